@@ -0,0 +1,97 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+from itertools import repeat
+from operator import truediv
+
+from sssm.utils import assert_true
+
+nan = float("nan")
+
+
+class StockUniverse(object):
+    """ dividend yield and P/E ratio calculations for many stocks and prices
+    at once, as Stock.calculate_dividend_yield and Stock.calculate_pe_ratio.
+
+    Each stock's dividend is worked out once, when the universe is created,
+    and results are returned as arrays of floats. A P/E ratio is NaN where
+    the scalar calculation would return None, i.e. for stocks without a
+    dividend, which can be tested for with math.isnan.
+    """
+
+    def __init__(self, stocks):
+        """ constructor
+
+        @param stocks - sequence of Stock objects
+        """
+        self.stocks = list(stocks)
+        self.names = [stock.get_name() for stock in self.stocks]
+        self.dividends = array("d", [stock.dividend() for stock in self.stocks])
+
+    def __len__(self):
+        return len(self.stocks)
+
+    def dividend_yields(self, prices):
+        """ return array of dividend yields for each stock at its price.
+
+        @param prices - sequence of prices in pennies, one per stock
+        """
+        self._validate_prices(prices, len(self))
+        return array("d", map(truediv, self.dividends, prices))
+
+    def pe_ratios(self, prices):
+        """ return array of P/E ratios for each stock at its price, NaN for
+        stocks without a dividend.
+
+        @param prices - sequence of prices in pennies, one per stock
+        """
+        self._validate_prices(prices, len(self))
+        return array("d", map(_pe_ratio, prices, self.dividends))
+
+    def dividend_yield_ladder(self, prices):
+        """ return list of arrays with the dividend yield of each stock at
+        every price.
+
+        @param prices - sequence of prices in pennies
+        """
+        self._validate_prices(prices)
+        return [array("d", map(truediv, repeat(dividend), prices))
+                for dividend in self.dividends]
+
+    def pe_ratio_ladder(self, prices):
+        """ return list of arrays with the P/E ratio of each stock at every
+        price, NaN for stocks without a dividend.
+
+        @param prices - sequence of prices in pennies
+        """
+        self._validate_prices(prices)
+        nans = array("d", [nan]) * len(prices)
+
+        return [array("d", map(truediv, prices, repeat(dividend)))
+                if dividend > 0 else array("d", nans)
+                for dividend in self.dividends]
+
+    def _validate_prices(self, prices, n=None):
+        """ validate the given prices, as Stock.validate_price
+
+        @param prices - sequence of prices in pennies
+        @param n - optional number of prices expected
+        """
+        assert_true(n is None or len(prices) == n,
+                    "expected %s prices, got %s", n, len(prices))
+
+        if len(prices):
+            lowest = min(prices)
+            assert_true(lowest > 0, "invalid price: %s", lowest)
+
+
+def _pe_ratio(price, dividend):
+    """ return P/E ratio for price and dividend, or NaN if no dividend
+
+    @param price - price in pennies
+    @param dividend - the stock's dividend
+    """
+    return price / dividend if dividend > 0 else nan
@@ -0,0 +1,314 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+from bisect import bisect_left
+from operator import mul
+
+from sssm.utils import assert_true
+
+_fmt = "bar(start=%s, open=%s, high=%s, low=%s, close=%s, volume=%s, vwap=%s)"
+
+
+class Bar(object):
+    """ open, high, low, close, volume and volume weighted average price of a
+    stock's trades over one interval """
+
+    def __init__(self, start, open_price, high, low, close, volume, amount):
+        """ constructor
+
+        @param start - start of the interval in microseconds
+        @param open_price - price of the first trade
+        @param high - highest price
+        @param low - lowest price
+        @param close - price of the last trade
+        @param volume - total quantity traded
+        @param amount - total of price * quantity
+        """
+        self.start = start
+        self.open = open_price
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.amount = amount
+
+    def __str__(self):
+
+        args = (
+            self.start,
+            self.open,
+            self.high,
+            self.low,
+            self.close,
+            self.volume,
+            self.get_vwap(),
+            )
+
+        return _fmt % args
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __eq__(self, other):
+
+        if not isinstance(other, Bar):
+            return NotImplemented
+
+        return vars(self) == vars(other)
+
+    def get_start(self):
+        return self.start
+
+    def get_open(self):
+        return self.open
+
+    def get_high(self):
+        return self.high
+
+    def get_low(self):
+        return self.low
+
+    def get_close(self):
+        return self.close
+
+    def get_volume(self):
+        return self.volume
+
+    def get_vwap(self):
+        return self.amount / self.volume
+
+
+class BucketSeries(object):
+    """ values summarizing a single stock's trades in buckets of equal length
+    of time, kept in order of bucket start time. Subclasses keep a column of
+    values per bucket alongside starts and implement add, _extend_bucket and
+    _columns.
+    """
+
+    def __init__(self, resolution):
+        """ constructor
+
+        @param resolution - length of each bucket in microseconds
+        """
+        assert_true(resolution > 0, "invalid resolution: %s", resolution)
+        self.resolution = resolution
+        self.starts = array("q")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, ts, price, quantity):
+        """ add a trade to the bucket for its time
+
+        @param ts - time of trade in microseconds
+        @param price - price traded at
+        @param quantity - quantity traded
+        """
+        raise NotImplementedError
+
+    def extend(self, timestamps, prices, quantities):
+        """ add trades given as equal length columns of values. A batch within
+        a single bucket, such as one from Market.record_trades, is added to it
+        in one go.
+
+        @param timestamps - sequence of times of trades in microseconds
+        @param prices - sequence of prices traded at
+        @param quantities - sequence of quantities traded
+        """
+
+        if not len(timestamps):
+            return
+
+        first, last = min(timestamps), max(timestamps)
+        start = first - first % self.resolution
+
+        if last - last % self.resolution != start:
+            for row in zip(timestamps, prices, quantities):
+                self.add(*row)
+
+            return
+
+        self._extend_bucket(start, first, last, timestamps, prices, quantities)
+
+    def evict(self, before):
+        """ remove buckets that end before the given time, returning the number
+        removed
+
+        @param before - time in microseconds
+        """
+        n = bisect_left(self.starts, before - self.resolution + 1)
+
+        if n:
+            for column in self._columns():
+                del column[:n]
+
+        return n
+
+    def _extend_bucket(self, start, first, last, timestamps, prices,
+                       quantities):
+        """ add trades that are all in the bucket starting at start, see
+        extend
+
+        @param start - start of the bucket in microseconds
+        @param first - time of first trade
+        @param last - time of last trade
+        @param timestamps - sequence of times of trades in microseconds
+        @param prices - sequence of prices traded at
+        @param quantities - sequence of quantities traded
+        """
+        raise NotImplementedError
+
+    def _columns(self):
+        """ return tuple of every column, starting with starts """
+        raise NotImplementedError
+
+    def _find(self, start):
+        """ return tuple of (index, found) of the bucket starting at start,
+        where index is where it would be inserted if it isn't found
+
+        @param start - start of the bucket in microseconds
+        """
+        starts = self.starts
+        n = len(starts)
+
+        if n and start == starts[-1]:
+            return n - 1, True
+
+        i = n if not n or start > starts[-1] else bisect_left(starts, start)
+        return i, i < n and starts[i] == start
+
+
+class BarSeries(BucketSeries):
+    """ bars for a single stock at one resolution, updated as trades are
+    recorded and stored column-wise in typed arrays in order of start time.
+
+    Trades normally arrive in time order, so a trade updates the last bar or
+    starts a new one. A late trade, e.g. if the clock has gone backwards, is
+    merged into the earlier bar it belongs in. The first and last trade times
+    of each bar are kept so that its open and close are those of the trades
+    that come first and last in the stock's TradeSeries.
+    """
+
+    def __init__(self, resolution):
+        """ constructor
+
+        @param resolution - length of each bar in microseconds
+        """
+        super().__init__(resolution)
+        self.firsts = array("q")  # time of first trade in bar
+        self.lasts = array("q")  # time of last trade in bar
+        self.opens = array("d")
+        self.highs = array("d")
+        self.lows = array("d")
+        self.closes = array("d")
+        self.volumes = array("d")
+        self.amounts = array("d")
+
+    def add(self, ts, price, quantity):
+        """ add a trade to the bar for its time
+
+        @param ts - time of trade in microseconds
+        @param price - price traded at
+        @param quantity - quantity traded
+        """
+        start = ts - ts % self.resolution
+        starts = self.starts
+
+        if starts and start == starts[-1] and ts >= self.lasts[-1]:
+            # the usual case of the next trade in the latest bar
+            self.lasts[-1] = ts
+            self.closes[-1] = price
+
+            if price > self.highs[-1]:
+                self.highs[-1] = price
+
+            if price < self.lows[-1]:
+                self.lows[-1] = price
+
+            self.volumes[-1] += quantity
+            self.amounts[-1] += price * quantity
+
+        else:
+            self._merge(start, ts, price, ts, price, price, price, quantity,
+                        price * quantity)
+
+    def get_bars(self, period=None):
+        """ return list of Bar objects for bars starting within period
+
+        @param period - optional tuple of (t1, t2) in microseconds, where
+          t1 <= start < t2 (default is all bars)
+        """
+        lo, hi = 0, len(self.starts)
+
+        if period:
+            lo = bisect_left(self.starts, period[0])
+            hi = bisect_left(self.starts, period[1], lo)
+
+        columns = (self.starts[lo:hi], self.opens[lo:hi], self.highs[lo:hi],
+                   self.lows[lo:hi], self.closes[lo:hi], self.volumes[lo:hi],
+                   self.amounts[lo:hi])
+        return [Bar(*row) for row in zip(*columns)]
+
+    def _extend_bucket(self, start, first, last, timestamps, prices,
+                       quantities):
+        """ merge trades that are all in the bar starting at start, see
+        BucketSeries.extend """
+
+        # open is the first trade at the first time, close the last one at the
+        # last time, as they are ordered in the TradeSeries
+        n = len(timestamps)
+        open_price = prices[list(timestamps).index(first)]
+        close_price = prices[n - 1 - list(reversed(timestamps)).index(last)]
+        self._merge(start, first, open_price, last, close_price, max(prices),
+                    min(prices), sum(quantities),
+                    sum(map(mul, prices, quantities)))
+
+    def _columns(self):
+        return (self.starts, self.firsts, self.lasts, self.opens, self.highs,
+                self.lows, self.closes, self.volumes, self.amounts)
+
+    def _merge(self, start, first, open_price, last, close_price, high, low,
+               volume, amount):
+        """ merge trades summarized by the given values into the bar starting
+        at start, creating it if there isn't one
+
+        @param start - start of the bar in microseconds
+        @param first - time of first trade
+        @param open_price - price of first trade
+        @param last - time of last trade
+        @param close_price - price of last trade
+        @param high - highest price
+        @param low - lowest price
+        @param volume - total quantity
+        @param amount - total of price * quantity
+        """
+        i, found = self._find(start)
+
+        if not found:
+            row = (start, first, last, open_price, high, low, close_price,
+                   volume, amount)
+
+            for column, value in zip(self._columns(), row):
+                column.insert(i, value)
+
+            return
+
+        if first < self.firsts[i]:
+            self.firsts[i] = first
+            self.opens[i] = open_price
+
+        if last >= self.lasts[i]:
+            self.lasts[i] = last
+            self.closes[i] = close_price
+
+        if high > self.highs[i]:
+            self.highs[i] = high
+
+        if low < self.lows[i]:
+            self.lows[i] = low
+
+        self.volumes[i] += volume
+        self.amounts[i] += amount
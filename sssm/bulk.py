@@ -0,0 +1,215 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+from contextlib import nullcontext
+import csv
+from itertools import islice
+from operator import le
+import os
+
+from sssm.journal import Journal, restore
+from sssm.market import _group_by_stock
+from sssm.utils import assert_true, Error, parse_number
+
+# A trade file is CSV with a header row naming these columns, one trade per
+# row, with the type as Trade.BUY / Trade.SELL and the timestamp as integer
+# microseconds since epoch. Quantities and prices are read back as ints or
+# floats as written, and whether the market can store them is left to it.
+# The binary format is that of journal.Journal.
+_fields = ("id", "stock", "type", "quantity", "price", "timestamp")
+_chunk_size = 10 ** 5  # number of trades parsed and loaded at a time
+
+
+def read_csv(source, chunk_size=_chunk_size):
+    """ yield trades from a CSV trade file in chunks of up to chunk_size, each
+    a tuple of (trade_ids, stocks, trade_types, quantities, prices,
+    timestamps) columns, as Market.load_trades but with a stock per trade.
+
+    @param source - path of file, or file object opened with newline=""
+    @param chunk_size - number of trades per chunk
+    """
+    assert_true(chunk_size > 0, "invalid chunk_size: %s", chunk_size)
+
+    with _open(source, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+
+        if header is None:
+            return
+
+        assert_true(tuple(header) == _fields, "invalid header: %s",
+                    ",".join(header))
+
+        while True:
+            rows = list(islice(reader, chunk_size))
+
+            if not rows:
+                return
+
+            yield _parse(rows, reader.line_num - len(rows) + 1)
+
+
+def load_csv(market, source, chunk_size=_chunk_size):
+    """ load every trade in a CSV trade file into market, whose stocks must
+    already have been added, keeping their ids and timestamps, and return
+    the number of trades loaded.
+
+    The file is parsed and loaded chunk_size trades at a time, so memory
+    used is bounded by the chunk size, not the size of the file. Each chunk
+    is validated as Market.record_trades, then loaded with one
+    Market.load_trades call per stock, and journaled if the market has a
+    journal. Trades for a stock are stored fastest in timestamp order, so
+    each stock's trades in a chunk are sorted by timestamp first if needed.
+    The market's ids are moved past the largest id loaded, see
+    Market.advance_ids.
+
+    @param market - Market object to load trades into
+    @param source - path of file, or file object opened with newline=""
+    @param chunk_size - number of trades to parse and load at a time
+    """
+    count = 0
+    max_id = -1
+
+    for trade_ids, stocks, trade_types, quantities, prices, timestamps \
+            in read_csv(source, chunk_size):
+        market.validate_trades(stocks, trade_types, quantities, prices)
+        columns = (trade_ids, trade_types, quantities, prices, timestamps)
+
+        for stock, stock_columns in _group_by_stock(stocks, columns):
+            stock_columns = _in_time_order(stock_columns)
+
+            if market.journal:
+                market.journal.extend(stock, *stock_columns)
+
+            market.load_trades(stock, *stock_columns)
+
+        count += len(trade_ids)
+        max_id = max(max_id, max(trade_ids))
+
+    market.advance_ids(max_id + 1)
+    return count
+
+
+def load_binary(market, path, chunk_size=_chunk_size):
+    """ load every trade in a binary trade file, as written by export_binary
+    or journal.Journal, into market, chunk_size trades at a time, see
+    journal.restore. Return the number of trades loaded.
+
+    @param market - Market object to load trades into
+    @param path - path of file
+    @param chunk_size - number of trades after which those read are loaded
+    """
+    return restore(market, path, chunk_size)
+
+
+def export_csv(trades, destination):
+    """ write trades to a CSV trade file as they are iterated over, e.g. from
+    Market.iter_tape, and return the number written
+
+    @param trades - iterable of Trade objects
+    @param destination - path of file, which is replaced, or file object
+      opened with newline=""
+    """
+    count = 0
+
+    with _open(destination, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(_fields)
+
+        for trade in trades:
+            writer.writerow((
+                trade.get_id(),
+                trade.get_stock(),
+                trade.get_trade_type(),
+                trade.get_quantity(),
+                trade.get_price(),
+                trade.get_timestamp(),
+                ))
+            count += 1
+
+    return count
+
+
+def export_binary(trades, path, chunk_size=_chunk_size):
+    """ write trades to a binary trade file as they are iterated over, e.g.
+    from Market.iter_tape, buffering chunk_size trades at a time, and return
+    the number written
+
+    @param trades - iterable of Trade objects
+    @param path - path of file, which is replaced
+    @param chunk_size - number of trades buffered before they are written
+    """
+    count = 0
+    open(path, "wb").close()
+
+    with Journal(path, commit_every=chunk_size, fsync=False) as journal:
+
+        for trade in trades:
+            journal.append(trade)
+            count += 1
+
+    return count
+
+
+def _open(source, mode):
+    """ return context manager giving a file object for source, opening and
+    closing the file if source is a path
+
+    @param source - path of file, or file object
+    @param mode - mode to open a path in
+    """
+
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, mode, newline="")
+
+    return nullcontext(source)
+
+
+def _parse(rows, line):
+    """ return tuple of columns of values parsed from rows of a CSV trade
+    file, see read_csv
+
+    @param rows - list of rows, each a list of strings
+    @param line - line number of the first row, for errors
+    """
+
+    if set(map(len, rows)) != {len(_fields)}:
+        i = next(i for i, row in enumerate(rows) if len(row) != len(_fields))
+        raise Error("invalid row at line %s: %s" % (line + i,
+                                                     ",".join(rows[i])))
+
+    trade_ids, stocks, trade_types, quantities, prices, timestamps = zip(*rows)
+
+    try:
+        return (
+            array("q", map(int, trade_ids)),
+            stocks,
+            array("b", map(int, trade_types)),
+            list(map(parse_number, quantities)),
+            list(map(parse_number, prices)),
+            array("q", map(int, timestamps)),
+            )
+
+    except (ValueError, OverflowError) as e:
+        raise Error("invalid value in lines %s to %s: %s" % (
+            line, line + len(rows) - 1, e
+            ))
+
+
+def _in_time_order(columns):
+    """ return columns of trades for one stock, as Market.load_trades,
+    sorted by timestamp if they are not already in order
+
+    @param columns - sequence of trade_ids, trade_types, quantities, prices
+      and timestamps columns
+    """
+    timestamps = columns[-1]
+
+    if all(map(le, timestamps, timestamps[1:])):
+        return columns
+
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+    return [[column[i] for i in order] for column in columns]
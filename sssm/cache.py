@@ -0,0 +1,112 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from collections import OrderedDict
+import threading
+import time
+
+from sssm.utils import assert_true
+
+
+def _monotonic_micros():
+    """ return monotonic clock time in microseconds """
+    return time.monotonic_ns() // 1000
+
+
+class ResultCache(object):
+    """ least recently used cache of query results, each stored with the
+    version of the data it was calculated from, so that a result is only
+    returned while the version is unchanged. Entries are also dropped once
+    they are older than the time to live, if there is one.
+
+    Queries over the default moving window, which ends now, are cached by
+    which snap length bucket now falls in, so a cached result may be for a
+    window that ended up to snap microseconds earlier.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, snap=1000):
+        """ constructor
+
+        @param max_size - maximum number of results to keep
+        @param ttl - optional time to live of results in microseconds
+        @param snap - length in microseconds of the time buckets that default
+          windows are cached by
+        """
+        assert_true(max_size > 0, "invalid max_size: %s", max_size)
+        assert_true(snap > 0, "invalid snap: %s", snap)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.snap = snap
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (version, value, expiry)
+        self._lock = threading.Lock()
+        self._clock = _monotonic_micros
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bucket(self, now):
+        """ return time bucket for a default window ending at now
+
+        @param now - time in microseconds
+        """
+        return now - now % self.snap
+
+    def get(self, key, version):
+        """ return tuple of (True, value) for the result cached for key at the
+        given version, or (False, None) if there isn't one
+
+        @param key - hashable key of the query
+        @param version - version of the data the query reads
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] == version and \
+                    (entry[2] is None or entry[2] > self._clock()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, version, value):
+        """ cache value as the result for key at the given version, evicting
+        the least recently used results if the cache is full
+
+        @param key - hashable key of the query
+        @param version - version of the data the query read
+        @param value - the result
+        """
+        expiry = None if self.ttl is None else self._clock() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (version, value, expiry)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ remove every result """
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ return dict of hits, misses, evictions and size """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                }
@@ -0,0 +1,37 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+
+
+class VirtualClock(object):
+    """ clock for a Market that only moves when it is set, e.g. by a
+    replay.Replay, so that trades are timestamped and default periods end at
+    a simulated time rather than the wall clock time. Called like
+    utils.micros_since_epoch to get the time.
+    """
+
+    def __init__(self, now=0):
+        """ constructor
+
+        @param now - starting time in microseconds since epoch
+        """
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, now):
+        """ set the time, which may be earlier than the current time
+
+        @param now - time in microseconds since epoch
+        """
+        self.now = now
+
+    def advance(self, micros):
+        """ move the time forward
+
+        @param micros - number of microseconds to move forward by
+        """
+        self.now += micros
@@ -0,0 +1,272 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+import fcntl
+from itertools import islice
+import os
+import threading
+import time
+
+from sssm.utils import advance_auto_increment, assert_true, \
+    reserve_auto_increment
+
+# default epoch of snowflake ids, 1 Jan 2026, in milliseconds since the epoch
+_snowflake_epoch = 1767225600000
+_persist_ahead = 1000  # milliseconds Snowflake reserves in its file at once
+
+
+class IdAllocator(object):
+    """ allocates unique ids to many threads without a shared lock on the hot
+    path. Each thread leases a block of ids from the source and hands them out
+    itself, only going back to the source, which is locked, once its block is
+    used up.
+
+    Ids from one thread are in ascending order, but as each thread has its own
+    block, ids from different threads interleave only roughly in time order.
+    The source decides whether ids are unique across processes and restarts,
+    see LocalCounter, FileCounter and Snowflake.
+
+    After trades with existing ids are loaded, advance moves a source that
+    supports it past them. Ids below that which threads had already leased
+    are skipped.
+    """
+
+    def __init__(self, source=None, block_size=1024):
+        """ constructor
+
+        @param source - optional source of blocks of ids (default is a
+          LocalCounter)
+        @param block_size - number of ids each thread leases at a time
+        """
+        assert_true(block_size > 0, "invalid block_size: %s", block_size)
+        self.source = LocalCounter() if source is None else source
+        self.block_size = block_size
+        self._floor = 0  # ids leased below this are skipped, see advance
+        self._local = threading.local()
+
+    def next_id(self):
+        """ return the next id for this thread """
+        floor = self._floor
+
+        while True:
+
+            try:
+                trade_id = next(self._local.block)
+
+            except (AttributeError, StopIteration):
+                self._local.block = iter(self.source.lease(self.block_size))
+                continue
+
+            if trade_id >= floor:
+                return trade_id
+
+    def reserve(self, n):
+        """ return list of the next n ids for this thread, e.g. for a batch of
+        trades, which are ascending but may not be consecutive
+
+        @param n - number of ids
+        """
+        local = self._local
+        floor = self._floor
+        block = getattr(local, "block", iter(()))
+        ids = [i for i in islice(block, n) if i >= floor]
+
+        while len(ids) < n:
+            block = iter(self.source.lease(max(self.block_size,
+                                               n - len(ids))))
+            ids.extend(i for i in islice(block, n - len(ids)) if i >= floor)
+
+        local.block = block
+        return ids
+
+    def advance(self, value):
+        """ make sure ids continue from at least value, e.g. after loading
+        trades with existing ids, if the source supports it. Snowflake ids
+        are unique by time and worker, so aren't advanced.
+
+        @param value - lowest value for the next id
+        """
+        advance = getattr(self.source, "advance", None)
+
+        if advance is not None:
+            advance(value)
+            self._floor = max(self._floor, value)
+
+
+class LocalCounter(object):
+    """ source of ids from the process wide auto incrementing integer, see
+    utils.auto_increment, so ids are only unique within the process """
+
+    def lease(self, n):
+        """ return range of the next n ids
+
+        @param n - number of ids
+        """
+        return reserve_auto_increment(n)
+
+    def advance(self, value):
+        """ make sure ids continue from at least value, see
+        utils.advance_auto_increment
+
+        @param value - lowest value for the next id
+        """
+        advance_auto_increment(value)
+
+
+class FileCounter(object):
+    """ source of ids from a counter persisted in a local file, so ids are
+    unique across every process leasing from the same file, and across
+    restarts. Each lease locks the file, reads the next id and writes it back
+    moved past the ids leased, so processes never wait on each other for
+    longer than that, and ids leased but not used by a process that stops
+    are skipped.
+    """
+
+    def __init__(self, path, fsync=False):
+        """ constructor
+
+        @param path - path of counter file, which is created if need be
+        @param fsync - sync the file to disk on each lease, so ids stay
+          unique after a power cut as well as a restart
+        """
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+
+    def lease(self, n):
+        """ return range of the next n ids
+
+        @param n - number of ids
+        """
+
+        with self._lock, open(self.path, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                f.seek(0)
+                start = int(f.read() or 0)
+                f.seek(0)
+                f.truncate()
+                f.write(b"%d" % (start + n))
+                f.flush()
+
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return range(start, start + n)
+
+    def advance(self, value):
+        """ make sure ids continue from at least value, e.g. after loading
+        trades with existing ids
+
+        @param value - lowest value for the next id
+        """
+        lease = self.lease(0)
+
+        if lease.start < value:
+            self.lease(value - lease.start)
+
+
+class Snowflake(object):
+    """ source of snowflake ids, each made up of the time in milliseconds
+    since an epoch, a worker id, e.g. of the shard or process, and a sequence
+    number within the millisecond, from the most to least significant bits.
+    Ids are unique across workers without any coordination between them, are
+    time ordered across workers to the millisecond and, with the default
+    widths of 41, 10 and 12 bits, fit in a signed 64 bit integer, as a
+    journal stores them, until 2095.
+
+    If the clock goes backwards or the sequence runs out within a millisecond,
+    ids are taken from the last millisecond used or the next one, so they
+    stay unique and ascending. If a path is given, this still holds after a
+    restart: a limit a second ahead of the last millisecond used is persisted
+    there each time it is reached, and a restarted source starts from it.
+    """
+
+    def __init__(self, worker_id, worker_bits=10, sequence_bits=12,
+                 epoch=_snowflake_epoch, path=None):
+        """ constructor
+
+        @param worker_id - id of this worker, unique among the workers
+        @param worker_bits - number of bits for the worker id
+        @param sequence_bits - number of bits for the sequence number
+        @param epoch - time ids count from in milliseconds since the epoch
+        @param path - optional path of file to persist the limit of the
+          milliseconds used in
+        """
+        assert_true(0 <= worker_id < 1 << worker_bits, "invalid worker_id: %s",
+                    worker_id)
+        self.worker_id = worker_id
+        self.worker_bits = worker_bits
+        self.sequence_bits = sequence_bits
+        self.epoch = epoch
+        self.path = path
+        self.last = -1  # last millisecond ids were leased in
+        self.sequence = 0  # next sequence number in the last millisecond
+        self.limit = None  # millisecond persisted, which hasn't been used
+        self._lock = threading.Lock()
+        self._clock = time.time
+
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.last = self.limit = int(f.read())
+
+    def lease(self, n):
+        """ return range of up to n ids from the same millisecond, fewer if
+        the millisecond's sequence numbers run out
+
+        @param n - number of ids
+        """
+        capacity = 1 << self.sequence_bits
+
+        with self._lock:
+            now = int(self._clock() * 1000) - self.epoch
+
+            if now > self.last:
+                self.last = now
+                self.sequence = 0
+
+            elif self.sequence == capacity:
+                self.last += 1
+                self.sequence = 0
+
+            if self.path is not None and \
+                    (self.limit is None or self.last >= self.limit):
+                self._persist(self.last + _persist_ahead)
+
+            start = self.sequence
+            self.sequence = min(capacity, start + n)
+            base = ((self.last << self.worker_bits) | self.worker_id) << \
+                self.sequence_bits
+
+        return range(base + start, base + self.sequence)
+
+    def split(self, snowflake_id):
+        """ return tuple of (milliseconds since epoch, worker id, sequence
+        number) the given id is made up of
+
+        @param snowflake_id - id from this source
+        """
+        sequence = snowflake_id & ((1 << self.sequence_bits) - 1)
+        rest = snowflake_id >> self.sequence_bits
+        worker_id = rest & ((1 << self.worker_bits) - 1)
+        return (rest >> self.worker_bits) + self.epoch, worker_id, sequence
+
+    def _persist(self, limit):
+        """ write limit to the file, so that no id from it or later is used
+        until it has been restarted from. The lock must be held.
+
+        @param limit - time in milliseconds since self.epoch
+        """
+        temp = "%s.%d.tmp" % (self.path, os.getpid())
+
+        with open(temp, "wb") as f:
+            f.write(b"%d" % limit)
+
+        os.replace(temp, self.path)
+        self.limit = limit
@@ -0,0 +1,241 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from collections import defaultdict
+from contextlib import nullcontext
+import heapq
+import math
+import threading
+
+
+def all_share_index(log_sum, zeros, count):
+    """ return all share index from the sum of the logs of the non-zero
+    volume weighted stock prices, the number of zero ones and the number of
+    stocks, or None if there are no stocks.
+
+    @param log_sum - sum of log(vwsp) for non-zero vwsps
+    @param zeros - number of zero vwsps
+    @param count - total number of vwsps
+    """
+
+    if not count:
+        return None
+
+    if zeros:
+        return 0.0
+
+    return math.exp(log_sum / count)
+
+
+class MovingWindow(object):
+    """ values for each stock over a moving window ending now, maintained
+    incrementally.
+
+    A stock's values only change when it trades or when one of its trades
+    enters or leaves the window, so only stocks marked as traded since the
+    last read, or whose next change time the window has moved past, are
+    recalculated when it is read. Subclasses implement _refresh, which
+    recalculates one stock and returns the times at which its values next
+    change, typically from _change_times.
+
+    Reads are serialized by holding self._lock around _advance, and each
+    stock's trades are read under its lock if locks are given. Trades may be
+    recorded and stocks marked as traded from other threads during a read.
+    """
+
+    def __init__(self, series, window, locks=None):
+        """ constructor
+
+        @param series - dict of stock name -> TradeSeries, shared with the
+          market so that new stocks are seen
+        @param window - length of the moving window in microseconds
+        @param locks - optional dict of stock name -> lock guarding its
+          TradeSeries, shared with the market
+        """
+        self.series = series
+        self.window = window
+        self.locks = defaultdict(nullcontext) if locks is None else locks
+        self.now = None
+        self._dirty = set()  # stocks traded since the values were last read
+        self._expiry = []  # heap of (time, stock name), see _schedule
+        self._scheduled = {}  # stock name -> time of its live heap entry
+        self._lock = threading.Lock()
+
+    def touch(self, name):
+        """ mark stock as traded so it is recalculated on the next read
+
+        @param name - name of the stock
+        """
+        self._dirty.add(name)
+
+    def _advance(self, now):
+        """ recalculate the stocks whose values have changed by now. The lock
+        must be held.
+
+        @param now - end of the window in microseconds
+        """
+
+        if self.now is None or now < self.now:
+            self._rebuild(now)
+
+        self.now = now
+        dirty = self._dirty
+
+        # only refresh stocks traded before the read started, as writers may
+        # keep marking stocks as traded and would otherwise starve the read
+        for _ in range(len(dirty)):
+            name = dirty.pop()
+            self._schedule(name, self._refresh(name, now))
+
+        expiry = self._expiry
+
+        while expiry and expiry[0][0] < now:
+            t, name = heapq.heappop(expiry)
+
+            if self._scheduled.get(name) == t:
+                del self._scheduled[name]
+                self._schedule(name, self._refresh(name, now))
+
+    def _rebuild(self, now):
+        """ recalculate every stock, e.g. if the clock has gone backwards
+
+        @param now - end of the window in microseconds
+        """
+        self._dirty.clear()
+        self._expiry = []
+        self._scheduled.clear()
+
+        for name in list(self.series):
+            self._schedule(name, self._refresh(name, now))
+
+    def _refresh(self, name, now):
+        """ recalculate the values of the named stock for the window ending at
+        now and return list of times at which they next change
+
+        @param name - name of the stock
+        @param now - end of the window in microseconds
+        """
+        raise NotImplementedError
+
+    def _schedule(self, name, times):
+        """ schedule the named stock to be recalculated once the window has
+        moved past the earliest of the given times.
+
+        @param name - name of the stock
+        @param times - list of times at which the stock's values next change
+        """
+
+        if times:
+            t = min(times)
+            self._scheduled[name] = t
+            heapq.heappush(self._expiry, (t, name))
+
+        else:
+            self._scheduled.pop(name, None)
+
+
+class AllShareIndex(MovingWindow):
+    """ GBCE all share index over a moving window ending now, maintained
+    incrementally, see MovingWindow.
+
+    The index is the geometric mean of each stock's volume weighted stock
+    price, kept as a running sum of their logs so that it cannot overflow.
+    """
+
+    def __init__(self, series, window, locks=None):
+        """ constructor, see MovingWindow """
+        super().__init__(series, window, locks)
+        self.vwsps = {}  # stock name -> vwsp for stocks with trades in window
+        self.log_sum = 0.0  # sum of log(vwsp) for non-zero vwsps
+        self.zeros = 0  # number of zero vwsps
+        self._updates = 0  # updates to log_sum since it was last summed
+
+    def value(self, now):
+        """ return all share index for the window ending at now, or None if no
+        stock has traded in it.
+
+        @param now - end of the window in microseconds
+        """
+        return all_share_index(*self.terms(now))
+
+    def terms(self, now):
+        """ return tuple of (log_sum, zeros, count) terms of the index for the
+        window ending at now, see all_share_index. Terms from separate indexes
+        over different stocks can be added together.
+
+        @param now - end of the window in microseconds
+        """
+
+        with self._lock:
+            self._advance(now)
+            return self.log_sum, self.zeros, len(self.vwsps)
+
+    def _refresh(self, name, now):
+        """ recalculate vwsp of the named stock for the window ending at now,
+        update the running log sum and return the times it next changes.
+
+        @param name - name of the stock
+        @param now - end of the window in microseconds
+        """
+        series = self.series[name]
+
+        with self.locks[name]:
+            lo, hi = series.span((now - self.window, now))
+            amount, quantity = series.totals(lo, hi)
+            times = self._change_times(series, lo, hi)
+
+        old = self.vwsps.pop(name, None)
+
+        if old is not None:
+            self._update(old, -1)
+
+        if lo < hi:
+            vwsp = float(amount) / quantity
+            self.vwsps[name] = vwsp
+            self._update(vwsp, 1)
+
+        return times
+
+    def _update(self, vwsp, sign):
+        """ add (sign=1) or remove (sign=-1) vwsp from the running log sum,
+        which must already be reflected in self.vwsps. The sum is recalculated
+        exactly every so often so rounding errors don't build up.
+
+        @param vwsp - the stock's vwsp
+        @param sign - 1 or -1
+        """
+
+        if vwsp == 0:
+            self.zeros += sign
+            return
+
+        self._updates += 1
+
+        if self._updates > max(len(self.vwsps), 1024):
+            self._updates = 0
+            logs = [math.log(v) for v in self.vwsps.values() if v != 0]
+            self.log_sum = math.fsum(logs)
+
+        else:
+            self.log_sum += sign * math.log(vwsp)
+
+    def _change_times(self, series, lo, hi):
+        """ return list of times at which the trades in the window next change,
+        i.e. when the first trade in the window leaves it or the first trade
+        after the window enters it.
+
+        @param series - the stock's TradeSeries
+        @param lo - index of first trade in window
+        @param hi - index after last trade in window
+        """
+        times = []
+
+        if lo < hi:
+            times.append(series.timestamps[lo] + self.window)
+
+        if hi < len(series):
+            times.append(series.timestamps[hi])
+
+        return times
@@ -0,0 +1,162 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+import heapq
+from itertools import count
+import threading
+
+from sssm.market import _group_by_stock
+from sssm.utils import assert_true
+
+
+class Ingestor(object):
+    """ ingestion stage for trades that already have ids and timestamps, e.g.
+    from several venues or a replayed feed, which may arrive out of
+    timestamp order.
+
+    Trades are held back until the watermark, the latest timestamp seen less
+    the allowed lateness, has passed them, then released to the market in
+    timestamp order with Market.load_trades, and journaled first if the
+    market has a journal. Every trade released is at or after every trade
+    released before it, so each stock's trades are appended in bulk rather
+    than inserted into the middle of its series, and the market's index,
+    bars, cached results and subscribers are updated as for any other trades
+    stored.
+
+    Released trades can be loaded in batches, trading how soon they are seen
+    by queries for fewer, larger loads.
+
+    A trade that arrives with a timestamp before the watermark is too late to
+    be released in order. It goes to the side channel instead: the late
+    callback if there is one, otherwise the late_trades list.
+    """
+
+    def __init__(self, market, lateness, late=None, batch_size=1):
+        """ constructor
+
+        @param market - Market object to release trades to, whose stocks must
+          already have been added
+        @param lateness - time in microseconds a trade may arrive after a
+          later one and still be stored in order
+        @param late - optional function called as late(trade) with each trade
+          that arrives too late (default is to add it to late_trades)
+        @param batch_size - number of released trades loaded into the market
+          at a time
+        """
+        assert_true(lateness >= 0, "invalid lateness: %s", lateness)
+        assert_true(batch_size > 0, "invalid batch_size: %s", batch_size)
+        self.market = market
+        self.lateness = lateness
+        self.late = late
+        self.late_trades = []
+        self.batch_size = batch_size
+        self.watermark = None  # no trade before this is accepted
+        self._pending = []  # heap of (timestamp, sequence, trade)
+        self._released = []  # trades released but not yet loaded, in order
+        self._sequence = count()  # keeps arrival order of equal timestamps
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending) + len(self._released)
+
+    def submit(self, trade):
+        """ accept trade, releasing it and any others the watermark has
+        passed to the market, and return True, or send it to the side channel
+        and return False if it is too late. The trade is validated as
+        Market.record_trade.
+
+        @param trade - Trade object
+        """
+        self.market.validate_trade(trade.get_stock(), trade.get_trade_type(),
+                                   trade.get_quantity(), trade.get_price())
+        ts = trade.get_timestamp()
+
+        with self._lock:
+            watermark = self.watermark
+
+            if watermark is not None and ts < watermark:
+                accepted = False
+
+            else:
+                accepted = True
+                heapq.heappush(self._pending, (ts, next(self._sequence),
+                                               trade))
+
+                if watermark is None or ts - self.lateness > watermark:
+                    self.watermark = ts - self.lateness
+                    self._release(self.watermark)
+
+        if not accepted:
+
+            if self.late is None:
+                self.late_trades.append(trade)
+
+            else:
+                self.late(trade)
+
+        return accepted
+
+    def extend(self, trades):
+        """ submit each of the given trades, returning the number accepted
+
+        @param trades - iterable of Trade objects
+        """
+        return sum(map(self.submit, trades))
+
+    def flush(self):
+        """ release and load every trade held back, e.g. at the end of a feed.
+        The watermark moves up to the latest trade released. """
+
+        with self._lock:
+
+            if self._pending:
+                latest = max(self._pending)[0]
+                self.watermark = max(self.watermark, latest)
+                self._release(latest)
+
+            self._load()
+
+    def _release(self, until):
+        """ release the trades held back with timestamps up to until, in
+        timestamp order, and load them once there is a batch of them. The
+        lock must be held.
+
+        @param until - time in microseconds
+        """
+        pending = self._pending
+        released = self._released
+
+        while pending and pending[0][0] <= until:
+            released.append(heapq.heappop(pending)[2])
+
+        if len(released) >= self.batch_size:
+            self._load()
+
+    def _load(self):
+        """ load the released trades into the market. The lock must be held.
+        """
+        trades = self._released
+
+        if not trades:
+            return
+
+        self._released = []
+        columns = (
+            [trade.get_id() for trade in trades],
+            [trade.get_trade_type() for trade in trades],
+            [trade.get_quantity() for trade in trades],
+            [trade.get_price() for trade in trades],
+            [trade.get_timestamp() for trade in trades],
+            )
+        stocks = [trade.get_stock() for trade in trades]
+
+        for stock, stock_columns in _group_by_stock(stocks, columns):
+
+            if self.market.journal:
+                self.market.journal.extend(stock, *stock_columns)
+
+            self.market.load_trades(stock, *stock_columns)
+
+        self.market.advance_ids(max(columns[0]) + 1)
@@ -0,0 +1,395 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from sssm.utils import assert_true, Error
+
+# A journal file is the magic bytes followed by blocks of trades for a single
+# stock. Each block is a header giving the number of trades n and the stock
+# name, followed by the trades' fixed width fields stored a column at a time:
+# n ids, n types, n quantities, n prices then n timestamps, in the order of
+# Market.load_trades arguments. Everything is little endian.
+
+_magic = b"SSSMJNL1"
+_header = struct.Struct("<IH")  # number of trades, length of stock name
+_typecodes = ("q", "b", "q", "d", "q")  # id, type, quantity, price, timestamp
+_widths = [array(typecode).itemsize for typecode in _typecodes]
+_record_size = sum(_widths)
+_swap = sys.byteorder != "little"
+
+
+class Journal(object):
+    """ append-only binary journal of trades, so that a market can be
+    restored after a restart with restore().
+
+    Trades are buffered by stock and written as a block per stock when the
+    journal is committed. Committing flushes the file and, unless fsync is
+    False, syncs it to disk. By default every trade is committed as it is
+    journaled. Group commit trades durability of the last few trades for
+    fewer, larger writes, and larger blocks, which are faster to restore.
+    With a commit interval, a background thread commits trades that have
+    been buffered for that long, so they aren't left unwritten while no more
+    trades are journaled.
+
+    Ids, quantities and timestamps must be integers that fit in 64 bits;
+    trades that don't are rejected with Error, leaving the buffered trades
+    unchanged.
+    """
+
+    def __init__(self, path, commit_every=1, commit_interval=None,
+                 fsync=True):
+        """ constructor
+
+        @param path - path of journal file, which is appended to if it exists.
+          A partly written block or magic bytes at the end of it, e.g. left
+          by a crash, are truncated first.
+        @param commit_every - commit once this many trades are buffered
+        @param commit_interval - optional time in seconds after which buffered
+          trades are committed, whether or not more trades are journaled
+        @param fsync - sync file to disk on commit
+        """
+        assert_true(commit_every > 0, "invalid commit_every: %s", commit_every)
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        size = _complete_size(path)
+        self.file = open(path, "ab")
+
+        # drop a partly written block, so new blocks follow a complete one
+        if size < self.file.tell():
+            self.file.truncate(size)
+
+        if size == 0:
+            self.file.write(_magic)
+
+        self._blocks = {}  # stock name -> tuple of column arrays
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._committer = None
+
+        if commit_interval is not None:
+            self._committer = threading.Thread(target=self._commit_on_interval,
+                                               daemon=True)
+            self._committer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, trade):
+        """ journal the given trade
+
+        @param trade - the Trade object
+        """
+        values = (
+            trade.get_id(),
+            trade.get_trade_type(),
+            trade.get_quantity(),
+            trade.get_price(),
+            trade.get_timestamp(),
+            )
+
+        with self._lock:
+            done = []
+
+            try:
+                for column, value in zip(self._block(trade.get_stock()),
+                                         values):
+                    column.append(value)
+                    done.append(column)
+
+            except (TypeError, OverflowError) as e:
+                # leave the buffered columns the same length
+                for column in done:
+                    column.pop()
+
+                raise Error("invalid trade for journal: %s" % e)
+
+            self._pending += 1
+            self._maybe_commit()
+
+    def extend(self, stock, trade_ids, trade_types, quantities, prices,
+               timestamps):
+        """ journal trades for the given stock given as equal length columns of
+        values, as Market.load_trades
+
+        @param stock - name of the stock
+        @param trade_ids - sequence of unique trade ids
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        @param timestamps - sequence of integer timestamps
+        """
+        values = (trade_ids, trade_types, quantities, prices, timestamps)
+
+        if not len(trade_ids):
+            return
+
+        # convert every column before buffering any, so a bad value can't
+        # leave them different lengths
+        try:
+            values = [array(typecode, column_values)
+                      for typecode, column_values in zip(_typecodes, values)]
+
+        except (TypeError, OverflowError) as e:
+            raise Error("invalid trades for journal: %s" % e)
+
+        with self._lock:
+
+            for column, column_values in zip(self._block(stock), values):
+                column.extend(column_values)
+
+            self._pending += len(trade_ids)
+            self._maybe_commit()
+
+    def commit(self):
+        """ write buffered trades to the file, flush it and sync it to disk """
+
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """ commit buffered trades and close the file """
+        self._closing.set()
+
+        if self._committer is not None:
+            self._committer.join()
+
+        if not self.file.closed:
+            self.commit()
+            self.file.close()
+
+    def _block(self, stock):
+        """ return tuple of column arrays buffering trades for stock
+
+        @param stock - name of the stock
+        """
+        block = self._blocks.get(stock)
+
+        if block is None:
+            block = tuple(array(typecode) for typecode in _typecodes)
+            self._blocks[stock] = block
+
+        return block
+
+    def _maybe_commit(self):
+        """ commit if enough trades are buffered or enough time has passed """
+
+        if self._pending >= self.commit_every:
+            self._commit()
+
+        elif self.commit_interval is not None and \
+                time.monotonic() - self._last_commit >= self.commit_interval:
+            self._commit()
+
+    def _commit_on_interval(self):
+        """ commit buffered trades once commit_interval has passed since the
+        last commit, until the journal is closed. Run by a background thread.
+        """
+
+        while True:
+            delay = self._last_commit + self.commit_interval - time.monotonic()
+
+            if self._closing.wait(max(delay, 0)):
+                return
+
+            with self._lock:
+
+                if time.monotonic() - self._last_commit < self.commit_interval:
+                    continue
+
+                if self._pending:
+                    self._commit()
+
+                else:
+                    self._last_commit = time.monotonic()
+
+    def _commit(self):
+        """ commit, see commit. The lock must be held. """
+        chunks = []
+
+        for stock, columns in self._blocks.items():
+            name = stock.encode()
+            chunks.append(_header.pack(len(columns[0]), len(name)))
+            chunks.append(name)
+
+            for column in columns:
+
+                if _swap:
+                    column.byteswap()
+
+                chunks.append(column.tobytes())
+
+        self.file.write(b"".join(chunks))
+        self.file.flush()
+
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+        self._blocks = {}
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+
+def restore(market, path, chunk_size=None):
+    """ load every trade in the journal at path into market, whose stocks
+    must already have been added, and return the number of trades loaded.
+
+    The file is memory mapped and the columns of every block for a stock are
+    joined up and copied straight into arrays, which are loaded with one
+    Market.load_trades call per stock, so a columnar market restores without
+    creating any Trade objects. A partly written block at the end of the
+    file is ignored. The market's ids are moved past the largest id loaded,
+    see Market.advance_ids.
+
+    @param market - Market object to load trades into
+    @param path - path of journal file
+    @param chunk_size - optional number of trades after which the blocks read
+      so far are loaded, to bound the memory used for a large file (default
+      is to load them all at once)
+    """
+    count = 0
+    max_id = -1
+
+    with open(path, "rb") as f:
+
+        if os.fstat(f.fileno()).st_size <= len(_magic):
+            return 0
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            assert_true(m[:len(_magic)] == _magic, "not a journal: %s", path)
+            blocks = {}  # stock name -> list of (offset, n) of its blocks
+            pending = 0
+
+            for stock, offset, n in _blocks(m):
+                blocks.setdefault(stock, []).append((offset, n))
+                pending += n
+
+                if chunk_size is not None and pending >= chunk_size:
+                    max_id = max(max_id, _load(market, m, blocks))
+                    count += pending
+                    blocks = {}
+                    pending = 0
+
+            max_id = max(max_id, _load(market, m, blocks))
+            count += pending
+
+    market.advance_ids(max_id + 1)
+    return count
+
+
+def _load(market, m, blocks):
+    """ load the trades in the given blocks into market, returning the
+    largest id loaded, or -1 if none
+
+    @param market - Market object to load trades into
+    @param m - mmap of whole journal file
+    @param blocks - dict of stock name -> list of (offset, n) of its blocks
+    """
+    max_id = -1
+
+    for stock, stock_blocks in blocks.items():
+        columns = _columns(m, stock_blocks)
+        market.load_trades(stock, *columns)
+        max_id = max(max_id, max(columns[0]))
+
+    return max_id
+
+
+def _complete_size(path):
+    """ return size of the journal at path up to the end of its last complete
+    block, which is less than the size of the file if a block was partly
+    written, or 0 if the file is empty, holds only part of the magic bytes
+    or doesn't exist
+
+    @param path - path of journal file
+    """
+
+    try:
+        f = open(path, "rb")
+
+    except FileNotFoundError:
+        return 0
+
+    with f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size < len(_magic):
+            head = f.read()
+            assert_true(_magic.startswith(head), "not a journal: %s", path)
+            return 0
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            assert_true(m[:len(_magic)] == _magic, "not a journal: %s", path)
+            end = len(_magic)
+
+            for stock, offset, n in _blocks(m):
+                end = offset + n * _record_size
+
+            return end
+
+
+def _blocks(m):
+    """ yield (stock, offset, n) for each complete block in journal, where n
+    trades start at offset
+
+    @param m - mmap of whole journal file
+    """
+    offset = len(_magic)
+    size = len(m)
+
+    while offset + _header.size <= size:
+        n, name_length = _header.unpack_from(m, offset)
+        offset += _header.size
+
+        if offset + name_length > size:
+            break
+
+        stock = m[offset:offset + name_length].decode()
+        offset += name_length
+
+        if offset + n * _record_size > size:
+            break
+
+        yield stock, offset, n
+        offset += n * _record_size
+
+
+def _columns(m, blocks):
+    """ return tuple of id, type, quantity, price and timestamp arrays for
+    the trades in the given blocks
+
+    @param m - mmap of whole journal file
+    @param blocks - list of (offset, n) of blocks
+    """
+    columns = []
+    start = 0  # offset of column in each block, per trade
+
+    for typecode, width in zip(_typecodes, _widths):
+        column = array(typecode)
+        column.frombytes(b"".join(
+            m[offset + n * start:offset + n * (start + width)]
+            for offset, n in blocks
+            ))
+
+        if _swap:
+            column.byteswap()
+
+        columns.append(column)
+        start += width
+
+    return tuple(columns)
@@ -3,32 +3,181 @@ Created on 10 Apr 2018
 
 @author: conor
 '''
+from array import array
+from contextlib import nullcontext
+import heapq
+from itertools import accumulate, count, islice
+import math
+import threading
+
+from sssm.bars import BarSeries
+from sssm.cache import ResultCache
+from sssm.index import AllShareIndex, all_share_index
+from sssm.metrics import Metrics, dump_prometheus, instrument, uninstrument
+from sssm.rankings import Rankings, _measures
+from sssm.series import TradeSeries, ColumnarTradeSeries
+from sssm.sketch import QuantileSeries
+from sssm.subscriptions import Subscription, Subscriptions
+from sssm.symbols import SymbolTable
 from sssm.trade import Trade
 from sssm.utils import micros_since_epoch, auto_increment, geometric_mean, \
-    assert_true
+    assert_true, reserve_auto_increment, advance_auto_increment, Error
 
 _five_minutes = (300 * (10 ** 6))  # five minutes in microseconds
+_trade_types = frozenset([Trade.BUY, Trade.SELL])
+_lock_stripes = 64  # number of locks shared between stocks in concurrent mode
+_chunk_size = 256  # number of trades fetched at a time by iter_trades
+_quantiles = (0.01, 0.5, 0.99)  # default fractions for get_quantiles
 
 
-def _default_period():
-    now = micros_since_epoch()
+def _default_period(now):
     return (now - _five_minutes, now)
 
 
+def _samples(start, end, step, window):
+    """ return number of sample times from start, every step, before end
+
+    @param start - time of first sample in microseconds
+    @param end - time after last sample in microseconds
+    @param step - time between samples in microseconds
+    @param window - length of window before each sample in microseconds
+    """
+    assert_true(step > 0, "invalid step: %s", step)
+    assert_true(window > 0, "invalid window: %s", window)
+    return max(0, int(-((start - end) // step)))
+
+
+def _tape_order(trade):
+    return trade.get_timestamp(), trade.get_id()
+
+
+def _group_by_stock(stocks, columns):
+    """ return list of (stock, columns) tuples, splitting the given columns of
+    values into one set of columns per stock
+
+    @param stocks - sequence of stock names
+    @param columns - tuple of sequences of values, the same length as stocks
+    """
+    rows = {}
+
+    for i, stock in enumerate(stocks):
+        rows.setdefault(stock, []).append(i)
+
+    if len(rows) == 1:
+        return [(stocks[0], columns)]
+
+    return [(stock, [[column[i] for i in indices] for column in columns])
+            for stock, indices in rows.items()]
+
+
 class Market(object):
 
-    def __init__(self):
+    def __init__(self, columnar=False, retention=None, archiver=None,
+                 concurrent=False, journal=None, metrics=False,
+                 bar_resolutions=None, cache=None, clock=None, ids=None,
+                 sketch_resolution=None):
+        """ constructor
+
+        @param columnar - store trades in typed arrays rather than as Trade
+          objects, trading slower get_trades calls for much less memory
+        @param retention - optional time in microseconds to keep trades for
+          (default is to keep all trades). Older trades are evicted in bulk,
+          so up to twice this amount may be held.
+        @param archiver - optional function called as archiver(stock, trades)
+          with each list of evicted trades
+        @param concurrent - make the market safe to use from multiple threads.
+          Each stock is guarded by one of a fixed set of locks, so threads
+          recording trades for different stocks rarely contend, and readers
+          only hold a stock's lock for the binary search of its trades.
+        @param journal - optional journal.Journal object to write each trade
+          to before it is stored, see journal.restore
+        @param metrics - time calls of the main methods from the start, see
+          enable_metrics
+        @param bar_resolutions - optional sequence of bar lengths in
+          microseconds, e.g. (10 ** 6, 60 * 10 ** 6), at which OHLCV bars are
+          kept for each stock as trades are stored, see get_bars
+        @param cache - optional cache.ResultCache object, or True for one with
+          default settings, to cache calculate_vwsp and calculate_gbce_asi
+          results in until trades are stored or evicted
+        @param clock - optional function returning the time in microseconds,
+          e.g. a clock.VirtualClock, used to timestamp trades and for periods
+          ending now (default is utils.micros_since_epoch)
+        @param ids - optional ids.IdAllocator to give new trades ids from
+          (default is utils.auto_increment)
+        @param sketch_resolution - optional bucket length in microseconds,
+          e.g. 10 ** 6, at which quantile sketches of trade prices and sizes
+          are kept for each stock as trades are stored, see get_quantiles
+        """
+        assert_true(retention is None or retention > 0,
+                    "invalid retention: %s", retention)
+        resolution = min(bar_resolutions or [1])
+        assert_true(resolution > 0, "invalid resolution: %s", resolution)
+        assert_true(sketch_resolution is None or sketch_resolution > 0,
+                    "invalid resolution: %s", sketch_resolution)
+
         self.stocks = {}
-        self.trades = []
+        self.symbols = SymbolTable()  # stock names and their ids
+        self.trades = {}  # stock name -> TradeSeries
+        self.retention = retention
+        self.archiver = archiver
+        self.journal = journal
+        self.clock = clock or micros_since_epoch
+        self.ids = ids
+        self._next_id = auto_increment if ids is None else ids.next_id
+        self._reserve_ids = reserve_auto_increment if ids is None else \
+            ids.reserve
+        self.bar_resolutions = tuple(sorted(set(bar_resolutions or ())))
+        self.bars = {}  # stock name -> {resolution -> BarSeries}
+        self.sketch_resolution = sketch_resolution
+        self.sketches = {}  # stock name -> QuantileSeries
+        self.cache = ResultCache() if cache is True else cache
+        self._versions = {}  # stock name -> version of its trades, for cache
+        self._version = None  # version of all trades, for cache
+        self._version_counter = count()
+        self._next_eviction = None
+        self._series_type = ColumnarTradeSeries if columnar else TradeSeries
+
+        if concurrent:
+            self._lock = threading.Lock()
+            self._stripes = [threading.Lock() for _ in range(_lock_stripes)]
+        else:
+            self._lock = nullcontext()
+            self._stripes = [self._lock]
+
+        self._locks = {}  # stock name -> one of self._stripes
+        self._sorted_stocks = []  # Stock objects in name order
+        self._gbce_asi = AllShareIndex(self.trades, _five_minutes, self._locks)
+        self.subscriptions = Subscriptions()
+
+        # subscribers see the window up to and including the latest trade,
+        # so the index published to them is kept separately, as the index
+        # can only be read cheaply at times that don't go backwards
+        self._published_asi = AllShareIndex(self.trades, _five_minutes,
+                                            self._locks)
+        self._rankings = Rankings(self.trades, _five_minutes, self._locks)
+        self.metrics = None
+
+        if metrics:
+            self.enable_metrics()
 
     def add_stock(self, stock):
         """ add a given stock to the market.
         
         @param stock - Stock object
         """
-        name = stock.get_name()
-        assert_true(name not in self.stocks, "duplicate stock: %r" % name)
-        self.stocks[name] = stock
+        with self._lock:
+            stock_id = self.symbols.add(stock.get_name())
+            name = self.symbols.get_name(stock_id)
+            self._locks[name] = self._stripes[stock_id % len(self._stripes)]
+            self.trades[name] = self._series_type(name)
+            self.bars[name] = {resolution: BarSeries(resolution)
+                               for resolution in self.bar_resolutions}
+
+            if self.sketch_resolution:
+                self.sketches[name] = QuantileSeries(self.sketch_resolution)
+
+            self._sorted_stocks.insert(self.symbols.rank(name), stock)
+            self.stocks[name] = stock
 
     def get_stock(self, name):
         """ return named stock
@@ -37,9 +186,32 @@ class Market(object):
         """
         return self.stocks.get(name)
 
+    def get_stock_id(self, name):
+        """ return the integer id of the named stock, assigned in the order
+        stocks are added starting from 0, or None if unknown
+
+        @param name - name of the stock
+        """
+        return self.symbols.get_id(name)
+
     def get_all_stocks(self):
         """ return all stocks orderd by name """
-        return sorted(self.stocks.values(), key=lambda stock: stock.get_name())
+        return list(self._sorted_stocks)
+
+    def validate_trade(self, stock, trade_type, quantity, price):
+        """ raise Error if the given values are not a valid trade
+
+        @param stock - name of the stock
+        @param trade_type - buy or sell indicator (Trade.BUY / Trade.SELL)
+        @param quantity - quantity traded
+        @param price - price traded at
+        """
+        assert_true(stock in self.stocks, "unknown stock: %r", stock)
+        valid_type = trade_type in _trade_types
+        assert_true(valid_type, "invalid type: %s", trade_type)
+        assert_true(quantity > 0, "invalid quantity: %s", quantity)
+        assert_true(price >= 0, "invalid price: %s", price)
+        self._check_storable((quantity,), (price,))
 
     def record_trade(self, stock, trade_type, quantity, price):
         """ create new trade for given values with auto increment id and
@@ -51,18 +223,244 @@ class Market(object):
         @param pice - price traded at
         """
 
-        assert_true(stock in self.stocks, "unknown stock: %r" % stock)
-        valid_type = trade_type in [Trade.BUY, Trade.SELL]
-        assert_true(valid_type, "invalid type: %s" % trade_type)
-        assert_true(quantity > 0, "invalid quantity: %s" % quantity)
-        assert_true(price >= 0, "invalid price: %s" % price)
-
-        trade_id = auto_increment()
-        ts = micros_since_epoch()
+        self.validate_trade(stock, trade_type, quantity, price)
+        stock = self.symbols.intern(stock)
+        trade_id = self._next_id()
+        ts = self.clock()
         new_trade = Trade(trade_id, stock, trade_type, quantity, price, ts)
-        self.trades.append(new_trade)
+
+        if self.journal:
+            self.journal.append(new_trade)
+
+        with self._locks[stock]:
+            self.trades[stock].append(new_trade)
+
+            for bars in self.bars[stock].values():
+                bars.add(ts, price, quantity)
+
+            if self.sketch_resolution:
+                self.sketches[stock].add(ts, price, quantity)
+
+        self._changed(stock)
+
+        if self.retention:
+            self._evict_stock(stock, ts)
+
         return new_trade
 
+    def record_trades(self, stocks, trade_types, quantities, prices):
+        """ record a batch of trades given as equal length columns of values,
+        as record_trade. The whole batch is validated before any of it is
+        recorded, takes a block of consecutive ids, or ascending ones from an
+        id allocator, and is stamped with a single timestamp. Return sequence
+        of the new trade ids, in the same order as the columns.
+
+        @param stocks - sequence of stock names
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        """
+        self.validate_trades(stocks, trade_types, quantities, prices)
+        n = len(stocks)
+        trade_ids = self._reserve_ids(n)
+        timestamps = [self.clock()] * n
+        columns = (trade_ids, trade_types, quantities, prices, timestamps)
+
+        for stock, stock_columns in _group_by_stock(stocks, columns):
+
+            if self.journal:
+                self.journal.extend(stock, *stock_columns)
+
+            self.load_trades(stock, *stock_columns)
+
+        return trade_ids
+
+    def validate_trades(self, stocks, trade_types, quantities, prices):
+        """ raise Error if the given columns of values, as record_trades, are
+        not all valid trades
+
+        @param stocks - sequence of stock names
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        """
+        lengths = set(map(len, (trade_types, quantities, prices)))
+        assert_true(lengths <= {len(stocks)}, "columns differ in length")
+
+        if not stocks:
+            return
+
+        unknown = set(stocks).difference(self.stocks)
+        invalid = set(trade_types).difference(_trade_types)
+        quantity = min(quantities)
+        price = min(prices)
+
+        assert_true(not unknown, "unknown stock: %r", min(unknown, default=0))
+        assert_true(not invalid, "invalid type: %s", min(invalid, default=0))
+        assert_true(quantity > 0, "invalid quantity: %s", quantity)
+        assert_true(price >= 0, "invalid price: %s", price)
+        self._check_storable(quantities, prices)
+
+    def _check_storable(self, quantities, prices):
+        """ raise Error if the given quantities or prices don't fit the typed
+        arrays they are kept in: columnar storage and the journal need
+        quantities that are integers that fit in 64 bits, and they, bars and
+        sketches need both to fit in floats. Checking up front means a trade
+        or batch is either stored everywhere or not at all.
+
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        """
+        integral = self.journal or self._series_type is ColumnarTradeSeries
+
+        if not (integral or self.bar_resolutions or self.sketch_resolution):
+            return
+
+        try:
+            array("q" if integral else "d", quantities)
+            array("d", prices)
+
+        except (TypeError, OverflowError) as e:
+            raise Error("invalid trade: %s" % e)
+
+    def load_trades(self, stock, trade_ids, trade_types, quantities, prices,
+                    timestamps):
+        """ store trades that already have ids and timestamps, e.g. ones
+        recorded elsewhere, given as equal length columns of values for the
+        given stock. The values are not validated, other than the stock and
+        that they fit the market's storage, see _check_storable.
+
+        @param stock - name of the stock
+        @param trade_ids - sequence of unique trade ids
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        @param timestamps - sequence of integer timestamps (microseconds since
+          epoch)
+        """
+        assert_true(stock in self.stocks, "unknown stock: %r", stock)
+
+        if not timestamps:
+            return
+
+        self._check_storable(quantities, prices)
+
+        with self._locks[stock]:
+            self.trades[stock].extend(
+                trade_ids, trade_types, quantities, prices, timestamps
+                )
+
+            for bars in self.bars[stock].values():
+                bars.extend(timestamps, prices, quantities)
+
+            if self.sketch_resolution:
+                self.sketches[stock].extend(timestamps, prices, quantities)
+
+        self._changed(stock)
+
+        if self.retention:
+            self._evict_stock(stock, max(timestamps))
+
+    def advance_ids(self, value):
+        """ make sure ids of new trades continue from at least value, e.g.
+        after loading trades with existing ids, from the market's id
+        allocator or else the auto incrementing id
+
+        @param value - lowest value for the next id
+        """
+
+        if self.ids is None:
+            advance_auto_increment(value)
+
+        else:
+            self.ids.advance(value)
+
+    def _evict_stock(self, stock, now):
+        """ evict old trades for the given stock after it has traded, and
+        periodically for all stocks so that those no longer trading are
+        evicted too.
+
+        @param stock - name of the stock
+        @param now - time in microseconds
+        """
+        archived = []
+
+        with self._locks[stock]:
+            evicted = self.trades[stock].evict(now - self.retention,
+                                               self._collector(archived))
+
+            for bars in self.bars[stock].values():
+                bars.evict(now - self.retention)
+
+            if self.sketch_resolution:
+                self.sketches[stock].evict(now - self.retention)
+
+        self._archive(archived)
+
+        if evicted:
+            self._changed(stock)
+
+        if self._next_eviction is None or now >= self._next_eviction:
+            self.evict(now)
+
+    def _collector(self, archived):
+        """ return archiver for TradeSeries.evict that adds (stock, trades)
+        tuples to archived, so they are archived with _archive once the
+        stock's lock is released, or None if there is no archiver
+
+        @param archived - list to add to
+        """
+
+        if self.archiver is None:
+            return None
+
+        return lambda stock, trades: archived.append((stock, trades))
+
+    def _archive(self, archived):
+        """ pass each of the (stock, trades) tuples collected by _collector
+        to the archiver. No lock may be held, as the archiver may call back
+        into the market or be slow.
+
+        @param archived - list of (stock, list of trades) tuples
+        """
+
+        for stock, trades in archived:
+            self.archiver(stock, trades)
+
+    def evict(self, now=None):
+        """ evict trades older than the retention period from all stocks.
+        This is called automatically by record_trade.
+
+        @param now - optional time in microseconds (default is now)
+        """
+
+        if not self.retention:
+            return
+
+        now = self.clock() if now is None else now
+        before = now - self.retention
+
+        for name, series in list(self.trades.items()):
+
+            archived = []
+
+            with self._locks[name]:
+                evicted = series.evict(before, self._collector(archived),
+                                       force=True)
+
+                for bars in self.bars[name].values():
+                    bars.evict(before)
+
+                if self.sketch_resolution:
+                    self.sketches[name].evict(before)
+
+            self._archive(archived)
+
+            if evicted:
+                self._changed(name)
+
+        self._next_eviction = now + self.retention
+
     def get_trades(self, stock, period=None):
         """ get all trades for the given stock chronologically, optionally
         within the given period.
@@ -72,27 +470,145 @@ class Market(object):
           all trades)
         """
 
-        def include_trade(trade):
-            """ return True to include trade if correct stock and, optionally,
-            within period
-            
-            @param trade - the Trade object
-            """
+        series = self.trades.get(stock)
 
-            if trade.get_stock() == stock:
+        if series is None:
+            return []
 
-                if period:
-                    timestamp = trade.get_timestamp()
-                    t1, t2 = period
-                    return timestamp >= t1 and timestamp < t2
+        with self._locks[stock]:
+            return series.get_trades(period)
 
-                else:
-                    return True
+    def iter_trades(self, stock, period=None, chunk_size=_chunk_size):
+        """ yield trades for the given stock chronologically, optionally
+        within the given period, as get_trades but without building a list of
+        them all. Trades are fetched chunk_size at a time and the stock's lock
+        is only held while a chunk is fetched, so trades can be recorded and
+        evicted while iterating. Trades recorded behind the iterator's
+        position are not seen.
 
-            else:
-                return False
+        @param stock - name of the stock
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all trades)
+        @param chunk_size - number of trades to fetch at a time
+        """
+        t, end = period if period else (-math.inf, math.inf)
+        skip = 0  # number of trades at time t already yielded
+
+        while True:
+            trades = self._trades_chunk(stock, t, end, skip, chunk_size)
+
+            if not trades:
+                return
+
+            yield from trades
+
+            # resume from the last timestamp seen, after the trades at that
+            # time already yielded, so that it doesn't matter if trades have
+            # been evicted from the front of the series in the meantime
+            last = trades[-1].get_timestamp()
+            same = 1
+
+            while same < len(trades) and \
+                    trades[-same - 1].get_timestamp() == last:
+                same += 1
+
+            skip = skip + same if last == t else same
+            t = last
+
+    def iter_tape(self, stocks=None, period=None, chunk_size=_chunk_size):
+        """ yield trades for all or the given stocks, optionally within the
+        given period, merged into one stream in timestamp order (then id
+        order for trades at the same time). Memory used is proportional to
+        the number of stocks times chunk_size, whatever the number of trades.
+
+        @param stocks - optional sequence of stock names (default is all)
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all trades)
+        @param chunk_size - number of trades per stock to fetch at a time, see
+          iter_trades
+        """
+        stocks = list(self.symbols.sorted_names) if stocks is None else stocks
+        streams = [self.iter_trades(stock, period, chunk_size)
+                   for stock in stocks]
+        return heapq.merge(*streams, key=_tape_order)
+
+    def _trades_chunk(self, stock, start, end, skip, n):
+        """ return list of up to n trades for the given stock from start to
+        end, skipping the first skip trades at time start
+
+        @param stock - name of the stock
+        @param start - time in microseconds of first trade
+        @param end - time in microseconds after last trade
+        @param skip - number of trades to skip
+        @param n - maximum number of trades to return
+        """
+        series = self.trades.get(stock)
+
+        if series is None:
+            return []
+
+        with self._locks[stock]:
+            lo, hi = series.span((start, end))
+
+            if skip:
+                # unless trades at start have since been evicted
+                at_lo, at_hi = series.span((start, start + 1))
+                lo += min(skip, at_hi - at_lo)
+
+            return series.slice(lo, min(hi, lo + n))
+
+    def get_bars(self, stock, resolution, period=None):
+        """ get OHLCV bars for the given stock at one of the market's bar
+        resolutions chronologically, optionally only those starting within
+        the given period. Bars without trades are not included.
+
+        @param stock - name of the stock
+        @param resolution - length of bars in microseconds
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all bars)
+        """
+        assert_true(resolution in self.bar_resolutions,
+                    "unknown resolution: %s", resolution)
+        bars = self.bars.get(stock)
+
+        if bars is None:
+            return []
+
+        with self._locks[stock]:
+            return bars[resolution].get_bars(period)
 
-        return list(filter(include_trade, self.trades))
+    def get_quantiles(self, stock, fractions=_quantiles, period=None):
+        """ get approximate quantiles of the prices and sizes of the given
+        stock's trades over the given period from its quantile sketches, e.g.
+        the 1st, 50th and 99th percentiles, as a dict of price and quantity
+        lists of values at each fraction, or None if there are no trades.
+
+        The period is widened to the sketch buckets it overlaps, so may take
+        in trades up to sketch_resolution before and after it. Within those
+        buckets, the rank of each value is within about 1% of the fraction
+        asked for, see sketch.QuantileSketch.
+
+        @param stock - name of the stock
+        @param fractions - sequence of fractions from 0 to 1 (default is 0.01,
+          0.5 and 0.99)
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          last five minutes)
+        """
+        assert_true(self.sketch_resolution, "quantile sketches are not kept")
+        sketches = self.sketches.get(stock)
+
+        if sketches is None:
+            return None
+
+        period = period or _default_period(self.clock())
+
+        with self._locks[stock]:
+            quantiles = sketches.get_quantiles(fractions, period)
+
+        if quantiles is None:
+            return None
+
+        return {"price": quantiles[0], "quantity": quantiles[1]}
 
     def calculate_vwsp(self, stock, period=None):
         """ calculate volume weighted stock price for all trades over given
@@ -103,29 +619,447 @@ class Market(object):
           last five minutes)
         """
 
-        trades = self.get_trades(stock, period or _default_period())
-
-        if trades:
-            top = sum([trade.get_total_amount() for trade in trades])
-            bottom = sum([trade.get_quantity() for trade in trades])
-            return float(top) / bottom
+        series = self.trades.get(stock)
 
-        else:
+        if series is None:
             return None
 
+        if self.cache is not None:
+            return self._cached("vwsp", stock, period, self._calculate_vwsp,
+                                stock, series, period)
+
+        return self._calculate_vwsp(stock, series, period)
+
+    def _calculate_vwsp(self, stock, series, period):
+        """ calculate volume weighted stock price, see calculate_vwsp
+
+        @param stock - name of the stock
+        @param series - the stock's TradeSeries
+        @param period - optional tuple of (t1, t2) in microseconds
+        """
+        period = period or _default_period(self.clock())
+
+        with self._locks[stock]:
+            return series.calculate_vwsp(period)
+
+    def rolling_vwsp(self, stock, start, end, step, window=_five_minutes):
+        """ return array of volume weighted stock prices sampled every step
+        from start until before end, each over the window before the sample
+        time like the default period of calculate_vwsp, with NaN for samples
+        without trades. The whole series is calculated in one sweep over the
+        stock's trades, see TradeSeries.rolling_segments.
+
+        @param stock - name of the stock
+        @param start - time of first sample in microseconds
+        @param end - time after last sample in microseconds
+        @param step - time between samples in microseconds
+        @param window - length of window before each sample in microseconds
+          (default is five minutes)
+        """
+        n = _samples(start, end, step, window)
+        vwsps = array("d", [math.nan]) * n
+
+        for a, b, vwsp in self._rolling_segments(stock, start, step, n,
+                                                 window):
+            vwsps[a:b] = array("d", [vwsp]) * (b - a)
+
+        return vwsps
+
+    def rolling_gbce_asi(self, start, end, step, window=_five_minutes):
+        """ return array of GBCE all share index values sampled every step
+        from start until before end, each over the window before the sample
+        time, with NaN for samples where no stock has traded. Calculated in
+        one sweep over each stock's trades, see rolling_gbce_asi_terms.
+
+        @param start - time of first sample in microseconds
+        @param end - time after last sample in microseconds
+        @param step - time between samples in microseconds
+        @param window - length of window before each sample in microseconds
+          (default is five minutes)
+        """
+        terms = self.rolling_gbce_asi_terms(start, end, step, window)
+        values = map(all_share_index, *terms)
+        return array("d", [math.nan if v is None else v for v in values])
+
+    def rolling_gbce_asi_terms(self, start, end, step, window=_five_minutes):
+        """ return tuple of (log_sums, zeros, counts) arrays of the terms of
+        the GBCE all share index at each sample, see rolling_gbce_asi and
+        calculate_gbce_asi_terms.
+
+        Each stock's vwsp is constant over runs of samples, so its terms are
+        added at the start of each run and taken away at the end, and the
+        terms at each sample are the running total of those changes. This
+        takes time in proportion to the number of trades plus the number of
+        samples, rather than their product.
+
+        @param start - time of first sample in microseconds
+        @param end - time after last sample in microseconds
+        @param step - time between samples in microseconds
+        @param window - length of window before each sample in microseconds
+          (default is five minutes)
+        """
+        n = _samples(start, end, step, window)
+        log_changes = [0.0] * (n + 1)
+        zero_changes = [0] * (n + 1)
+        count_changes = [0] * (n + 1)
+
+        for stock in list(self.stocks):
+
+            for a, b, vwsp in self._rolling_segments(stock, start, step, n,
+                                                     window):
+                count_changes[a] += 1
+                count_changes[b] -= 1
+
+                if vwsp == 0:
+                    zero_changes[a] += 1
+                    zero_changes[b] -= 1
+
+                else:
+                    log = math.log(vwsp)
+                    log_changes[a] += log
+                    log_changes[b] -= log
+
+        return (array("d", islice(accumulate(log_changes), n)),
+                array("q", islice(accumulate(zero_changes), n)),
+                array("q", islice(accumulate(count_changes), n)))
+
+    def _rolling_segments(self, stock, start, step, n, window):
+        """ return list of runs of samples with the same vwsp for the given
+        stock, see TradeSeries.rolling_segments
+
+        @param stock - name of the stock
+        @param start - time of first sample in microseconds
+        @param step - time between samples in microseconds
+        @param n - number of samples
+        @param window - length of window before each sample in microseconds
+        """
+        series = self.trades.get(stock)
+
+        if series is None:
+            return []
+
+        with self._locks[stock]:
+            return series.rolling_segments(start, step, n, window)
+
     def calculate_gbce_asi(self, period=None):
         """ calculate GBCE all share index for all stocks over given period.
+        The index for the default period is maintained incrementally, so only
+        stocks that have traded or whose trades have moved out of the last
+        five minutes since the previous call are recalculated.
         
         @param period - optional tuple of (t1, t2) in microseconds (default is
           last five minutes)
         """
 
-        stocks = self.stocks.keys()
-        period = period or _default_period()
-        vwsps = [self.calculate_vwsp(stock, period) for stock in stocks]
+        if self.cache is not None:
+            return self._cached("asi", None, period,
+                                self._calculate_gbce_asi, period)
+
+        return self._calculate_gbce_asi(period)
+
+    def _calculate_gbce_asi(self, period):
+        """ calculate GBCE all share index, see calculate_gbce_asi
+
+        @param period - optional tuple of (t1, t2) in microseconds
+        """
+
+        if not period:
+            return self._gbce_asi.value(self.clock())
+
+        stocks = list(self.stocks)
+        # per-stock results aren't cached, so that one index query doesn't
+        # fill the cache with an entry per stock
+        vwsps = [self._calculate_vwsp(stock, self.trades[stock], period)
+                 for stock in stocks]
 
         # remove None values for stocks with no trades
         actual_vwsps = list(filter(lambda val: val != None, vwsps))
 
         return geometric_mean(actual_vwsps)
 
+    def calculate_gbce_asi_terms(self, period=None, now=None):
+        """ return tuple of (log_sum, zeros, count) terms of the GBCE all share
+        index over given period, see index.all_share_index. Terms from markets
+        with different stocks can be added together to give the index over
+        all of them.
+
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          five minutes before now)
+        @param now - optional time in microseconds for default period (default
+          is now)
+        """
+
+        if not period:
+            now = self.clock() if now is None else now
+            return self._gbce_asi.terms(now)
+
+        stocks = list(self.stocks)
+        # per-stock results aren't cached, so that one index query doesn't
+        # fill the cache with an entry per stock
+        vwsps = [self._calculate_vwsp(stock, self.trades[stock], period)
+                 for stock in stocks]
+        actual_vwsps = [vwsp for vwsp in vwsps if vwsp is not None]
+        logs = [math.log(vwsp) for vwsp in actual_vwsps if vwsp != 0]
+        zeros = len(actual_vwsps) - len(logs)
+        return math.fsum(logs), zeros, len(actual_vwsps)
+
+    def get_top(self, by, n=20, ascending=False, now=None):
+        """ return list of (stock name, value) tuples for the n stocks ranked
+        highest by volume, number of trades or VWSP change over the last five
+        minutes, highest first, or lowest first if ascending, e.g. the top
+        movers. VWSP change is relative to the five minutes before, e.g. 0.1
+        for a 10% rise. The rankings are maintained incrementally, as the
+        index for the default period is, so only stocks that have traded or
+        whose trades have moved through the window since the previous call
+        are recalculated, and a call takes O(n) more.
+
+        Stocks that haven't traded in the last five minutes are not ranked,
+        nor by VWSP change are those that didn't trade in the five minutes
+        before.
+
+        @param by - "volume", "trades" or "vwsp_change"
+        @param n - number of stocks (default is 20)
+        @param ascending - rank lowest values first
+        @param now - optional time in microseconds the window ends at
+          (default is now)
+        """
+        assert_true(by in _measures, "unknown ranking: %s", by)
+        assert_true(n >= 0, "invalid n: %s", n)
+        now = self.clock() if now is None else now
+        return self._rankings.top(by, n, now, ascending)
+
+    def _cached(self, name, stock, period, func, *args):
+        """ return result of func(*args) for the named query from the cache,
+        calculating and caching it if it isn't there for the current version
+        of the trades the query reads. The default period is cached by the
+        cache's time bucket for now.
+
+        @param name - name of the query
+        @param stock - name of the stock the query reads, or None for all
+        @param period - optional tuple of (t1, t2) in microseconds
+        @param func - function calculating the result
+        @param args - arguments to pass to func
+        """
+        cache = self.cache
+
+        # read the version first, so trades stored while calculating leave
+        # the result out of date rather than stale
+        version = self._version if stock is None else self._versions.get(stock)
+        window = tuple(period) if period else \
+            cache.bucket(self.clock())
+        key = (name, stock, window)
+        hit, value = cache.get(key, version)
+
+        if not hit:
+            value = func(*args)
+            cache.put(key, version, value)
+
+        return value
+
+    def _changed(self, stock):
+        """ note that the given stock's trades have changed, so the index and
+        any cached results are recalculated, and notify subscribers
+
+        @param stock - name of the stock
+        """
+        self._gbce_asi.touch(stock)
+        self._published_asi.touch(stock)
+        self._rankings.touch(stock)
+
+        if self.cache is not None:
+            # every version is unique, so a cached result can't be mistaken
+            # for a current one if threads bump versions out of order
+            version = next(self._version_counter)
+            self._versions[stock] = version
+            self._version = version
+
+        if self.subscriptions.count:
+            self._publish(stock, self.clock())
+
+    def subscribe_vwsp(self, stock, callback, when=None):
+        """ subscribe to the volume weighted stock price of the given stock
+        over the five minutes up to and including now, which is recalculated
+        as its trades are stored or evicted, and return the
+        subscription.Subscription to pass to unsubscribe. callback(vwsp, now)
+        is called whenever the vwsp changes, or if when is given, each time
+        when(vwsp) becomes true. The vwsp is None once the stock has no
+        trades in the window.
+
+        Callbacks are called in the thread storing the trade, one at a time.
+        A stock's vwsp also changes as its trades leave the window, which
+        subscribers only see when it next trades or publish is called.
+
+        @param stock - name of the stock
+        @param callback - function called as callback(vwsp, now)
+        @param when - optional condition called as when(vwsp), e.g. lambda
+          vwsp: vwsp > 120 to be notified each time it rises above 120
+        """
+        assert_true(stock in self.stocks, "unknown stock: %r", stock)
+        return self._subscribe(Subscription(stock, callback, when))
+
+    def subscribe_gbce_asi(self, callback, when=None):
+        """ subscribe to the GBCE all share index over the five minutes up to
+        and including now, which is recalculated incrementally as trades are
+        stored or evicted, see subscribe_vwsp.
+
+        @param callback - function called as callback(index, now)
+        @param when - optional condition called as when(index)
+        """
+        return self._subscribe(Subscription(None, callback, when))
+
+    def unsubscribe(self, subscription):
+        """ stop notifying the given subscription
+
+        @param subscription - subscription.Subscription returned by
+          subscribe_vwsp or subscribe_gbce_asi
+        """
+        self.subscriptions.remove(subscription)
+
+    def publish(self, now=None):
+        """ recalculate every subscribed value for the window up to and
+        including now and notify subscribers of changes, e.g. periodically so
+        that they see trades leaving the window.
+
+        @param now - optional time in microseconds (default is now)
+        """
+        now = self.clock() if now is None else now
+        subscriptions = self.subscriptions
+
+        with subscriptions.lock:
+
+            for stock in list(subscriptions.stocks):
+                self._publish_vwsp(stock, now)
+
+            self._publish_gbce_asi(now)
+
+    def _subscribe(self, subscription):
+        """ start subscription from the current value and add it
+
+        @param subscription - subscription.Subscription object
+        """
+        subscriptions = self.subscriptions
+        now = self.clock()
+
+        with subscriptions.lock:
+
+            if subscription.stock is None:
+                subscription.start(self._published_asi.value(now + 1))
+
+            else:
+                subscription.start(self._current_vwsp(subscription.stock,
+                                                      now))
+
+            subscriptions.add(subscription)
+
+        return subscription
+
+    def _publish(self, stock, now):
+        """ notify subscribers to the given stock's vwsp and the index, after
+        the stock's trades have changed
+
+        @param stock - name of the stock
+        @param now - time in microseconds
+        """
+
+        with self.subscriptions.lock:
+            self._publish_vwsp(stock, now)
+            self._publish_gbce_asi(now)
+
+    def _publish_vwsp(self, stock, now):
+        """ notify subscribers to the given stock's vwsp. The subscriptions
+        lock must be held.
+
+        @param stock - name of the stock
+        @param now - time in microseconds
+        """
+        subscribers = self.subscriptions.stocks.get(stock)
+
+        if subscribers:
+            vwsp = self._current_vwsp(stock, now)
+
+            for subscription in list(subscribers):
+                subscription.update(vwsp, now)
+
+    def _publish_gbce_asi(self, now):
+        """ notify subscribers to the index. The subscriptions lock must be
+        held.
+
+        @param now - time in microseconds
+        """
+        subscribers = self.subscriptions.index
+
+        if subscribers:
+            index = self._published_asi.value(now + 1)
+
+            for subscription in list(subscribers):
+                subscription.update(index, now)
+
+    def _current_vwsp(self, stock, now):
+        """ return vwsp of the given stock over the five minutes up to and
+        including now
+
+        @param stock - name of the stock
+        @param now - time in microseconds
+        """
+        return self._calculate_vwsp(stock, self.trades[stock],
+                                    _default_period(now + 1))
+
+    def enable_metrics(self):
+        """ start counting and timing calls of the main methods, and counting
+        the trades get_trades scans and returns, see stats. Until this is
+        called, the methods are not instrumented at all.
+        """
+
+        if self.metrics is None:
+            self.metrics = Metrics()
+            instrument(self, self.metrics)
+
+    def disable_metrics(self):
+        """ stop instrumenting methods and discard the metrics collected """
+
+        if self.metrics is not None:
+            uninstrument(self)
+            self.metrics = None
+
+    def stats(self):
+        """ return dict snapshot of the market's metrics: calls (method name ->
+        count), latency (method name -> histogram dict, see
+        metrics.Histogram.snapshot), rows_scanned and rows_returned by
+        get_trades, which are empty or zero unless metrics are enabled, and
+        trades, trades_per_stock (name -> number of trades held),
+        memory_bytes (approximate memory used by trades) and, if results are
+        cached, cache (see cache.ResultCache.stats).
+        """
+
+        if self.metrics is not None:
+            stats = self.metrics.snapshot()
+
+        else:
+            stats = {"calls": {}, "latency": {}, "rows_scanned": 0,
+                     "rows_returned": 0}
+
+        trades_per_stock = {}
+        memory_bytes = 0
+
+        for name, series in list(self.trades.items()):
+
+            with self._locks[name]:
+                trades_per_stock[name] = len(series)
+                memory_bytes += series.nbytes()
+
+        stats["trades"] = sum(trades_per_stock.values())
+        stats["trades_per_stock"] = trades_per_stock
+        stats["memory_bytes"] = memory_bytes
+
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+
+        return stats
+
+    def dump_metrics(self, destination):
+        """ write stats() in Prometheus text format to a file or socket, see
+        metrics.dump_prometheus
+
+        @param destination - (host, port) tuple, or path of socket or file
+        """
+        dump_prometheus(self.stats(), destination)
@@ -0,0 +1,275 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from bisect import bisect_left
+import functools
+import os
+import socket
+import stat
+import threading
+import time
+
+# upper bounds of latency histogram buckets in seconds, 1us to 5s
+_latency_buckets = tuple(float("%se%d" % (m, e))
+                         for e in range(-6, 1) for m in (1, 2.5, 5))
+
+# Market methods timed when metrics are enabled
+_instrumented = (
+    "record_trade",
+    "record_trades",
+    "load_trades",
+    "get_trades",
+    "calculate_vwsp",
+    "calculate_gbce_asi",
+    "evict",
+    )
+
+
+class Histogram(object):
+    """ count of observed values in fixed buckets, as a Prometheus histogram """
+
+    def __init__(self, buckets=_latency_buckets):
+        """ constructor
+
+        @param buckets - ascending sequence of bucket upper bounds
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last is for larger values
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """ add value to the histogram
+
+        @param value - the observed value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """ return dict of count, sum and list of (upper bound, cumulative
+        count) buckets, ending with infinity """
+        bounds = self.buckets + (float("inf"),)
+        cumulative = 0
+        buckets = []
+
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Metrics(object):
+    """ latency histograms and call counts for instrumented Market methods,
+    and the number of trades get_trades scanned and returned. Safe to update
+    from any thread.
+    """
+
+    def __init__(self):
+        """ constructor """
+        self.latencies = {}  # method name -> Histogram
+        self.rows_scanned = 0
+        self.rows_returned = 0
+        self._lock = threading.Lock()
+
+    def observe(self, method, elapsed):
+        """ record a call of method that took elapsed seconds
+
+        @param method - name of the method
+        @param elapsed - time taken in seconds
+        """
+
+        with self._lock:
+            histogram = self.latencies.get(method)
+
+            if histogram is None:
+                histogram = self.latencies[method] = Histogram()
+
+            histogram.observe(elapsed)
+
+    def rows(self, scanned, returned):
+        """ record trades scanned and returned by a get_trades call
+
+        @param scanned - number of trades looked at
+        @param returned - number of trades returned
+        """
+
+        with self._lock:
+            self.rows_scanned += scanned
+            self.rows_returned += returned
+
+    def snapshot(self):
+        """ return dict of calls, latency, rows_scanned and rows_returned """
+
+        with self._lock:
+            latency = {method: histogram.snapshot()
+                       for method, histogram in self.latencies.items()}
+
+            return {
+                "calls": {method: histogram["count"]
+                          for method, histogram in latency.items()},
+                "latency": latency,
+                "rows_scanned": self.rows_scanned,
+                "rows_returned": self.rows_returned,
+                }
+
+
+def instrument(market, metrics):
+    """ time the instrumented methods of market, by shadowing them with
+    timing wrappers in the instance, so that an uninstrumented market pays
+    nothing for them.
+
+    @param market - Market object
+    @param metrics - Metrics object to record to
+    """
+
+    for method in _instrumented:
+        func = getattr(market, method)
+        setattr(market, method, _timed(metrics, method, func))
+
+    get_trades = market.get_trades
+
+    @functools.wraps(get_trades)
+    def counted_get_trades(stock, period=None):
+        trades = get_trades(stock, period)
+        series = market.trades.get(stock)
+
+        # the trades returned and the probes of the two binary searches
+        probes = 2 * len(series).bit_length() if series is not None else 0
+        metrics.rows(len(trades) + probes, len(trades))
+        return trades
+
+    market.get_trades = counted_get_trades
+
+
+def uninstrument(market):
+    """ remove timing wrappers added by instrument
+
+    @param market - Market object
+    """
+
+    for method in _instrumented:
+        market.__dict__.pop(method, None)
+
+
+def _timed(metrics, method, func):
+    """ return wrapper of func recording its latency to metrics
+
+    @param metrics - Metrics object
+    @param method - name of the method
+    @param func - the bound method
+    """
+    clock = time.perf_counter
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = clock()
+
+        try:
+            return func(*args, **kwargs)
+
+        finally:
+            metrics.observe(method, clock() - start)
+
+    return timed
+
+
+def format_prometheus(stats):
+    """ return Prometheus text exposition format of Market.stats() snapshot
+
+    @param stats - dict returned by Market.stats
+    """
+    lines = []
+
+    def metric(name, kind, description):
+        lines.append("# HELP sssm_%s %s" % (name, description))
+        lines.append("# TYPE sssm_%s %s" % (name, kind))
+
+    metric("calls_total", "counter", "Calls of Market methods.")
+
+    for method, count in sorted(stats["calls"].items()):
+        lines.append('sssm_calls_total{method="%s"} %d' % (method, count))
+
+    metric("latency_seconds", "histogram", "Latency of Market methods.")
+
+    for method, histogram in sorted(stats["latency"].items()):
+
+        for bound, count in histogram["buckets"]:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append('sssm_latency_seconds_bucket{method="%s",le="%s"} %d'
+                         % (method, le, count))
+
+        lines.append('sssm_latency_seconds_sum{method="%s"} %r' % (
+            method, histogram["sum"]
+            ))
+        lines.append('sssm_latency_seconds_count{method="%s"} %d' % (
+            method, histogram["count"]
+            ))
+
+    metric("rows_scanned_total", "counter", "Trades scanned by get_trades.")
+    lines.append("sssm_rows_scanned_total %d" % stats["rows_scanned"])
+    metric("rows_returned_total", "counter", "Trades returned by get_trades.")
+    lines.append("sssm_rows_returned_total %d" % stats["rows_returned"])
+    metric("trades", "gauge", "Trades held per stock.")
+
+    for stock, count in sorted(stats["trades_per_stock"].items()):
+        lines.append('sssm_trades{stock="%s"} %d' % (_escape(stock), count))
+
+    metric("memory_bytes", "gauge", "Approximate memory used by trades.")
+    lines.append("sssm_memory_bytes %d" % stats["memory_bytes"])
+
+    if "cache" in stats:
+        cache = stats["cache"]
+
+        for name in ("hits", "misses", "evictions"):
+            metric("cache_%s_total" % name, "counter",
+                   "Result cache %s." % name)
+            lines.append("sssm_cache_%s_total %d" % (name, cache[name]))
+
+        metric("cache_size", "gauge", "Results in result cache.")
+        lines.append("sssm_cache_size %d" % cache["size"])
+
+    return "\n".join(lines) + "\n"
+
+
+def dump_prometheus(stats, destination):
+    """ write Prometheus text of Market.stats() snapshot to destination,
+    which is either a (host, port) tuple to send it to over TCP, the path of
+    a Unix socket to send it to, or the path of a file to replace with it,
+    e.g. for the node exporter textfile collector.
+
+    @param stats - dict returned by Market.stats
+    @param destination - (host, port) tuple, or path of socket or file
+    """
+    data = format_prometheus(stats).encode()
+
+    if isinstance(destination, tuple):
+        with socket.create_connection(destination) as sock:
+            sock.sendall(data)
+
+    elif os.path.exists(destination) and \
+            stat.S_ISSOCK(os.stat(destination).st_mode):
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(destination)
+            sock.sendall(data)
+
+    else:
+        temp = "%s.%d.tmp" % (destination, os.getpid())
+
+        with open(temp, "wb") as f:
+            f.write(data)
+
+        os.replace(temp, destination)
+
+
+def _escape(value):
+    """ return value escaped for use as a Prometheus label value
+
+    @param value - string value
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,126 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from bisect import bisect_left, insort
+
+from sssm.index import MovingWindow
+
+# what stocks can be ranked by: traded quantity, number of trades, and the
+# relative change in volume weighted stock price from the previous window
+_measures = ("volume", "trades", "vwsp_change")
+
+
+class Rankings(MovingWindow):
+    """ stocks ranked by volume, number of trades and VWSP change over a
+    moving window ending now, maintained incrementally, see
+    index.MovingWindow.
+
+    Each ranking is kept as a list of (-value, name) in sorted order, so the
+    top n stocks are the first n entries, and the bottom n the last n. A
+    stock's VWSP change also depends on the window before the current one,
+    so a stock is recalculated, and moved in the rankings, when one of its
+    trades enters or leaves either window. Stocks without trades in the
+    window are not ranked, nor for VWSP change are those without trades in
+    the window before it or whose VWSP was zero.
+    """
+
+    def __init__(self, series, window, locks=None):
+        """ constructor, see index.MovingWindow """
+        super().__init__(series, window, locks)
+        self.values = {}  # stock name -> tuple of its value for each ranking
+        self.ranked = {by: [] for by in _measures}  # by -> [(-value, name)]
+
+    def top(self, by, n, now, ascending=False):
+        """ return list of up to n (name, value) tuples for the stocks ranked
+        highest by the given measure over the window ending at now, highest
+        first, or lowest first if ascending. Ties are in name order, or
+        reverse name order if ascending.
+
+        @param by - "volume", "trades" or "vwsp_change"
+        @param n - number of stocks
+        @param now - end of the window in microseconds
+        @param ascending - rank lowest values first
+        """
+
+        with self._lock:
+            self._advance(now)
+            ranked = self.ranked[by]
+
+            if ascending:
+                entries = reversed(ranked[max(0, len(ranked) - n):])
+
+            else:
+                entries = ranked[:n]
+
+            return [(name, -value) for value, name in entries]
+
+    def _refresh(self, name, now):
+        """ recalculate the values of the named stock for the window ending at
+        now, move it in the rankings and return the times they next change
+
+        @param name - name of the stock
+        @param now - end of the window in microseconds
+        """
+        series = self.series[name]
+        window = self.window
+
+        with self.locks[name]:
+            lo, hi = series.span((now - window, now))
+            amount, quantity = series.totals(lo, hi)
+            before, _ = series.span((now - 2 * window, now - window))
+            previous_amount, previous_quantity = series.totals(before, lo)
+            times = self._change_times(series, before, lo, hi)
+
+        values = (None, None, None)
+
+        if lo < hi:
+            vwsp = float(amount) / quantity
+            change = None
+
+            if before < lo and previous_amount:
+                change = vwsp * previous_quantity / previous_amount - 1
+
+            values = (quantity, hi - lo, change)
+
+        old = self.values.pop(name, (None, None, None))
+
+        for by, old_value, value in zip(_measures, old, values):
+
+            if old_value != value:
+                ranked = self.ranked[by]
+
+                if old_value is not None:
+                    del ranked[bisect_left(ranked, (-old_value, name))]
+
+                if value is not None:
+                    insort(ranked, (-value, name))
+
+        if lo < hi:
+            self.values[name] = values
+
+        return times
+
+    def _change_times(self, series, before, lo, hi):
+        """ return list of times at which the trades in the window or the
+        window before it next change, i.e. when the first trade in either
+        leaves it or the first trade after the window enters it.
+
+        @param series - the stock's TradeSeries
+        @param before - index of first trade in the window before
+        @param lo - index of first trade in window
+        @param hi - index after last trade in window
+        """
+        times = []
+
+        if before < lo:
+            times.append(series.timestamps[before] + 2 * self.window)
+
+        if lo < hi:
+            times.append(series.timestamps[lo] + self.window)
+
+        if hi < len(series):
+            times.append(series.timestamps[hi])
+
+        return times
@@ -0,0 +1,140 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+import heapq
+from itertools import count
+
+from sssm.clock import VirtualClock
+from sssm.utils import assert_true
+
+
+class Replay(object):
+    """ drives a market from a recorded tape of trades as fast as they can be
+    recorded, moving the market's VirtualClock to each trade's timestamp as
+    the trade is recorded, so that a day of trading can be backtested in
+    seconds.
+
+    Callbacks can be fired at intervals of virtual time along the way, e.g.
+    to sample the VWSP or all share index. A callback due at time t is
+    called with the clock at t, after every trade before t is recorded and
+    before any trade at t, so it sees the market as at t and queries over the
+    default period cover the five minutes before t.
+
+        clock = VirtualClock()
+        market = Market(clock=clock)
+        ...
+        replay = Replay(market)
+        replay.every(60 * 10 ** 6, lambda now: print(
+            now, market.calculate_gbce_asi()))
+        replay.run(source.iter_tape())
+    """
+
+    def __init__(self, market):
+        """ constructor
+
+        @param market - Market object to record trades in, created with a
+          VirtualClock as its clock
+        """
+        assert_true(isinstance(market.clock, VirtualClock),
+                    "market clock is not a VirtualClock")
+        self.market = market
+        self.clock = market.clock
+        self.count = 0  # number of trades replayed
+        self._timers = []  # heap of (due, sequence, interval, callback)
+        self._unscheduled = []  # list of (interval, callback)
+        self._sequence = count()  # breaks ties between timers due together
+
+    def every(self, interval, callback, start=None):
+        """ call callback(now) every interval microseconds of virtual time
+
+        @param interval - time between calls in microseconds
+        @param callback - function called with the time in microseconds
+        @param start - optional time of the first call (default is the first
+          multiple of interval at or after the first trade replayed)
+        """
+        assert_true(interval > 0, "invalid interval: %s", interval)
+
+        if start is None:
+            self._unscheduled.append((interval, callback))
+
+        else:
+            self._schedule(start, interval, callback)
+
+    def run(self, trades, end=None):
+        """ record the given trades in the market, in the order given, firing
+        callbacks as they fall due, and return the number recorded. Trades
+        get new ids, as from Market.record_trade.
+
+        @param trades - iterable of Trade objects in timestamp order, e.g.
+          from Market.iter_tape
+        @param end - optional time to fire callbacks until, and leave the
+          clock at, after the last trade
+        """
+        record_trade = self.market.record_trade
+        clock = self.clock
+        timers = self._timers
+        n = 0
+
+        for trade in trades:
+            ts = trade.get_timestamp()
+
+            if self._unscheduled:
+                self._schedule_unscheduled(ts)
+
+            if timers and timers[0][0] <= ts:
+                self._fire(ts)
+
+            clock.set(ts)
+            record_trade(trade.get_stock(), trade.get_trade_type(),
+                         trade.get_quantity(), trade.get_price())
+            n += 1
+
+        self.count += n
+
+        if end is not None:
+
+            if self._unscheduled:
+                self._schedule_unscheduled(end)
+
+            self._fire(end)
+            clock.set(end)
+
+        return n
+
+    def _schedule(self, due, interval, callback):
+        """ add timer calling callback at due then every interval after
+
+        @param due - time of first call in microseconds
+        @param interval - time between calls in microseconds
+        @param callback - function called with the time in microseconds
+        """
+        heapq.heappush(self._timers, (due, next(self._sequence), interval,
+                                      callback))
+
+    def _schedule_unscheduled(self, now):
+        """ schedule the timers added without a start time to start at the
+        first multiple of their interval at or after now
+
+        @param now - time in microseconds
+        """
+
+        for interval, callback in self._unscheduled:
+            self._schedule(-(-now // interval) * interval, interval, callback)
+
+        self._unscheduled = []
+
+    def _fire(self, until):
+        """ call the callbacks due at or before until, in time order
+
+        @param until - time in microseconds
+        """
+        timers = self._timers
+
+        while timers and timers[0][0] <= until:
+            due, sequence, interval, callback = timers[0]
+            self.clock.set(due)
+            callback(due)
+            heapq.heapreplace(timers, (due + interval, sequence, interval,
+                                       callback))
@@ -0,0 +1,446 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, compress, islice, repeat
+from operator import floordiv, le, lt, mul, sub, truediv
+import sys
+
+from sssm.trade import Trade
+from sssm.utils import Error
+
+
+class TradeSeries(object):
+    """ trades for a single stock kept in timestamp order, so that the trades
+    within a period can be found by binary search rather than a full scan.
+
+    Running totals of amount (price * quantity) and quantity are kept
+    alongside, where amounts[i] is the total of the first i trades, so the
+    totals for any slice of the series are two lookups and a subtraction.
+    """
+
+    def __init__(self, stock=None):
+        """ constructor
+
+        @param stock - optional name of the stock
+        """
+        self.stock = stock
+        self.timestamps = []
+        self.trades = []
+        self.amounts = [0]
+        self.quantities = [0]
+
+    def __len__(self):
+        return len(self.trades)
+
+    def append(self, trade):
+        """ add trade to the series. Trades are normally recorded in time order
+        so this is an append, but if the clock has gone backwards the trade is
+        inserted after any others with the same or an earlier timestamp.
+
+        @param trade - the Trade object
+        """
+        ts = trade.get_timestamp()
+        amount = trade.get_total_amount()
+        quantity = trade.get_quantity()
+
+        if not self.timestamps or ts >= self.timestamps[-1]:
+            self.timestamps.append(ts)
+            self.trades.append(trade)
+            self.amounts.append(self.amounts[-1] + amount)
+            self.quantities.append(self.quantities[-1] + quantity)
+
+        else:
+            i = bisect_right(self.timestamps, ts)
+            self.timestamps.insert(i, ts)
+            self.trades.insert(i, trade)
+            _insert_total(self.amounts, i, amount)
+            _insert_total(self.quantities, i, quantity)
+
+    def extend(self, trade_ids, trade_types, quantities, prices, timestamps):
+        """ add trades given as columns of values. If the timestamps are in
+        order and none are before the last trade in the series, the columns
+        are appended in bulk, otherwise each trade is added as append.
+
+        @param trade_ids - sequence of unique trade ids
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        @param timestamps - sequence of integer timestamps (microseconds since
+          epoch)
+        """
+        columns = (trade_ids, trade_types, quantities, prices, timestamps)
+        trades = [Trade(trade_id, self.stock, trade_type, quantity, price, ts)
+                  for trade_id, trade_type, quantity, price, ts
+                  in zip(*columns)]
+
+        if not self._follows(timestamps):
+
+            for trade in trades:
+                self.append(trade)
+
+            return
+
+        self.timestamps.extend(timestamps)
+        self.trades.extend(trades)
+        _extend_totals(self.amounts, map(mul, prices, quantities))
+        _extend_totals(self.quantities, quantities)
+
+    def _follows(self, timestamps):
+        """ return True if timestamps are in order and none are before the last
+        trade in the series
+
+        @param timestamps - sequence of timestamps
+        """
+
+        if not timestamps:
+            return True
+
+        if self.timestamps and timestamps[0] < self.timestamps[-1]:
+            return False
+
+        return all(map(le, timestamps, islice(timestamps, 1, None)))
+
+    def span(self, period=None):
+        """ return (lo, hi) slice indices of the trades within period.
+
+        @param period - optional tuple of (t1, t2) in microseconds, where
+          t1 <= timestamp < t2 (default is all trades)
+        """
+
+        if not period:
+            return 0, len(self.timestamps)
+
+        t1, t2 = period
+        lo = bisect_left(self.timestamps, t1)
+        hi = bisect_left(self.timestamps, t2, lo)
+        return lo, hi
+
+    def get_trades(self, period=None):
+        """ return list of trades within period chronologically.
+
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all trades)
+        """
+        return self.slice(*self.span(period))
+
+    def slice(self, lo, hi):
+        """ return list of trades[lo:hi]
+
+        @param lo - index of first trade
+        @param hi - index after last trade
+        """
+        return self.trades[lo:hi]
+
+    def totals(self, lo, hi):
+        """ return tuple of (amount, quantity) totals for trades[lo:hi]
+
+        @param lo - index of first trade
+        @param hi - index after last trade
+        """
+        return (self.amounts[hi] - self.amounts[lo],
+                self.quantities[hi] - self.quantities[lo])
+
+    def calculate_vwsp(self, period=None):
+        """ return volume weighted stock price for trades within period, or
+        None if there are none.
+
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all trades)
+        """
+        lo, hi = self.span(period)
+
+        if lo >= hi:
+            return None
+
+        amount, quantity = self.totals(lo, hi)
+        return float(amount) / quantity
+
+    def running_totals(self):
+        """ return tuple of (amounts, quantities) running totals, where
+        amounts[i] is the total amount of the first i trades """
+        return self.amounts, self.quantities
+
+    def rolling_segments(self, start, step, n, window):
+        """ return list of (a, b, vwsp) tuples for the volume weighted stock
+        price over each of n windows [t - window, t) ending at the sample
+        times t = start + k * step, where vwsp is the same for samples a to
+        b - 1. Samples with no trades in their window are left out.
+
+        Each trade enters the window at one sample and leaves it at a later
+        one, and the vwsp can only change at those samples. So finding them
+        is a single pass over the trades, and the trades in the window for
+        each run of samples between them are found by binary search, however
+        many samples there are.
+
+        @param start - time of the first sample in microseconds
+        @param step - time between samples in microseconds
+        @param n - number of samples
+        @param window - length of each window in microseconds
+        """
+        timestamps = self.timestamps
+
+        # trade i enters the window at sample enters[i] + 1 and leaves it at
+        # sample leaves[i] + 1, both in ascending order as the trades are
+        enters = list(map(floordiv, map(sub, timestamps, repeat(start)),
+                          repeat(step)))
+        leaves = list(map(floordiv, map(sub, timestamps,
+                                        repeat(start - window)),
+                          repeat(step)))
+
+        # the samples before which the trades in the window can change, as
+        # k for sample k + 1, starting with sample 0
+        changes = sorted(set(enters).union(leaves, (-1,)))
+        keys = changes[bisect_left(changes, -1):bisect_left(changes, n - 1)]
+        points = [int(k) + 1 for k in keys]
+
+        # trades lo to hi - 1 are in the window from each point to the next,
+        # and the points with none in it are left out
+        los = list(map(bisect_right, repeat(leaves), keys))
+        his = list(map(bisect_right, repeat(enters), keys))
+        mask = list(map(lt, los, his))
+        los = list(compress(los, mask))
+        his = list(compress(his, mask))
+        amounts, quantities = self.running_totals()
+        vwsps = map(truediv,
+                    map(sub, map(amounts.__getitem__, his),
+                        map(amounts.__getitem__, los)),
+                    map(sub, map(quantities.__getitem__, his),
+                        map(quantities.__getitem__, los)))
+        segments = list(zip(compress(points, mask),
+                            compress(points[1:] + [n], mask), vwsps))
+
+        return segments
+
+    def evict(self, before, archiver=None, force=False):
+        """ remove trades with timestamps before the given time, returning the
+        number removed. Unless forced, trades are only removed once they make
+        up at least half of the series, so that the cost of removing them from
+        the front of each list is amortized over the trades removed.
+
+        @param before - time in microseconds
+        @param archiver - optional function called as archiver(stock, trades)
+          with the list of removed trades
+        @param force - remove trades however few there are
+        """
+        timestamps = self.timestamps
+
+        if not timestamps or timestamps[0] >= before:
+            return 0
+
+        n = bisect_left(timestamps, before)
+
+        if 2 * n < len(timestamps) and not force:
+            return 0
+
+        if archiver:
+            archiver(self.stock, self.slice(0, n))
+
+        self._remove(n)
+        return n
+
+    def _remove(self, n):
+        """ remove the first n trades
+
+        @param n - number of trades to remove
+        """
+        del self.timestamps[:n]
+        del self.trades[:n]
+        self.amounts = _rebase(self.amounts[n:])
+        self.quantities = _rebase(self.quantities[n:])
+
+    def nbytes(self):
+        """ return approximate number of bytes used by the series, taking the
+        last trade and its totals as typical of every trade """
+        lists = (self.timestamps, self.trades, self.amounts, self.quantities)
+        size = sum(map(sys.getsizeof, lists))
+
+        if self.trades:
+            trade = self.trades[-1]
+            values = [value for name, value in vars(trade).items()
+                      if name != "stock"]  # the name is shared
+            values += [self.timestamps[-1], self.amounts[-1],
+                       self.quantities[-1]]
+            per_trade = sys.getsizeof(trade) + sys.getsizeof(vars(trade)) + \
+                sum(map(sys.getsizeof, values))
+            size += per_trade * len(self.trades)
+
+        return size
+
+
+class ColumnarTradeSeries(TradeSeries):
+    """ trades for a single stock stored column-wise in typed arrays rather
+    than as a list of Trade objects. This uses a fraction of the memory and
+    leaves nothing for the garbage collector to track; Trade objects are only
+    created when trades are fetched.
+
+    Prices are stored as floats, so fetched trades have float prices. Ids,
+    quantities and timestamps must be integers that fit in 64 bits; trades
+    that don't are rejected with Error, leaving the series unchanged.
+    """
+
+    def __init__(self, stock=None):
+        """ constructor
+
+        @param stock - optional name of the stock
+        """
+        self.stock = stock
+        self.ids = array("q")
+        self.trade_types = array("b")
+        self.quantities = array("q")
+        self.prices = array("d")
+        self.amounts = array("d")
+        self.timestamps = array("q")
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, trade):
+        """ add trade to the series, see TradeSeries.append
+
+        @param trade - the Trade object
+        """
+        ts = trade.get_timestamp()
+        row = (
+            (self.ids, trade.get_id()),
+            (self.trade_types, trade.get_trade_type()),
+            (self.quantities, trade.get_quantity()),
+            (self.prices, trade.get_price()),
+            (self.amounts, trade.get_total_amount()),
+            (self.timestamps, ts),
+            )
+
+        n = len(self.timestamps)
+        i = n if not n or ts >= self.timestamps[-1] else \
+            bisect_right(self.timestamps, ts)
+        done = []
+
+        try:
+            for column, value in row:
+                column.insert(i, value)
+                done.append(column)
+
+        except (TypeError, OverflowError) as e:
+            # leave the columns the same length
+            for column in done:
+                del column[i]
+
+            raise Error("invalid trade for columnar storage: %s" % e)
+
+    def extend(self, trade_ids, trade_types, quantities, prices, timestamps):
+        """ add trades given as columns of values, see TradeSeries.extend
+
+        @param trade_ids - sequence of unique trade ids
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        @param timestamps - sequence of integer timestamps (microseconds since
+          epoch)
+        """
+
+        # convert every column before changing any, so a bad value can't
+        # leave them different lengths
+        try:
+            trade_ids, trade_types, quantities, prices, timestamps = (
+                array(typecode, column) for typecode, column in zip(
+                    "qbqdq",
+                    (trade_ids, trade_types, quantities, prices, timestamps)
+                    )
+                )
+
+        except (TypeError, OverflowError) as e:
+            raise Error("invalid trades for columnar storage: %s" % e)
+
+        if not self._follows(timestamps):
+            TradeSeries.extend(self, trade_ids, trade_types, quantities,
+                               prices, timestamps)
+            return
+
+        self.ids.extend(trade_ids)
+        self.trade_types.extend(trade_types)
+        self.quantities.extend(quantities)
+        self.prices.extend(prices)
+        self.amounts.extend(map(mul, prices, quantities))
+        self.timestamps.extend(timestamps)
+
+    def slice(self, lo, hi):
+        """ return list of newly created trades for rows lo to hi
+
+        @param lo - index of first trade
+        @param hi - index after last trade
+        """
+        columns = (
+            self.ids[lo:hi],
+            self.trade_types[lo:hi],
+            self.quantities[lo:hi],
+            self.prices[lo:hi],
+            self.timestamps[lo:hi],
+            )
+
+        return [Trade(trade_id, self.stock, trade_type, quantity, price, ts)
+                for trade_id, trade_type, quantity, price, ts in zip(*columns)]
+
+    def _remove(self, n):
+        """ remove the first n trades
+
+        @param n - number of trades to remove
+        """
+
+        for column in (self.ids, self.trade_types, self.quantities,
+                       self.prices, self.amounts, self.timestamps):
+            del column[:n]
+
+    def nbytes(self):
+        """ return number of bytes used by the series' arrays """
+        columns = (self.ids, self.trade_types, self.quantities, self.prices,
+                   self.amounts, self.timestamps)
+        return sum(map(sys.getsizeof, columns))
+
+    def totals(self, lo, hi):
+        """ return tuple of (amount, quantity) totals for trades[lo:hi]
+
+        @param lo - index of first trade
+        @param hi - index after last trade
+        """
+        return sum(self.amounts[lo:hi]), sum(self.quantities[lo:hi])
+
+    def running_totals(self):
+        """ return tuple of (amounts, quantities) running totals, see
+        TradeSeries.running_totals, calculated from the columns """
+        return (array("d", accumulate(self.amounts, initial=0)),
+                array("q", accumulate(self.quantities, initial=0)))
+
+
+def _insert_total(totals, i, value):
+    """ insert value as the i'th entry in running totals list, adding it to
+    the totals after it.
+
+    @param totals - list of running totals
+    @param i - index of the new entry (excluding the leading zero)
+    @param value - value of the new entry
+    """
+    totals.insert(i + 1, totals[i] + value)
+
+    for j in range(i + 2, len(totals)):
+        totals[j] += value
+
+
+def _extend_totals(totals, values):
+    """ extend running totals list with values
+
+    @param totals - list of running totals
+    @param values - iterable of values to add
+    """
+    totals.extend(islice(accumulate(values, initial=totals[-1]), 1, None))
+
+
+def _rebase(totals):
+    """ return running totals list relative to its first entry
+
+    @param totals - list of running totals
+    """
+    base = totals[0]
+    return [total - base for total in totals]
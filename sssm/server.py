@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+import argparse
+import asyncio
+import logging
+
+from sssm.market import Market
+from sssm.stock import Stock
+from sssm.trade import Trade
+from sssm.utils import Error, assert_true, parse_number
+
+# Line protocol, one command per line with space separated fields:
+#
+#   STOCK <name> <last_dividend> <par_value> [<fixed_dividend>] -> OK
+#   TRADE <stock> <BUY|SELL> <quantity> <price>                 -> (nothing)
+#   VWSP <stock> [<t1> <t2>]                                     -> <vwsp>
+#   ASI [<t1> <t2>]                                              -> <index>
+#
+# Trades are not acknowledged, so that a client can stream them. Any error,
+# including a line that isn't UTF-8, is sent back as "ERROR <message>", other
+# than an error recording a batch of trades that passed validation, which is
+# logged. Queries are answered once every trade sent before them on the same
+# connection has been recorded, so their result includes those trades.
+
+_trade_type_names = {"BUY": Trade.BUY, "SELL": Trade.SELL}
+_log = logging.getLogger(__name__)
+
+
+class TradeServer(object):
+    """ asyncio server feeding a trade stream into a Market in batches and
+    answering VWSP and all share index queries on the same event loop.
+
+    Trades are parsed and validated by each connection and put on a bounded
+    queue. A single ingest task takes whatever is on the queue, up to
+    batch_size trades, and records it with Market.record_trades. When the
+    queue is full connections stop reading, so the socket buffers fill up
+    and push back on the sender. A batch that fails to record is logged and
+    dropped, so later trades are still recorded and queries answered.
+    """
+
+    def __init__(self, market=None, queue_size=10000, batch_size=1000):
+        """ constructor
+
+        @param market - optional Market object to use (default is a new one)
+        @param queue_size - maximum number of trades waiting to be recorded
+        @param batch_size - maximum number of trades recorded at once
+        """
+        self.market = market if market is not None else Market()
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.queue = None
+        self._ingest_task = None
+
+    async def start(self, host=None, port=None, path=None):
+        """ start ingest task and listen on TCP host and port or Unix socket
+        path. Return the asyncio server.
+
+        @param host - host for TCP socket
+        @param port - port for TCP socket
+        @param path - path of Unix socket, used instead of host and port
+        """
+        self.queue = asyncio.Queue(self.queue_size)
+        self._ingest_task = asyncio.create_task(self.ingest())
+
+        if path:
+            return await asyncio.start_unix_server(self.handle, path)
+
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def stop(self):
+        """ stop ingest task, once everything on the queue is recorded """
+        await self.queue.join()
+        self._ingest_task.cancel()
+
+    async def handle(self, reader, writer):
+        """ handle a client connection until it is closed
+
+        @param reader - asyncio StreamReader
+        @param writer - asyncio StreamWriter
+        """
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                response = await self.command(line)
+
+                if response is not None:
+                    writer.write(response.encode() + b"\n")
+                    await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def command(self, line):
+        """ run command and return response line, or None for trades
+
+        @param line - bytes of the command line
+        """
+
+        try:
+            fields = line.decode().split()
+            assert_true(fields, "empty command")
+            name, args = fields[0].upper(), fields[1:]
+
+            if name == "TRADE":
+                await self.queue.put(self.parse_trade(args))
+                return None
+
+            elif name == "STOCK":
+                self.market.add_stock(_parse_stock(args))
+                return "OK"
+
+            elif name == "VWSP":
+                assert_true(len(args) in (1, 3), "usage: VWSP stock [t1 t2]")
+                await self.barrier()
+                period = _parse_period(args[1:])
+                return str(self.market.calculate_vwsp(args[0], period))
+
+            elif name == "ASI":
+                assert_true(len(args) in (0, 2), "usage: ASI [t1 t2]")
+                await self.barrier()
+                return str(self.market.calculate_gbce_asi(_parse_period(args)))
+
+            else:
+                raise Error("unknown command: %s" % name)
+
+        except (Error, ValueError) as e:
+            return "ERROR %s" % e
+
+    def parse_trade(self, args):
+        """ return (stock, trade_type, quantity, price) tuple for TRADE command
+        arguments, validated as Market.record_trade would.
+
+        @param args - list of stock, trade type, quantity and price fields
+        """
+        usage = "usage: TRADE stock BUY|SELL quantity price"
+        assert_true(len(args) == 4, usage)
+        stock, trade_type, quantity, price = args
+        trade_type = _trade_type_names.get(trade_type.upper(), trade_type)
+        trade = (stock, int(trade_type), int(quantity), parse_number(price))
+        self.market.validate_trade(*trade)
+        return trade
+
+    async def barrier(self):
+        """ wait until every trade queued so far has been recorded """
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put(done)
+        await done
+
+    async def ingest(self):
+        """ record trades from the queue in batches, forever """
+        queue = self.queue
+
+        while True:
+            items = [await queue.get()]
+
+            while len(items) < self.batch_size and not queue.empty():
+                items.append(queue.get_nowait())
+
+            self.record(items)
+
+            for _ in items:
+                queue.task_done()
+
+    def record(self, items):
+        """ record trades in items, in order, resolving barrier futures once
+        the trades before them have been recorded.
+
+        @param items - list of trade tuples and barrier futures
+        """
+        trades = []
+
+        for item in items:
+
+            if isinstance(item, tuple):
+                trades.append(item)
+
+            else:
+                self._record_trades(trades)
+                trades = []
+
+                if not item.done():  # unless the connection has gone
+                    item.set_result(None)
+
+        self._record_trades(trades)
+
+    def _record_trades(self, trades):
+        """ record list of (stock, trade_type, quantity, price) tuples
+
+        @param trades - list of trade tuples
+        """
+
+        if not trades:
+            return
+
+        try:
+            self.market.record_trades(*zip(*trades))
+
+        except Exception:
+            # keep the ingest task running, or barriers would never resolve
+            _log.exception("failed to record %d trades", len(trades))
+
+
+def _parse_stock(args):
+    """ return Stock object for STOCK command arguments
+
+    @param args - list of name, last dividend, par value and optional fixed
+      dividend fields
+    """
+    usage = "usage: STOCK name last_dividend par_value [fixed_dividend]"
+    assert_true(len(args) in (3, 4), usage)
+    name, last_dividend, par_value = args[0], args[1], args[2]
+    fixed_dividend = float(args[3]) if len(args) == 4 else None
+    return Stock(name, parse_number(last_dividend), parse_number(par_value),
+                 fixed_dividend)
+
+
+def _parse_period(args):
+    """ return (t1, t2) tuple for optional period arguments, or None
+
+    @param args - empty list or list of t1 and t2 fields
+    """
+    return tuple(map(parse_number, args)) if args else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="serve a market over a line based socket protocol"
+        )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8642)
+    parser.add_argument("--unix", help="listen on Unix socket at this path")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    async def serve():
+        server = TradeServer(None, args.queue_size, args.batch_size)
+        listener = await server.start(args.host, args.port, args.unix)
+
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
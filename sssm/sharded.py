@@ -0,0 +1,479 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+from itertools import chain
+import math
+import multiprocessing
+import zlib
+
+from sssm.index import all_share_index
+from sssm.market import Market, _default_period, _five_minutes, \
+    _group_by_stock, _quantiles
+from sssm.rankings import _measures
+from sssm.trade import Trade
+from sssm.utils import assert_true, Error
+
+
+class ShardedMarket(Market):
+    """ market with its stocks partitioned by name between worker processes,
+    each of which owns a Market holding the trades for its stocks.
+
+    Trades are validated, given ids and timestamps and journaled here, then
+    buffered and sent to the owning worker in batches, so recording a trade
+    doesn't wait for a worker. Anything that reads trades sends the buffered
+    trades first, so it sees every trade recorded before it. VWSP is
+    calculated by the owning worker. The all share index is combined from the
+    index terms of every worker (see Market.calculate_gbce_asi_terms), which
+    are calculated in parallel.
+
+    Call close(), or use as a context manager, to stop the workers.
+    """
+
+    def __init__(self, shards=None, batch_size=1000, metrics=False,
+                 clock=None, ids=None, journal=None, **kwargs):
+        """ constructor
+
+        @param shards - optional number of worker processes (default is the
+          number of CPUs)
+        @param batch_size - number of trades buffered for a worker before they
+          are sent to it
+        @param metrics - time calls made to this market, see
+          Market.enable_metrics
+        @param clock - optional function returning the time in microseconds,
+          see Market, which is only called here
+        @param ids - optional ids.IdAllocator to give new trades ids from, see
+          Market, which is only used here
+        @param journal - optional journal.Journal object to write each trade
+          to before it is sent to a worker, see Market
+        @param kwargs - passed to each worker's Market constructor, so must be
+          picklable if processes are spawned rather than forked
+        """
+        Market.__init__(self, metrics=metrics,
+                        columnar=kwargs.get("columnar", False),
+                        bar_resolutions=kwargs.get("bar_resolutions"),
+                        clock=clock, ids=ids, journal=journal,
+                        sketch_resolution=kwargs.get("sketch_resolution"))
+        self.batch_size = batch_size
+        self._shards = [_Shard(kwargs) for _ in
+                        range(shards or multiprocessing.cpu_count())]
+        self._owners = {}  # stock name -> _Shard
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ send any buffered trades and stop the worker processes """
+
+        for shard in self._shards:
+            shard.close()
+
+    def add_stock(self, stock):
+        """ add a given stock to the market and its owning worker.
+
+        @param stock - Stock object
+        """
+        Market.add_stock(self, stock)
+        name = stock.get_name()
+        shard = self._shards[zlib.crc32(name.encode()) % len(self._shards)]
+        shard.call("add_stock", stock)
+        self._owners[name] = shard
+
+    def record_trade(self, stock, trade_type, quantity, price):
+        """ create new trade, as Market.record_trade, and buffer it to be sent
+        to the stock's worker.
+
+        @param stock - name of the stock
+        @param trade_type - buy or sell indicator (Trade.BUY / Trade.SELL)
+        @param quantity - quantity traded
+        @param price - price traded at
+        """
+        self.validate_trade(stock, trade_type, quantity, price)
+        trade_id = self._next_id()
+        ts = self.clock()
+        trade = Trade(trade_id, stock, trade_type, quantity, price, ts)
+
+        if self.journal:
+            self.journal.append(trade)
+
+        row = (stock, trade_id, trade_type, quantity, price, ts)
+        self._owners[stock].buffer(row, self.batch_size)
+        return trade
+
+    def record_trades(self, stocks, trade_types, quantities, prices):
+        """ record a batch of trades, as Market.record_trades, buffering each
+        to be sent to its stock's worker.
+
+        @param stocks - sequence of stock names
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        """
+        self.validate_trades(stocks, trade_types, quantities, prices)
+        n = len(stocks)
+        trade_ids = self._reserve_ids(n)
+        timestamps = [self.clock()] * n
+        owners = self._owners
+
+        if self.journal:
+            columns = (trade_ids, trade_types, quantities, prices, timestamps)
+
+            for stock, stock_columns in _group_by_stock(stocks, columns):
+                self.journal.extend(stock, *stock_columns)
+
+        for row in zip(stocks, trade_ids, trade_types, quantities, prices,
+                       timestamps):
+            owners[row[0]].buffer(row, self.batch_size)
+
+        return trade_ids
+
+    def load_trades(self, stock, trade_ids, trade_types, quantities, prices,
+                    timestamps):
+        """ store trades that already have ids and timestamps in the stock's
+        worker, see Market.load_trades
+
+        @param stock - name of the stock
+        @param trade_ids - sequence of unique trade ids
+        @param trade_types - sequence of Trade.BUY / Trade.SELL indicators
+        @param quantities - sequence of quantities traded
+        @param prices - sequence of prices traded at
+        @param timestamps - sequence of integer timestamps
+        """
+        columns = (trade_ids, trade_types, quantities, prices, timestamps)
+        self._owner(stock).call("load_trades", stock, *map(list, columns))
+
+    def get_trades(self, stock, period=None):
+        """ get all trades for the given stock from its worker, see
+        Market.get_trades
+
+        @param stock - name of the stock
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all trades)
+        """
+
+        if stock not in self._owners:
+            return []
+
+        return self._owners[stock].call("get_trades", stock, period)
+
+    def _trades_chunk(self, stock, start, end, skip, n):
+        """ return chunk of trades for iter_trades from the stock's worker, see
+        Market._trades_chunk
+
+        @param stock - name of the stock
+        @param start - time in microseconds of first trade
+        @param end - time in microseconds after last trade
+        @param skip - number of trades to skip
+        @param n - maximum number of trades to return
+        """
+
+        if stock not in self._owners:
+            return []
+
+        return self._owners[stock].call("_trades_chunk", stock, start, end,
+                                        skip, n)
+
+    def get_bars(self, stock, resolution, period=None):
+        """ get OHLCV bars for the given stock from its worker, see
+        Market.get_bars
+
+        @param stock - name of the stock
+        @param resolution - length of bars in microseconds
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          all bars)
+        """
+        assert_true(resolution in self.bar_resolutions,
+                    "unknown resolution: %s", resolution)
+
+        if stock not in self._owners:
+            return []
+
+        return self._owners[stock].call("get_bars", stock, resolution, period)
+
+    def get_quantiles(self, stock, fractions=_quantiles, period=None):
+        """ get approximate price and size quantiles for the given stock
+        from its worker, see Market.get_quantiles
+
+        @param stock - name of the stock
+        @param fractions - sequence of fractions from 0 to 1 (default is 0.01,
+          0.5 and 0.99)
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          last five minutes)
+        """
+        assert_true(self.sketch_resolution, "quantile sketches are not kept")
+
+        if stock not in self._owners:
+            return None
+
+        period = period or _default_period(self.clock())
+        return self._owners[stock].call("get_quantiles", stock, fractions,
+                                        period)
+
+    def _rolling_segments(self, stock, start, step, n, window):
+        """ return runs of samples with the same vwsp for the given stock from
+        its worker, see Market._rolling_segments
+
+        @param stock - name of the stock
+        @param start - time of first sample in microseconds
+        @param step - time between samples in microseconds
+        @param n - number of samples
+        @param window - length of window before each sample in microseconds
+        """
+
+        if stock not in self._owners:
+            return []
+
+        return self._owners[stock].call("_rolling_segments", stock, start,
+                                        step, n, window)
+
+    def calculate_vwsp(self, stock, period=None):
+        """ calculate volume weighted stock price in the stock's worker, see
+        Market.calculate_vwsp
+
+        @param stock - name of the stock
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          last five minutes)
+        """
+
+        if stock not in self._owners:
+            return None
+
+        period = period or _default_period(self.clock())
+        return self._owners[stock].call("calculate_vwsp", stock, period)
+
+    def calculate_gbce_asi(self, period=None):
+        """ calculate GBCE all share index over all workers, see
+        Market.calculate_gbce_asi
+
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          last five minutes)
+        """
+        return all_share_index(*self.calculate_gbce_asi_terms(period))
+
+    def calculate_gbce_asi_terms(self, period=None, now=None):
+        """ return terms of the GBCE all share index summed over all workers,
+        see Market.calculate_gbce_asi_terms
+
+        @param period - optional tuple of (t1, t2) in microseconds (default is
+          five minutes before now)
+        @param now - optional time in microseconds for default period (default
+          is now)
+        """
+        now = self.clock() if now is None else now
+        terms = self._gather("calculate_gbce_asi_terms", period or None, now)
+        log_sums, zeros, counts = zip(*terms)
+        return math.fsum(log_sums), sum(zeros), sum(counts)
+
+    def get_top(self, by, n=20, ascending=False, now=None):
+        """ return the n stocks ranked highest by the given measure, see
+        Market.get_top, merged from the top n of every worker
+
+        @param by - "volume", "trades" or "vwsp_change"
+        @param n - number of stocks (default is 20)
+        @param ascending - rank lowest values first
+        @param now - optional time in microseconds the window ends at
+          (default is now)
+        """
+        assert_true(by in _measures, "unknown ranking: %s", by)
+        assert_true(n >= 0, "invalid n: %s", n)
+        now = self.clock() if now is None else now
+        tops = self._gather("get_top", by, n, ascending, now)
+        return sorted(chain.from_iterable(tops), key=_ranking_order,
+                      reverse=ascending)[:n]
+
+    def rolling_gbce_asi_terms(self, start, end, step, window=_five_minutes):
+        """ return terms of the rolling GBCE all share index summed over all
+        workers, see Market.rolling_gbce_asi_terms
+
+        @param start - time of first sample in microseconds
+        @param end - time after last sample in microseconds
+        @param step - time between samples in microseconds
+        @param window - length of window before each sample in microseconds
+          (default is five minutes)
+        """
+        terms = self._gather("rolling_gbce_asi_terms", start, end, step,
+                             window)
+        log_sums, zeros, counts = zip(*terms)
+        return (array("d", map(math.fsum, zip(*log_sums))),
+                array("q", map(sum, zip(*zeros))),
+                array("q", map(sum, zip(*counts))))
+
+    def evict(self, now=None):
+        """ evict trades older than the retention period in all workers, see
+        Market.evict
+
+        @param now - optional time in microseconds (default is now)
+        """
+        now = self.clock() if now is None else now
+        self._gather("evict", now)
+
+    def subscribe_vwsp(self, stock, callback, when=None):
+        """ not supported, as trades are stored by the workers """
+        raise Error("subscriptions are not supported by ShardedMarket")
+
+    def subscribe_gbce_asi(self, callback, when=None):
+        """ not supported, as trades are stored by the workers """
+        raise Error("subscriptions are not supported by ShardedMarket")
+
+    def stats(self):
+        """ return snapshot of metrics, see Market.stats, with the trades held
+        and memory used by every worker """
+        stats = Market.stats(self)
+
+        for worker_stats in self._gather("stats"):
+            stats["trades_per_stock"].update(worker_stats["trades_per_stock"])
+            stats["memory_bytes"] += worker_stats["memory_bytes"]
+
+        stats["trades"] = sum(stats["trades_per_stock"].values())
+        return stats
+
+    def _owner(self, stock):
+        """ return _Shard owning the given stock, or raise Error if unknown
+
+        @param stock - name of the stock
+        """
+        assert_true(stock in self._owners, "unknown stock: %r", stock)
+        return self._owners[stock]
+
+    def _gather(self, method, *args):
+        """ call method on every worker's market in parallel and return list
+        of results
+
+        @param method - name of Market method
+        @param args - arguments to pass to method
+        """
+
+        for shard in self._shards:
+            shard.send(method, args)
+
+        return [shard.receive() for shard in self._shards]
+
+
+class _Shard(object):
+    """ worker process owning a Market, and the trades buffered for it """
+
+    def __init__(self, kwargs):
+        """ constructor
+
+        @param kwargs - passed to worker's Market constructor
+        """
+        self.rows = []
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(child, kwargs), daemon=True
+            )
+        self.process.start()
+        child.close()
+
+    def buffer(self, row, batch_size):
+        """ buffer (stock, id, type, quantity, price, timestamp) row, sending
+        the buffered rows once there are batch_size of them
+
+        @param row - tuple of trade values
+        @param batch_size - number of rows to buffer
+        """
+        self.rows.append(row)
+
+        if len(self.rows) >= batch_size:
+            self.flush()
+
+    def flush(self):
+        """ send buffered rows to the worker without waiting for a reply """
+
+        if self.rows:
+            self.conn.send(("_load_rows", (self.rows,), False))
+            self.rows = []
+
+    def send(self, method, args):
+        """ send buffered rows and then a method call to the worker
+
+        @param method - name of Market method
+        @param args - tuple of arguments to pass to method
+        """
+        self.flush()
+        self.conn.send((method, args, True))
+
+    def receive(self):
+        """ return result of the last method sent, raising any error """
+        error, result = self.conn.recv()
+
+        if error is not None:
+            raise error
+
+        return result
+
+    def call(self, method, *args):
+        """ call method on the worker's market and return the result
+
+        @param method - name of Market method
+        @param args - arguments to pass to method
+        """
+        self.send(method, args)
+        return self.receive()
+
+    def close(self):
+        """ send buffered rows and stop the worker """
+
+        if self.process.is_alive():
+            self.flush()
+            self.conn.send((None, (), False))
+            self.process.join()
+
+        self.conn.close()
+
+
+def _serve(conn, kwargs):
+    """ worker process main loop, calling methods of its market as they are
+    received until told to stop. An error from a call that isn't waited for
+    is raised by the next call that is.
+
+    @param conn - Connection to parent process
+    @param kwargs - passed to Market constructor
+    """
+    market = Market(**kwargs)
+    error = None
+
+    while True:
+        method, args, reply = conn.recv()
+
+        if method is None:
+            break
+
+        result = None
+
+        try:
+            if method == "_load_rows":
+                _load_rows(market, *args)
+            else:
+                result = getattr(market, method)(*args)
+
+        except Exception as e:
+            error = error or e
+
+        if reply:
+            conn.send((error, result))
+            error = None
+
+
+def _ranking_order(top):
+    """ return sort key of a (stock name, value) tuple from Market.get_top,
+    highest value first, then in name order """
+    return -top[1], top[0]
+
+
+def _load_rows(market, rows):
+    """ load list of (stock, id, type, quantity, price, timestamp) rows into
+    market
+
+    @param market - Market object
+    @param rows - list of tuples of trade values
+    """
+    stocks, *columns = zip(*rows)
+
+    for stock, stock_columns in _group_by_stock(stocks, columns):
+        market.load_trades(stock, *stock_columns)
@@ -0,0 +1,331 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+import math
+
+from sssm.bars import BucketSeries
+from sssm.utils import assert_true
+
+_k = 200  # default size of the largest compactor of a QuantileSketch
+_c = 2 / 3  # ratio of the size of each compactor to the one above it
+_min_capacity = 8  # smallest size of a compactor
+
+
+class QuantileSketch(object):
+    """ mergeable quantile sketch of a stream of values in bounded memory, as
+    the KLL sketch of Karnin, Lang and Liberty.
+
+    Values are kept in a stack of compactors, typed arrays of values each
+    standing for 2 ** level of the values added. When a compactor is full
+    it is sorted and every other value is promoted to the one above, so the
+    number of values kept stays below about 3 * k however many are added,
+    8 bytes each. Which half is promoted alternates, rather than being
+    random, so results are reproducible.
+
+    Quantiles are exact until a compactor first fills, after about k values.
+    After that the rank of a quantile returned is within about 2 / k of the
+    fraction asked for with high probability, e.g. 1% of the values for the
+    default k of 200, see bench_quantiles. The smallest and largest values
+    are always exact. Sketches merged, or queried together with
+    quantiles_of, have the same relative error bound.
+    """
+
+    def __init__(self, k=_k):
+        """ constructor
+
+        @param k - size of the largest compactor, trading memory for accuracy
+        """
+        assert_true(k >= _min_capacity, "invalid k: %s", k)
+        self.k = k
+        self.levels = [array("d")]  # compactors, level h values weigh 2 ** h
+        self.count = 0  # number of values added, the total weight
+        self.min = None
+        self.max = None
+        self._offsets = [0]  # which half of each compactor is promoted next
+        self._size = 0  # number of values kept
+        self._limit = self._capacity(0)  # number kept at which to compress
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        """ add value to the sketch
+
+        @param value - the value
+        """
+        self.levels[0].append(value)
+        self.count += 1
+        self._size += 1
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if self._size >= self._limit:
+            self._compress()
+
+    def extend(self, values):
+        """ add each of the given values to the sketch
+
+        @param values - sequence of values
+        """
+
+        if not len(values):
+            return
+
+        self.levels[0].extend(iter(values))
+        self.count += len(values)
+        self._size += len(values)
+        self._bounds(min(values), max(values))
+        self._compress()
+
+    def merge(self, other):
+        """ add the values summarized by another sketch to this one
+
+        @param other - QuantileSketch object
+        """
+
+        if not other.count:
+            return
+
+        depth = len(self.levels)
+
+        for h, level in enumerate(other.levels):
+
+            if h == len(self.levels):
+                self.levels.append(array("d"))
+                self._offsets.append(0)
+
+            self.levels[h].extend(level)
+
+        if len(self.levels) > depth:
+            self._limit = sum(map(self._capacity, range(len(self.levels))))
+
+        self.count += other.count
+        self._size += other._size
+        self._bounds(other.min, other.max)
+        self._compress()
+
+    def get_quantiles(self, fractions):
+        """ return list of the values at the given fractions of the way
+        through the values added, or None if there are none, see
+        quantiles_of
+
+        @param fractions - sequence of fractions from 0 to 1, e.g. 0.5 for the
+          median
+        """
+        return quantiles_of([self], fractions)
+
+    def nbytes(self):
+        """ return approximate memory used by the values kept in bytes """
+        return sum(level.itemsize * len(level) for level in self.levels)
+
+    def _bounds(self, low, high):
+        """ widen the smallest and largest values to include low and high
+
+        @param low - smallest value added
+        @param high - largest value added
+        """
+
+        if self.min is None or low < self.min:
+            self.min = low
+
+        if self.max is None or high > self.max:
+            self.max = high
+
+    def _capacity(self, h):
+        """ return the number of values compactor h holds before it is
+        compacted, which shrinks geometrically below the top one
+
+        @param h - level of the compactor
+        """
+        depth = len(self.levels) - 1 - h
+        return max(_min_capacity, int(self.k * _c ** depth))
+
+    def _compress(self):
+        """ compact full compactors until the values kept fit """
+
+        while self._size >= self._limit:
+
+            for h, level in enumerate(self.levels):
+
+                if len(level) >= self._capacity(h):
+                    self._compact(h)
+                    break
+
+    def _compact(self, h):
+        """ sort compactor h and promote half of its values, or all but one
+        if it holds an odd number, to the compactor above
+
+        @param h - level of the compactor
+        """
+
+        if h + 1 == len(self.levels):
+            self.levels.append(array("d"))
+            self._offsets.append(0)
+            self._limit = sum(map(self._capacity, range(len(self.levels))))
+
+        values = sorted(self.levels[h])
+        n = len(values) - len(values) % 2
+        offset = self._offsets[h]
+        self._offsets[h] ^= 1
+        self.levels[h + 1].extend(values[offset:n:2])
+        self.levels[h] = array("d", values[n:])
+        self._size -= n // 2
+
+
+def quantiles_of(sketches, fractions):
+    """ return list of the values at the given fractions of the way through
+    the values added to all of the given sketches together, or None if there
+    are none. Rather than merging them, which compacts them further, the
+    values kept by every sketch are queried together, so the error is no
+    more than that of the sketches.
+
+    The value for a fraction q is the smallest value with at least q of the
+    values at or below it, so with the values 1 to 100 the median (0.5) is 50.
+
+    @param sketches - sequence of QuantileSketch objects
+    @param fractions - sequence of fractions from 0 to 1
+    """
+    sketches = [sketch for sketch in sketches if sketch.count]
+
+    if not sketches:
+        return None
+
+    for q in fractions:
+        assert_true(0 <= q <= 1, "invalid fraction: %s", q)
+
+    depth = max(len(sketch.levels) for sketch in sketches)
+    levels = [sorted(chain.from_iterable(
+        sketch.levels[h] for sketch in sketches if h < len(sketch.levels)
+        )) for h in range(depth)]
+    count = sum(sketch.count for sketch in sketches)
+    low = min(sketch.min for sketch in sketches)
+    high = max(sketch.max for sketch in sketches)
+
+    if depth == 1:
+        # nothing has been compacted, so the values are exact
+        values = levels[0]
+        return [values[max(0, math.ceil(q * count) - 1)] for q in fractions]
+
+    values = sorted(chain.from_iterable(levels))
+
+    def rank(value):
+        return sum(bisect_right(level, value) << h
+                   for h, level in enumerate(levels))
+
+    quantiles = []
+
+    for q in fractions:
+
+        if q == 0 or q == 1:
+            quantiles.append(low if q == 0 else high)
+            continue
+
+        # smallest value whose rank reaches q of the values
+        target = q * count
+        lo, hi = 0, len(values) - 1
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if rank(values[mid]) >= target:
+                hi = mid
+
+            else:
+                lo = mid + 1
+
+        quantiles.append(values[lo])
+
+    return quantiles
+
+
+class QuantileSeries(BucketSeries):
+    """ quantile sketches of the prices and sizes of a single stock's trades,
+    one pair per time bucket, updated as trades are recorded and kept in
+    order of bucket start time. Quantiles over any period are found by
+    querying the sketches of the buckets it overlaps together.
+
+    Memory is bounded by the number of buckets held, so by the market's
+    retention over the resolution, not by the number of trades: each bucket
+    keeps at most about 3 * k prices and sizes, 8 bytes each, or fewer if it
+    has fewer trades.
+    """
+
+    def __init__(self, resolution, k=_k):
+        """ constructor
+
+        @param resolution - length of each bucket in microseconds
+        @param k - size of the largest compactor of each sketch, see
+          QuantileSketch
+        """
+        super().__init__(resolution)
+        self.k = k
+        self.prices = []  # QuantileSketch of prices for each bucket
+        self.quantities = []  # QuantileSketch of quantities for each bucket
+
+    def add(self, ts, price, quantity):
+        """ add a trade to the sketches of the bucket for its time
+
+        @param ts - time of trade in microseconds
+        @param price - price traded at
+        @param quantity - quantity traded
+        """
+        i = self._bucket(ts - ts % self.resolution)
+        self.prices[i].add(price)
+        self.quantities[i].add(quantity)
+
+    def _extend_bucket(self, start, first, last, timestamps, prices,
+                       quantities):
+        """ add trades that are all in the bucket starting at start to its
+        sketches in one go, see BucketSeries.extend """
+        i = self._bucket(start)
+        self.prices[i].extend(prices)
+        self.quantities[i].extend(quantities)
+
+    def get_quantiles(self, fractions, period):
+        """ return tuple of lists of the price and quantity quantiles of
+        trades in the buckets overlapping period, see quantiles_of, or None if
+        there are no trades in them
+
+        @param fractions - sequence of fractions from 0 to 1
+        @param period - tuple of (t1, t2) in microseconds, where t1 <= t < t2
+        """
+        lo = bisect_left(self.starts, period[0] - self.resolution + 1)
+        hi = bisect_left(self.starts, period[1], lo)
+        prices = quantiles_of(self.prices[lo:hi], fractions)
+
+        if prices is None:
+            return None
+
+        return prices, quantiles_of(self.quantities[lo:hi], fractions)
+
+    def nbytes(self):
+        """ return approximate memory used by the sketches in bytes """
+        return sum(sketch.nbytes() for sketch in chain(self.prices,
+                                                       self.quantities))
+
+    def _bucket(self, start):
+        """ return index of the bucket starting at start, creating it if there
+        isn't one
+
+        @param start - start of the bucket in microseconds
+        """
+        i, found = self._find(start)
+
+        if not found:
+            self.starts.insert(i, start)
+            self.prices.insert(i, QuantileSketch(self.k))
+            self.quantities.insert(i, QuantileSketch(self.k))
+
+        return i
+
+    def _columns(self):
+        return self.starts, self.prices, self.quantities
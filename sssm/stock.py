@@ -63,7 +63,7 @@ class Stock(object):
         
         @param price - the price in pennies
         """
-        assert_true(price > 0, "invalid price: %s" % price)
+        assert_true(price > 0, "invalid price: %s", price)
 
     def calculate_dividend_yield(self, price):
         """ calculate dividend yield for this stock at the given price.
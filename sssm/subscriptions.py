@@ -0,0 +1,119 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+import threading
+
+
+class Subscription(object):
+    """ interest in a stock's volume weighted stock price, or the all share
+    index, over the moving window ending now, see Market.subscribe_vwsp and
+    Market.subscribe_gbce_asi.
+
+    Without a condition, the callback is called with each new value that
+    differs from the last one. With a condition, e.g. lambda vwsp: vwsp > 120,
+    it is only called when the condition becomes true, having been false,
+    so a threshold is reported once each time it is crossed.
+    """
+
+    def __init__(self, stock, callback, when=None):
+        """ constructor
+
+        @param stock - name of the stock, or None for the all share index
+        @param callback - function called as callback(value, now)
+        @param when - optional condition function called as when(value)
+        """
+        self.stock = stock
+        self.callback = callback
+        self.when = when
+        self.value = None  # last value seen
+        self.active = False  # whether the condition held for the last value
+
+    def start(self, value):
+        """ set the value at the time of subscribing, without notifying
+
+        @param value - the current value, or None if there isn't one
+        """
+        self.value = value
+        self.active = self._holds(value)
+
+    def update(self, value, now):
+        """ notify the subscriber of value if it changed, or if the
+        condition has become true
+
+        @param value - the new value, or None if there isn't one
+        @param now - time in microseconds the value is for
+        """
+
+        if self.when is None:
+            notify = value != self.value
+
+        else:
+            active = self._holds(value)
+            notify = active and not self.active
+            self.active = active
+
+        self.value = value
+
+        if notify:
+            self.callback(value, now)
+
+    def _holds(self, value):
+        """ return whether the condition holds for value
+
+        @param value - the value, or None if there isn't one
+        """
+        return self.when is not None and value is not None and \
+            bool(self.when(value))
+
+
+class Subscriptions(object):
+    """ a market's subscriptions, by stock and to the all share index.
+    Updates are serialized by a re-entrant lock, so a callback may record
+    trades or change subscriptions.
+    """
+
+    def __init__(self):
+        """ constructor """
+        self.stocks = {}  # stock name -> list of its Subscriptions
+        self.index = []  # Subscriptions to the all share index
+        self.count = 0
+        self.lock = threading.RLock()
+
+    def add(self, subscription):
+        """ add subscription
+
+        @param subscription - Subscription object
+        """
+
+        with self.lock:
+            self._list(subscription.stock).append(subscription)
+            self.count += 1
+
+    def remove(self, subscription):
+        """ remove subscription if it is present
+
+        @param subscription - Subscription object
+        """
+
+        with self.lock:
+            subscriptions = self._list(subscription.stock)
+
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+                self.count -= 1
+
+            if not subscriptions and subscription.stock is not None:
+                del self.stocks[subscription.stock]
+
+    def _list(self, stock):
+        """ return list of subscriptions for stock, or the index if None
+
+        @param stock - name of the stock, or None
+        """
+
+        if stock is None:
+            return self.index
+
+        return self.stocks.setdefault(stock, [])
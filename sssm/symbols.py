@@ -0,0 +1,73 @@
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+from bisect import bisect_left, insort
+import sys
+
+from sssm.utils import assert_true
+
+
+class SymbolTable(object):
+    """ stock names with dense integer ids, assigned from 0 in the order the
+    names are added, and kept in sorted order as they are added, so that
+    listing them in order doesn't sort them.
+
+    Names are interned, so that every trade for a stock refers to the same
+    string object rather than a copy, and dict lookups by name compare
+    strings by identity.
+    """
+
+    def __init__(self):
+        """ constructor """
+        self.ids = {}  # name -> id
+        self.names = []  # id -> name
+        self.sorted_names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def add(self, name):
+        """ add name and return its id
+
+        @param name - name of the stock
+        """
+        assert_true(name not in self.ids, "duplicate stock: %r", name)
+        name = sys.intern(name)
+        stock_id = len(self.names)
+        self.ids[name] = stock_id
+        self.names.append(name)
+        insort(self.sorted_names, name)
+        return stock_id
+
+    def get_id(self, name):
+        """ return id of name, or None if unknown
+
+        @param name - name of the stock
+        """
+        return self.ids.get(name)
+
+    def get_name(self, stock_id):
+        """ return the interned name with the given id
+
+        @param stock_id - id of the stock
+        """
+        return self.names[stock_id]
+
+    def intern(self, name):
+        """ return the interned copy of name, which must have been added
+
+        @param name - name of the stock
+        """
+        return self.names[self.ids[name]]
+
+    def rank(self, name):
+        """ return position of name in sorted order
+
+        @param name - name of the stock
+        """
+        return bisect_left(self.sorted_names, name)
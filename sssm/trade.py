@@ -50,6 +50,22 @@ class Trade(object):
     def get_total_amount(self):
         return self.price * self.quantity
 
+    def _key(self):
+        return (
+            self.id,
+            self.stock,
+            self.trade_type,
+            self.quantity,
+            self.price,
+            self.timestamp
+            )
+
+    def __eq__(self, other):
+        return isinstance(other, Trade) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self.id)
+
     def __str__(self):
 
         args = (
@@ -4,6 +4,9 @@ Created on 11 Apr 2018
 @author: conor
 '''
 
+import math
+import sys
+import threading
 import time
 
 
@@ -31,34 +34,84 @@ def geometric_mean(ps):
     for p in ps[1:]:
         x *= p
 
-    return x ** (1 / len(ps))
+    if 0 < x <= sys.float_info.max:
+        return x ** (1 / len(ps))
+
+    if 0 in ps:
+        return 0.0
+
+    # product has overflowed or underflowed so work in log space instead
+    return math.exp(math.fsum(map(math.log, ps)) / len(ps))
 
 
 _auto_increment_value = 0
+_auto_increment_lock = threading.Lock()
 
 
 def auto_increment():
-    """ return auto_incrementing integer """
+    """ return auto_incrementing integer, safe to call from any thread """
+    global _auto_increment_value
+
+    with _auto_increment_lock:
+        _auto_increment_value += 1
+        return _auto_increment_value - 1
+
+
+def reserve_auto_increment(n):
+    """ return range of the next n auto incrementing integers
+
+    @param n - number of integers to reserve
+    """
+    global _auto_increment_value
+
+    with _auto_increment_lock:
+        _auto_increment_value += n
+        return range(_auto_increment_value - n, _auto_increment_value)
+
+
+def advance_auto_increment(value):
+    """ make sure auto incrementing integers continue from at least value,
+    e.g. after loading trades with existing ids
+
+    @param value - lowest value for the next auto incrementing integer
+    """
     global _auto_increment_value
-    _auto_increment_value += 1
-    return _auto_increment_value - 1
+
+    with _auto_increment_lock:
+        _auto_increment_value = max(_auto_increment_value, value)
 
 
 def reset_auto_increment():
     """ reset auto incrementing integer to zero for testing """
     global _auto_increment_value
-    _auto_increment_value = 0
+
+    with _auto_increment_lock:
+        _auto_increment_value = 0
+
+
+def parse_number(field):
+    """ return int or float value of field
+
+    @param field - string to parse
+    """
+
+    try:
+        return int(field)
+
+    except ValueError:
+        return float(field)
 
 
-def assert_true(cond, err):
+def assert_true(cond, err, *args):
     """ assert given condition is True otherwise raise given error
         
     @param cond - condition that must be true
     @param err - error message to raise if condition found to be False
+    @param args - optional values to format err with, only if it is raised
     """
 
     if not cond:
-        raise Error(err)
+        raise Error(err % args if args else err)
 
 
 class Error(Exception):
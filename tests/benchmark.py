@@ -0,0 +1,1486 @@
+#!/usr/bin/env python3
+'''
+Created on 18 Oct 2026
+
+@author: conor
+'''
+import argparse
+import asyncio
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+import heapq
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from sssm import utils
+from sssm.analytics import StockUniverse
+from sssm.bulk import export_binary, export_csv, load_binary, load_csv
+from sssm.cache import ResultCache
+from sssm.clock import VirtualClock
+from sssm.ids import IdAllocator, Snowflake
+from sssm.ingest import Ingestor
+from sssm.journal import Journal, restore
+from sssm.market import Market, _group_by_stock
+from sssm.replay import Replay
+from sssm.sharded import ShardedMarket
+from sssm.stock import Stock
+from sssm.trade import Trade
+
+
+def scan_vwsp(market, stock, period):
+    """ reference volume weighted stock price, calculated by scanning every
+    trade in the period as Market.calculate_vwsp used to.
+
+    @param market - the Market object
+    @param stock - name of the stock
+    @param period - tuple of (t1, t2) in microseconds
+    """
+    trades = market.get_trades(stock, period)
+
+    if trades:
+        top = sum([trade.get_total_amount() for trade in trades])
+        bottom = sum([trade.get_quantity() for trade in trades])
+        return float(top) / bottom
+
+    else:
+        return None
+
+
+def timed(func, *args):
+    """ return tuple of (result, elapsed seconds) for calling func(*args) """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def build_market(n_trades, n_stocks=10, seed=0, columnar=False):
+    """ return market with n_trades random trades spread over n_stocks stocks,
+    one trade per microsecond starting at the epoch.
+
+    @param n_trades - number of trades to record
+    @param n_stocks - number of stocks in the market
+    @param seed - random seed
+    @param columnar - passed to Market constructor
+    """
+    rand = random.Random(seed)
+    market = Market(columnar=columnar)
+    names = ["S%04d" % i for i in range(n_stocks)]
+
+    for name in names:
+        market.add_stock(Stock(name, 8, 100))
+
+    saved = utils._micros_since_epoch
+    clock = iter(range(n_trades))
+    utils._micros_since_epoch = lambda: next(clock)
+
+    try:
+        for _ in range(n_trades):
+            market.record_trade(
+                rand.choice(names),
+                rand.choice((Trade.BUY, Trade.SELL)),
+                rand.randint(1, 1000),
+                rand.randint(50, 150)
+                )
+
+    finally:
+        utils._micros_since_epoch = saved
+
+    return market
+
+
+def bench_vwsp(n_trades=10 ** 6, repeat=100):
+    """ compare running total VWSP against a scan of the period, over a short
+    window and over the whole tape.
+
+    @param n_trades - number of trades in the market
+    @param repeat - number of VWSP calls to time per case
+    """
+    market, elapsed = timed(build_market, n_trades)
+    print("recorded %d trades in %.2fs" % (n_trades, elapsed))
+
+    for label, period in [("window", (n_trades // 2, n_trades // 2 + 3000)),
+                          ("all", (0, n_trades))]:
+        expected = scan_vwsp(market, "S0000", period)
+        actual = market.calculate_vwsp("S0000", period)
+        assert expected == actual, (expected, actual)
+
+        _, scan = timed(lambda: [scan_vwsp(market, "S0000", period)
+                                 for _ in range(repeat)])
+        _, total = timed(lambda: [market.calculate_vwsp("S0000", period)
+                                  for _ in range(repeat)])
+
+        print("vwsp %-6s scan %10.1fus  running totals %6.1fus  (x%.0f)" % (
+            label,
+            10 ** 6 * scan / repeat,
+            10 ** 6 * total / repeat,
+            scan / total
+            ))
+
+
+def bench_memory(n_trades=10 ** 6):
+    """ compare memory used by Trade objects and columnar trade storage.
+
+    @param n_trades - number of trades in the market
+    """
+
+    for columnar in (False, True):
+        tracemalloc.start()
+        market, _ = timed(build_market, n_trades, 10, 0, columnar)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        _, vwsp = timed(market.calculate_vwsp, "S0000", (0, n_trades))
+
+        print("columnar=%-5s %7.1fMB  %5.1f bytes/trade  vwsp(all) %.1fms" % (
+            columnar, size / 10 ** 6, size / n_trades, 1000 * vwsp
+            ))
+
+
+def bench_gbce_asi(n_trades=10 ** 6, n_stocks=10 ** 4, repeat=100):
+    """ compare reading the incrementally maintained all share index for the
+    last five minutes with calculating it from scratch.
+
+    @param n_trades - number of trades in the market
+    @param n_stocks - number of stocks in the market
+    @param repeat - number of index calculations to time per case
+    """
+    market = build_market(n_trades, n_stocks)
+    names = sorted(market.stocks)
+    saved = utils._micros_since_epoch
+    now = n_trades
+
+    try:
+        utils._micros_since_epoch = lambda: now
+        period = (now - 300 * (10 ** 6), now)
+        assert abs(market.calculate_gbce_asi() /
+                   market.calculate_gbce_asi(period) - 1) < 1e-9
+
+        _, scratch = timed(lambda: [market.calculate_gbce_asi(period)
+                                    for _ in range(repeat)])
+
+        def trade_and_read():
+            nonlocal now
+
+            for i in range(repeat):
+                now += 1
+                market.record_trade(names[i % n_stocks], Trade.BUY, 10, 100)
+                market.calculate_gbce_asi()
+
+        _, incremental = timed(trade_and_read)
+
+    finally:
+        utils._micros_since_epoch = saved
+
+    print("gbce asi %d stocks  scratch %8.1fus  incremental %6.1fus" % (
+        n_stocks,
+        10 ** 6 * scratch / repeat,
+        10 ** 6 * incremental / repeat
+        ))
+
+
+def bench_ingest(n_trades=10 ** 6, n_stocks=100, batch_size=1000):
+    """ compare recording trades one at a time with recording them in batches
+
+    @param n_trades - number of trades to record
+    @param n_stocks - number of stocks in the market
+    @param batch_size - number of trades per batch
+    """
+    rand = random.Random(0)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    stocks = [rand.choice(names) for _ in range(n_trades)]
+    trade_types = [rand.randint(Trade.BUY, Trade.SELL) for _ in range(n_trades)]
+    quantities = [rand.randint(1, 1000) for _ in range(n_trades)]
+    prices = [rand.randint(50, 150) for _ in range(n_trades)]
+
+    for columnar in (False, True):
+        single, batched = Market(columnar=columnar), Market(columnar=columnar)
+
+        for name in names:
+            single.add_stock(Stock(name, 8, 100))
+            batched.add_stock(Stock(name, 8, 100))
+
+        def record_single():
+            for row in zip(stocks, trade_types, quantities, prices):
+                single.record_trade(*row)
+
+        def record_batched():
+            for i in range(0, n_trades, batch_size):
+                j = i + batch_size
+                batched.record_trades(
+                    stocks[i:j], trade_types[i:j], quantities[i:j], prices[i:j]
+                    )
+
+        _, t_single = timed(record_single)
+        _, t_batched = timed(record_batched)
+
+        print("ingest columnar=%-5s  record_trade %9.0f/s  "
+              "record_trades %9.0f/s" % (
+                  columnar, n_trades / t_single, n_trades / t_batched
+                  ))
+
+
+def bench_threads(n_trades=200000, n_stocks=100, max_threads=8):
+    """ report recording throughput of a concurrent market against number of
+    writer threads, each recording to its own stocks, with one thread reading
+    the all share index throughout.
+
+    @param n_trades - total number of trades to record per run
+    @param n_stocks - number of stocks in the market
+    @param max_threads - largest number of writer threads
+    """
+    n_threads = 1
+
+    while n_threads <= max_threads:
+        market = Market(concurrent=True)
+        names = ["S%04d" % i for i in range(n_stocks)]
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        def write(i):
+            own = names[i::n_threads]
+
+            for j in range(n_trades // n_threads):
+                market.record_trade(own[j % len(own)], Trade.BUY, 10, 100)
+
+        done = threading.Event()
+        reads = [0]
+
+        def read():
+            while not done.is_set():
+                market.calculate_gbce_asi()
+                reads[0] += 1
+
+        writers = [threading.Thread(target=write, args=(i,))
+                   for i in range(n_threads)]
+        reader = threading.Thread(target=read)
+        reader.start()
+        start = time.perf_counter()
+
+        for thread in writers:
+            thread.start()
+
+        for thread in writers:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+        done.set()
+        reader.join()
+
+        print("threads %d  %9.0f trades/s  %6.0f index reads/s" % (
+            n_threads, n_trades / elapsed, reads[0] / elapsed
+            ))
+
+        n_threads *= 2
+
+
+def bench_sharded(n_trades=10 ** 6, n_stocks=1000, batch_size=1000):
+    """ report batched recording throughput, and all share index latency,
+    against number of worker processes in a sharded market.
+
+    @param n_trades - number of trades to record per run
+    @param n_stocks - number of stocks in the market
+    @param batch_size - number of trades per record_trades call
+    """
+    rand = random.Random(0)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    stocks = [rand.choice(names) for _ in range(n_trades)]
+    trade_types = [Trade.BUY] * n_trades
+    quantities = [rand.randint(1, 1000) for _ in range(n_trades)]
+    prices = [rand.randint(50, 150) for _ in range(n_trades)]
+    shards = 1
+
+    while shards <= os.cpu_count():
+
+        with ShardedMarket(shards) as market:
+
+            for name in names:
+                market.add_stock(Stock(name, 8, 100))
+
+            start = time.perf_counter()
+
+            for i in range(0, n_trades, batch_size):
+                j = i + batch_size
+                market.record_trades(
+                    stocks[i:j], trade_types[i:j], quantities[i:j], prices[i:j]
+                    )
+
+            market.calculate_gbce_asi((0, 1))  # wait for workers to catch up
+            elapsed = time.perf_counter() - start
+            _, asi = timed(market.calculate_gbce_asi)
+
+        print("shards %2d  %9.0f trades/s  gbce asi %.1fms" % (
+            shards, n_trades / elapsed, 1000 * asi
+            ))
+
+        shards *= 2
+
+
+def bench_journal(n_trades=10 ** 7, n_stocks=1000, batch_size=1000):
+    """ journal trades recorded in batches and report time to restore them
+    into a columnar market.
+
+    @param n_trades - number of trades to journal
+    @param n_stocks - number of stocks in the market
+    @param batch_size - number of trades per record_trades call
+    """
+    rand = random.Random(0)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    stocks = [rand.choice(names) for _ in range(batch_size)]
+    quantities = [rand.randint(1, 1000) for _ in range(batch_size)]
+    prices = [rand.randint(50, 150) for _ in range(batch_size)]
+    trade_types = [Trade.BUY] * batch_size
+    path = os.path.join(tempfile.mkdtemp(), "trades.jnl")
+
+    def create_market(**kwargs):
+        market = Market(columnar=True, **kwargs)
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        return market
+
+    with Journal(path, commit_every=10 * batch_size) as journal:
+        market = create_market(journal=journal)
+
+        def record():
+            for _ in range(n_trades // batch_size):
+                market.record_trades(stocks, trade_types, quantities, prices)
+
+        _, elapsed = timed(record)
+
+    print("journal %d trades  %9.0f trades/s recorded  %.0fMB" % (
+        n_trades, n_trades / elapsed, os.path.getsize(path) / 10 ** 6
+        ))
+
+    del market
+    market = create_market()
+    count, elapsed = timed(restore, market, path)
+    assert count == n_trades
+    print("journal restored in %.2fs (%.0f trades/s)" % (
+        elapsed, n_trades / elapsed
+        ))
+    os.remove(path)
+
+
+def percentile(values, p):
+    """ return p'th percentile of values by nearest rank
+
+    @param values - list of numbers
+    @param p - percentile between 0 and 100
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def bench_server(n_batches=2000, batch_size=100, n_stocks=100):
+    """ run sssm.server in a subprocess and stream batches of trades to it
+    over a Unix socket, each followed by a VWSP query. Report the time from
+    sending a batch to its trades being queryable.
+
+    @param n_batches - number of batches to send
+    @param batch_size - number of trades per batch
+    @param n_stocks - number of stocks in the market
+    """
+    path = os.path.join(tempfile.mkdtemp(), "sssm.sock")
+    server = subprocess.Popen([sys.executable, "-m", "sssm.server",
+                               "--unix", path])
+
+    async def generate():
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+
+        reader, writer = await asyncio.open_unix_connection(path)
+        names = ["S%04d" % i for i in range(n_stocks)]
+        writer.write("".join("STOCK %s 8 100\n" % name
+                             for name in names).encode())
+
+        for _ in names:
+            await reader.readline()
+
+        latencies = []
+        start = time.perf_counter()
+
+        for i in range(n_batches):
+            lines = ["TRADE %s BUY 10 %d\n" % (names[(i + j) % n_stocks],
+                                                 90 + j % 20)
+                     for j in range(batch_size)]
+            sent = time.perf_counter()
+            writer.write("".join(lines).encode())
+            writer.write(b"VWSP S0000\n")
+            await reader.readline()
+            latencies.append(time.perf_counter() - sent)
+
+        elapsed = time.perf_counter() - start
+        writer.close()
+        return latencies, elapsed
+
+    try:
+        latencies, elapsed = asyncio.run(generate())
+
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("server %9.0f trades/s  batch of %d queryable after "
+          "p50 %.2fms  p99 %.2fms  max %.2fms" % (
+              n_batches * batch_size / elapsed,
+              batch_size,
+              1000 * percentile(latencies, 50),
+              1000 * percentile(latencies, 99),
+              1000 * max(latencies)
+              ))
+
+
+def bench_retention(rate=50000, seconds=60, retention=10, n_stocks=100):
+    """ soak test recording trades at a constant rate with a retention period
+    and report memory use, which should level off once the retention period
+    has passed.
+
+    @param rate - trades per (simulated) second
+    @param seconds - number of seconds to simulate
+    @param retention - retention period in seconds
+    @param n_stocks - number of stocks in the market
+    """
+    second = 10 ** 6
+    market = Market(retention=retention * second)
+    names = ["S%04d" % i for i in range(n_stocks)]
+
+    for name in names:
+        market.add_stock(Stock(name, 8, 100))
+
+    saved = utils._micros_since_epoch
+    now = 0
+    utils._micros_since_epoch = lambda: now
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    try:
+        for s in range(seconds):
+            for i in range(rate):
+                now = s * second + i * second // rate
+                market.record_trade(names[i % n_stocks], Trade.BUY, 10, 100)
+
+            if (s + 1) % retention == 0:
+                print("retention soak %3ds  %8.1fMB  %9d trades held" % (
+                    s + 1,
+                    tracemalloc.get_traced_memory()[0] / 10 ** 6,
+                    sum(len(series) for series in market.trades.values())
+                    ))
+
+    finally:
+        utils._micros_since_epoch = saved
+        tracemalloc.stop()
+
+    elapsed = time.perf_counter() - start
+    print("retention soak %.0f trades/s" % (rate * seconds / elapsed))
+
+
+def bench_analytics(n_stocks=1000, n_prices=1000):
+    """ compare scalar and batch dividend yield and P/E ratio calculations for
+    every stock at every price on a ladder.
+
+    @param n_stocks - number of stocks
+    @param n_prices - number of prices in the ladder
+    """
+    stocks = [Stock("S%04d" % i, i % 10, 100, [None, 0.02][i % 2])
+              for i in range(n_stocks)]
+    prices = [50 + i * 0.1 for i in range(n_prices)]
+
+    def scalar():
+        for stock in stocks:
+            [stock.calculate_dividend_yield(price) for price in prices]
+            [stock.calculate_pe_ratio(price) for price in prices]
+
+    def batch():
+        universe = StockUniverse(stocks)
+        universe.dividend_yield_ladder(prices)
+        universe.pe_ratio_ladder(prices)
+
+    _, scalar_elapsed = timed(scalar)
+    _, batch_elapsed = timed(batch)
+    print("analytics %d stocks x %d prices  scalar %.2fs  batch %.2fs  "
+          "(x%.0f)" % (n_stocks, n_prices, scalar_elapsed, batch_elapsed,
+                       scalar_elapsed / batch_elapsed))
+
+
+def bench_metrics(n_trades=10 ** 6, n_stocks=100):
+    """ compare record_trade and get_trades throughput with metrics disabled
+    and enabled.
+
+    @param n_trades - number of trades to record
+    @param n_stocks - number of stocks in the market
+    """
+    names = ["S%04d" % i for i in range(n_stocks)]
+
+    for metrics in (False, True):
+        market = Market(metrics=metrics)
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        def record():
+            for i in range(n_trades):
+                market.record_trade(names[i % n_stocks], Trade.BUY, 10, 100)
+
+        def query():
+            for i in range(n_trades // 10):
+                market.get_trades(names[i % n_stocks], (0, 1))
+
+        _, t_record = timed(record)
+        _, t_query = timed(query)
+        print("metrics=%-5s record_trade %9.0f/s  get_trades %9.0f/s" % (
+            metrics, n_trades / t_record, n_trades / 10 / t_query
+            ))
+
+
+def bench_iter(n_trades=10 ** 6, n_stocks=100):
+    """ compare peak memory and time of reading every trade in a columnar
+    market in time order, by sorting the lists from get_trades and with
+    iter_tape.
+
+    @param n_trades - number of trades in the market
+    @param n_stocks - number of stocks in the market
+    """
+    market = build_market(n_trades, n_stocks, columnar=True)
+
+    def get_trades():
+        trades = [trade for stock in market.stocks
+                  for trade in market.get_trades(stock)]
+        trades.sort(key=lambda trade: trade.get_timestamp())
+        return sum(1 for _ in trades)
+
+    def iter_tape():
+        return sum(1 for _ in market.iter_tape())
+
+    for label, func in [("get_trades", get_trades), ("iter_tape", iter_tape)]:
+        tracemalloc.start()
+        count, elapsed = timed(func)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert count == n_trades
+
+        print("read all %-10s %6.2fs  peak %7.1fMB" % (
+            label, elapsed, peak / 10 ** 6
+            ))
+
+
+def bench_bars(n_trades=10 ** 6, n_stocks=100, repeat=100):
+    """ report the cost of keeping 1s, 1m and 5m bars while recording trades,
+    and compare reading the last hour of 1m bars for a stock with making them
+    from its trades.
+
+    @param n_trades - number of trades to record
+    @param n_stocks - number of stocks in the market
+    @param repeat - number of bar queries to time
+    """
+    second = 10 ** 6
+    names = ["S%04d" % i for i in range(n_stocks)]
+    saved = utils._micros_since_epoch
+
+    for resolutions in (None, (second, 60 * second, 300 * second)):
+        market = Market(bar_resolutions=resolutions)
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        # 1000 trades a second
+        utils._micros_since_epoch = iter(range(0, n_trades * 1000,
+                                               1000)).__next__
+
+        def record():
+            for i in range(n_trades):
+                market.record_trade(names[i % n_stocks], Trade.BUY,
+                                    1 + i % 10, 90 + i % 20)
+
+        try:
+            _, elapsed = timed(record)
+
+        finally:
+            utils._micros_since_epoch = saved
+
+        print("bars %-36s record_trade %9.0f/s" % (
+            resolutions, n_trades / elapsed
+            ))
+
+    end = n_trades * 1000
+    period = (end - 3600 * second, end)
+
+    def from_trades():
+        for _ in range(repeat):
+            bars = {}
+
+            for trade in market.get_trades("S0000", period):
+                ts = trade.get_timestamp()
+                bars.setdefault(ts - ts % (60 * second), []).append(trade)
+
+    def from_bars():
+        for _ in range(repeat):
+            market.get_bars("S0000", 60 * second, period)
+
+    _, t_trades = timed(from_trades)
+    _, t_bars = timed(from_bars)
+    print("bars last hour of 1m bars  from trades %8.1fus  get_bars %6.1fus" % (
+        10 ** 6 * t_trades / repeat, 10 ** 6 * t_bars / repeat
+        ))
+
+
+def bench_cache(n_trades=10 ** 5, n_stocks=1000, repeat=1000):
+    """ compare repeated VWSP and all share index queries for a fixed period
+    and for the default window with and without a result cache, with a trade
+    recorded every tenth query.
+
+    @param n_trades - number of trades in the market
+    @param n_stocks - number of stocks in the market
+    @param repeat - number of queries to time per case
+    """
+    rand = random.Random(0)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    saved = utils._micros_since_epoch
+    now = n_trades
+
+    try:
+        utils._micros_since_epoch = lambda: now
+
+        for cache in (None, ResultCache()):
+            market = Market(cache=cache)
+
+            for name in names:
+                market.add_stock(Stock(name, 8, 100))
+
+            market.record_trades([rand.choice(names) for _ in range(n_trades)],
+                                 [Trade.BUY] * n_trades, [10] * n_trades,
+                                 [rand.randint(50, 150)
+                                  for _ in range(n_trades)])
+            period = (0, now)
+
+            def query(func, *args):
+                nonlocal now
+
+                for i in range(repeat):
+                    if i % 10 == 0:
+                        now += 1
+                        market.record_trade(names[i % n_stocks], 0, 10, 100)
+
+                    func(*args)
+
+            results = [
+                timed(query, market.calculate_vwsp, "S0000", period)[1],
+                timed(query, market.calculate_vwsp, "S0000")[1],
+                timed(query, market.calculate_gbce_asi, period)[1],
+                timed(query, market.calculate_gbce_asi)[1],
+                ]
+
+            print("cache=%-5s vwsp %6.1fus  vwsp(now) %6.1fus  asi %8.1fus  "
+                  "asi(now) %6.1fus" % ((cache is not None,) + tuple(
+                      10 ** 6 * result / repeat for result in results
+                      )))
+
+    finally:
+        utils._micros_since_epoch = saved
+
+
+def bench_rolling(n_trades=10 ** 6, n_stocks=100, n_calls=1000):
+    """ compare calculating the all share index every second over a trading
+    day in one sweep with rolling_gbce_asi and with a calculate_gbce_asi call
+    per second, which is timed for n_calls seconds and scaled up.
+
+    @param n_trades - number of trades over the day
+    @param n_stocks - number of stocks in the market
+    @param n_calls - number of calculate_gbce_asi calls to time
+    """
+    second = 10 ** 6
+    day = 8 * 3600 * second
+    market = Market()
+    names = ["S%04d" % i for i in range(n_stocks)]
+
+    for name in names:
+        market.add_stock(Stock(name, 8, 100))
+
+    rand = random.Random(0)
+    saved = utils._micros_since_epoch
+    utils._micros_since_epoch = iter(range(0, day, day // n_trades)).__next__
+
+    try:
+        for _ in range(n_trades):
+            market.record_trade(rand.choice(names), Trade.BUY,
+                                rand.randint(1, 1000), rand.randint(50, 150))
+
+    finally:
+        utils._micros_since_epoch = saved
+
+    index, sweep = timed(market.rolling_gbce_asi, 0, day, second)
+    window = 300 * second
+
+    def per_call():
+        return [market.calculate_gbce_asi((t - window, t))
+                for t in range(0, n_calls * second, second)]
+
+    values, elapsed = timed(per_call)
+    assert all(abs(a / b - 1) < 1e-9 for a, b in zip(index, values) if b)
+
+    print("rolling asi %d samples  sweep %.2fs  per call %.0fs (est)" % (
+        len(index), sweep, elapsed * len(index) / n_calls
+        ))
+
+
+def bench_bulk(n_trades=10 ** 6, n_stocks=100, chunk_size=10 ** 5):
+    """ load a CSV trade file of a synthetic tape into a columnar market in
+    chunks, reporting the rate and the memory used beyond the trades stored,
+    then export the market and load it back in the binary format.
+
+    @param n_trades - number of trades in the file
+    @param n_stocks - number of stocks traded
+    @param chunk_size - number of trades loaded at a time
+    """
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, "trades.csv")
+    binary_path = os.path.join(directory, "trades.bin")
+
+    def create_market():
+        market = Market(columnar=True)
+
+        for i in range(n_stocks):
+            market.add_stock(Stock("S%04d" % i, 8, 100))
+
+        return market
+
+    with open(csv_path, "w") as f:
+        f.write("id,stock,type,quantity,price,timestamp\n")
+        trade_id = 0
+
+        for chunk in generate_tape(n_trades, n_stocks):
+            f.writelines("%d,%s,%d,%d,%r,%d\n" % ((trade_id + i,) + row)
+                         for i, row in enumerate(zip(*chunk)))
+            trade_id += len(chunk[0])
+
+    market = create_market()
+    count, elapsed = timed(load_csv, market, csv_path, chunk_size)
+    assert count == n_trades
+
+    # load again traced, which is much slower, for the memory used
+    traced = create_market()
+    tracemalloc.start()
+    load_csv(traced, csv_path, chunk_size)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    print("bulk csv load %d trades  %9.0f trades/s  %.0fMB stored  "
+          "%.0fMB peak" % (n_trades, n_trades / elapsed, size / 10 ** 6,
+                           peak / 10 ** 6))
+
+    count, elapsed = timed(export_csv, market.iter_tape(), csv_path)
+    print("bulk csv export %9.0f trades/s" % (count / elapsed))
+    count, elapsed = timed(export_binary, market.iter_tape(), binary_path,
+                           chunk_size)
+    print("bulk binary export %9.0f trades/s  %.0fMB" % (
+        count / elapsed, os.path.getsize(binary_path) / 10 ** 6
+        ))
+
+    del market
+    market = create_market()
+    count, elapsed = timed(load_binary, market, binary_path, chunk_size)
+    assert count == n_trades
+    print("bulk binary load %9.0f trades/s" % (n_trades / elapsed))
+    os.remove(csv_path)
+    os.remove(binary_path)
+
+
+def bench_replay(n_trades=10 ** 6, n_stocks=100, interval=60 * 10 ** 6):
+    """ replay a synthetic trading day into a market with a virtual clock,
+    sampling the all share index and the vwsp of every stock at intervals,
+    and report how long the day took.
+
+    @param n_trades - number of trades over the day
+    @param n_stocks - number of stocks traded
+    @param interval - time between samples in microseconds
+    """
+    day = 8 * 3600 * 10 ** 6
+    names = ["S%04d" % i for i in range(n_stocks)]
+    source = Market(columnar=True)
+    market = Market(clock=VirtualClock())
+    trade_id = 0
+
+    for name in names:
+        source.add_stock(Stock(name, 8, 100))
+        market.add_stock(Stock(name, 8, 100))
+
+    for chunk in generate_tape(n_trades, n_stocks, rate=n_trades * 10 ** 6 /
+                               day):
+        n = len(chunk[0])
+        columns = (range(trade_id, trade_id + n),) + chunk[1:]
+
+        for stock, stock_columns in _group_by_stock(chunk[0], columns):
+            source.load_trades(stock, *stock_columns)
+
+        trade_id += n
+
+    samples = []
+
+    def sample(now):
+        samples.append((market.calculate_gbce_asi(),
+                        [market.calculate_vwsp(name) for name in names]))
+
+    replay = Replay(market)
+    replay.every(interval, sample)
+    count, elapsed = timed(replay.run, source.iter_tape())
+    assert count == n_trades
+
+    print("replay %d trades over %.1f hours  %.1fs  %9.0f trades/s  "
+          "%d samples" % (count, market.clock() / 3.6e9, elapsed,
+                          count / elapsed, len(samples)))
+
+
+def bench_subscribe(n_trades=10 ** 5, n_stocks=100):
+    """ compare the cost per trade of keeping a client up to date with the
+    vwsp of every stock and the all share index, by polling them all after
+    each trade and by subscribing to them.
+
+    @param n_trades - number of trades to record
+    @param n_stocks - number of stocks in the market
+    """
+    rand = random.Random(0)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    trades = [(rand.choice(names), Trade.BUY, rand.randint(1, 1000),
+               rand.randint(50, 150)) for _ in range(n_trades)]
+
+    def create_market():
+        clock = VirtualClock()
+        market = Market(clock=clock)
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        return clock, market
+
+    def record(clock, market, poll):
+        for i, trade in enumerate(trades):
+            clock.set(i * 1000)
+            market.record_trade(*trade)
+
+            if poll:
+                [market.calculate_vwsp(name) for name in names]
+                market.calculate_gbce_asi()
+
+    clock, market = create_market()
+    _, plain = timed(record, clock, market, False)
+    clock, market = create_market()
+    _, polled = timed(record, clock, market, True)
+    clock, market = create_market()
+    updates = []
+
+    for name in names:
+        market.subscribe_vwsp(name, lambda vwsp, now: updates.append(vwsp))
+
+    market.subscribe_gbce_asi(lambda index, now: updates.append(index))
+    _, subscribed = timed(record, clock, market, False)
+
+    print("subscribe %d stocks  record %.1fus  + poll %.1fus  + subscribe "
+          "%.1fus per trade  %d updates" % (
+              n_stocks, 10 ** 6 * plain / n_trades, 10 ** 6 * polled / n_trades,
+              10 ** 6 * subscribed / n_trades, len(updates)
+              ))
+
+
+def bench_symbols(n_stocks=10 ** 4, n_trades=10 ** 5, repeat=100):
+    """ time listing a large universe of stocks in name order, against
+    sorting them as get_all_stocks used to, and measure the memory per trade
+    when each trade's stock name is a fresh string, e.g. one parsed from a
+    message, which the market replaces with its interned copy.
+
+    @param n_stocks - number of stocks in the market
+    @param n_trades - number of trades to record
+    @param repeat - number of listings to time
+    """
+    rand = random.Random(0)
+    names = ["S%05d" % i for i in range(n_stocks)]
+    rand.shuffle(names)
+    market = Market()
+
+    for name in names:
+        market.add_stock(Stock(name, 8, 100))
+
+    def listed():
+        for _ in range(repeat):
+            market.get_all_stocks()
+
+    def sorted_stocks():
+        for _ in range(repeat):
+            sorted(market.stocks.values(), key=lambda stock: stock.get_name())
+
+    _, elapsed = timed(listed)
+    _, baseline = timed(sorted_stocks)
+    messages = [rand.choice(names).encode() for _ in range(n_trades)]
+
+    tracemalloc.start()
+    size = tracemalloc.get_traced_memory()[0]
+    _, record = timed(lambda: [market.record_trade(message.decode(), 0, 1, 1)
+                               for message in messages])
+    size = tracemalloc.get_traced_memory()[0] - size
+    tracemalloc.stop()
+
+    print("symbols %d stocks  get_all_stocks %.0fus (sorted %.0fus)  "
+          "%.0f bytes per trade recorded" % (
+              n_stocks, 10 ** 6 * elapsed / repeat,
+              10 ** 6 * baseline / repeat, size / n_trades
+              ))
+
+
+def bench_reorder(n_trades=2 * 10 ** 5, n_stocks=100, jitter=10 ** 4):
+    """ store trades arriving up to jitter microseconds out of order, one
+    at a time straight into the market, which inserts each late trade into
+    its stock's series, and through an Ingestor with that much lateness.
+
+    @param n_trades - number of trades
+    @param n_stocks - number of stocks traded
+    @param jitter - maximum delay of a trade's arrival in microseconds
+    """
+    rand = random.Random(0)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    trades = [Trade(i, rand.choice(names), Trade.BUY, rand.randint(1, 1000),
+                    rand.randint(50, 150), i * 100) for i in range(n_trades)]
+    arrivals = sorted(trades, key=lambda trade: trade.get_timestamp() +
+                      rand.randint(0, jitter))
+
+    def create_market():
+        market = Market(columnar=True)
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        return market
+
+    def direct(market):
+        for trade in arrivals:
+            market.load_trades(trade.get_stock(), [trade.get_id()],
+                               [trade.get_trade_type()],
+                               [trade.get_quantity()], [trade.get_price()],
+                               [trade.get_timestamp()])
+
+    def ingested(market, batch_size):
+        ingestor = Ingestor(market, jitter, batch_size=batch_size)
+        ingestor.extend(arrivals)
+        ingestor.flush()
+        return len(ingestor.late_trades)
+
+    market = create_market()
+    _, elapsed = timed(direct, market)
+    print("reorder %d trades  direct %9.0f trades/s" % (
+        n_trades, n_trades / elapsed
+        ))
+
+    for batch_size in (1, 1000):
+        reordered = create_market()
+        late, elapsed = timed(ingested, reordered, batch_size)
+        assert late == 0
+
+        for name in names:
+            assert reordered.get_trades(name) == market.get_trades(name)
+
+        print("reorder %d trades  ingestor batch %4d %9.0f trades/s" % (
+            n_trades, batch_size, n_trades / elapsed
+            ))
+
+
+def bench_ids(n_ids=2 * 10 ** 5, n_threads=(1, 4, 16)):
+    """ allocate ids from many threads at once with the process wide
+    auto incrementing integer, which takes its lock for every id, and with
+    an IdAllocator leasing blocks of ids per thread, from a local counter and
+    from snowflake ids.
+
+    @param n_ids - number of ids allocated by each thread
+    @param n_threads - sequence of numbers of threads to run
+    """
+
+    def allocate(next_id, threads):
+        def run():
+            for _ in range(n_ids):
+                next_id()
+
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+    for threads in n_threads:
+        for name, next_id in (
+                ("auto_increment", utils.auto_increment),
+                ("leased", IdAllocator().next_id),
+                ("snowflake", IdAllocator(Snowflake(0)).next_id),
+                ):
+            _, elapsed = timed(allocate, next_id, threads)
+            print("ids %2d threads  %-14s %10.0f ids/s" % (
+                threads, name, threads * n_ids / elapsed
+                ))
+
+
+def bench_quantiles(n_trades=10 ** 6, n_stocks=10, resolution=10 ** 7,
+                    repeat=100):
+    """ report the cost of keeping price and size quantile sketches while
+    recording trades, and compare the 1st, 50th and 99th percentiles of a
+    stock's prices and sizes over the last five minutes from its sketches
+    with sorting its trades, with the rank error and memory of the sketches.
+
+    @param n_trades - number of trades to record
+    @param n_stocks - number of stocks in the market
+    @param resolution - length of sketch buckets in microseconds
+    @param repeat - number of quantile queries to time
+    """
+    second = 10 ** 6
+    names = ["S%04d" % i for i in range(n_stocks)]
+    fractions = (0.01, 0.5, 0.99)
+    saved = utils._micros_since_epoch
+
+    for sketch_resolution in (None, resolution):
+        market = Market(sketch_resolution=sketch_resolution)
+        rand = random.Random(0)
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        # 1000 trades a second
+        utils._micros_since_epoch = iter(range(0, n_trades * 1000,
+                                               1000)).__next__
+
+        def record():
+            for i in range(n_trades):
+                market.record_trade(names[i % n_stocks], Trade.BUY,
+                                    rand.randint(1, 1000),
+                                    rand.lognormvariate(4.6, 0.1))
+
+        try:
+            _, elapsed = timed(record)
+
+        finally:
+            utils._micros_since_epoch = saved
+
+        print("quantiles sketch_resolution %-8s record_trade %9.0f/s" % (
+            sketch_resolution, n_trades / elapsed
+            ))
+
+    end = n_trades * 1000
+    period = (end - 300 * second, end)
+
+    def from_trades():
+        for _ in range(repeat):
+            trades = market.get_trades("S0000", period)
+            prices = sorted(trade.get_price() for trade in trades)
+            sizes = sorted(trade.get_quantity() for trade in trades)
+            quantiles = [(prices[max(0, math.ceil(q * len(prices)) - 1)],
+                          sizes[max(0, math.ceil(q * len(sizes)) - 1)])
+                         for q in fractions]
+
+        return quantiles
+
+    def from_sketches():
+        for _ in range(repeat):
+            quantiles = market.get_quantiles("S0000", fractions, period)
+
+        return quantiles
+
+    exact, t_trades = timed(from_trades)
+    approximate, t_sketches = timed(from_sketches)
+    print("quantiles last 5m  from trades %8.1fus  get_quantiles %8.1fus" % (
+        10 ** 6 * t_trades / repeat, 10 ** 6 * t_sketches / repeat
+        ))
+
+    # error over all of one stock's trades
+    trades = market.get_trades("S0000")
+    prices = sorted(trade.get_price() for trade in trades)
+    day = market.get_quantiles("S0000", fractions, (0, end))
+    error = max(abs(bisect_right(prices, value) / len(prices) - q)
+                for value, q in zip(day["price"], fractions))
+    sketches = market.sketches["S0000"]
+    print("quantiles exact %s  sketched %s" % (
+        [round(price, 2) for price, _ in exact],
+        [round(price, 2) for price in approximate["price"]]
+        ))
+    print("quantiles %d trades  rank error %.4f  %d buckets  %.1fKB" % (
+        len(trades), error, len(sketches), sketches.nbytes() / 1000
+        ))
+
+
+def bench_top(n_trades=10 ** 5, n_stocks=1000, every=(10, 100, 1000),
+              n=20):
+    """ record trades for many stocks at 1000 a second, asking for the top n
+    movers by VWSP change over the last five minutes every so often, from
+    the maintained rankings and by calculating the VWSP of every stock for
+    this window and the one before and sorting them. Trades for the ten
+    minutes before are recorded first.
+
+    @param n_trades - number of trades to record while asking
+    @param n_stocks - number of stocks in the market
+    @param every - sequence of numbers of trades recorded between queries
+    @param n - number of stocks asked for
+    """
+    names = ["S%04d" % i for i in range(n_stocks)]
+    minutes = 5 * 60 * 10 ** 6
+
+    def top_movers(market):
+        now = market.clock()
+        changes = []
+
+        for name in names:
+            vwsp = market.calculate_vwsp(name, (now - minutes, now))
+            before = market.calculate_vwsp(name, (now - 2 * minutes,
+                                                  now - minutes))
+
+            if vwsp is not None and before:
+                changes.append((vwsp / before - 1, name))
+
+        return [(name, change) for change, name in heapq.nlargest(n, changes)]
+
+    warmup = 2 * minutes // 1000
+
+    def run(market, clock, query, interval):
+        rand = random.Random(0)
+        result = None
+
+        for i in range(warmup + n_trades):
+            clock.set(i * 1000)
+            market.record_trade(rand.choice(names), Trade.BUY,
+                                rand.randint(1, 1000), rand.randint(50, 150))
+
+            if query is not None and i >= warmup and i % interval == 0:
+                result = query(market)
+
+        return result
+
+    for interval in every:
+        results = {}
+
+        for label, query in (
+                ("no queries", None),
+                ("recalculated", top_movers),
+                ("get_top", lambda market: market.get_top("vwsp_change", n)),
+                ):
+            clock = VirtualClock()
+            market = Market(clock=clock)
+
+            for name in names:
+                market.add_stock(Stock(name, 8, 100))
+
+            results[label], elapsed = timed(run, market, clock, query,
+                                            interval)
+
+            if query is None:
+                baseline = elapsed
+                continue
+
+            print("top %d of %d stocks every %4d trades  %-12s %8.1fus" % (
+                n, n_stocks, interval, label,
+                10 ** 6 * (elapsed - baseline) / (n_trades // interval)
+                ))
+
+        assert [name for name, _ in results["get_top"]] == \
+            [name for name, _ in results["recalculated"]]
+
+
+def generate_tape(n_trades, n_stocks=100, rate=10 ** 5, skew=1.0,
+                  volatility=0.0005, seed=0, chunk_size=10 ** 5):
+    """ yield a seeded synthetic trade tape in chunks, each a tuple of lists
+    of (stocks, trade_types, quantities, prices, timestamps), so that large
+    tapes needn't be held in memory.
+
+    Stocks are named as in build_market and picked with Zipf weights, so the
+    stock of rank r trades in proportion to 1 / r ** skew. Trades arrive as a
+    Poisson process and each stock's price follows its own geometric random
+    walk from 100.
+
+    @param n_trades - number of trades on the tape
+    @param n_stocks - number of stocks traded
+    @param rate - mean number of trades per second
+    @param skew - Zipf exponent, 0 for uniformly traded stocks
+    @param volatility - standard deviation of log price change per trade
+    @param seed - random seed
+    @param chunk_size - number of trades per chunk
+    """
+    rand = random.Random(seed)
+    names = ["S%04d" % i for i in range(n_stocks)]
+    weights = list(accumulate(1.0 / (r + 1) ** skew for r in range(n_stocks)))
+    walks = [100.0] * n_stocks
+    arrivals = rate / 10.0 ** 6  # per microsecond
+    t = 0.0
+
+    for start in range(0, n_trades, chunk_size):
+        n = min(chunk_size, n_trades - start)
+        picks = rand.choices(range(n_stocks), cum_weights=weights, k=n)
+        prices = []
+        timestamps = []
+
+        for i in picks:
+            walks[i] *= math.exp(rand.gauss(0.0, volatility))
+            prices.append(max(round(walks[i], 2), 0.01))
+            t += rand.expovariate(arrivals)
+            timestamps.append(int(t))
+
+        yield (
+            [names[i] for i in picks],
+            rand.choices((Trade.BUY, Trade.SELL), k=n),
+            [int(rand.random() * 1000) + 1 for _ in range(n)],
+            prices,
+            timestamps,
+            )
+
+
+def measure(operation, n_trades, latencies, elapsed, calls):
+    """ return result dict for a suite operation
+
+    @param operation - name of the Market method measured
+    @param n_trades - number of trades in the market
+    @param latencies - list of sampled call times in seconds
+    @param elapsed - total time of all calls in seconds
+    @param calls - number of calls
+    """
+    return {
+        "operation": operation,
+        "trades": n_trades,
+        "calls": calls,
+        "seconds": elapsed,
+        "throughput": calls / elapsed,
+        "p50_us": 10 ** 6 * percentile(latencies, 50),
+        "p99_us": 10 ** 6 * percentile(latencies, 99),
+        }
+
+
+def run_suite_size(n_trades, queries, columnar, samples, tape):
+    """ measure record_trade, get_trades, calculate_vwsp and
+    calculate_gbce_asi for a market of n_trades trades from a synthetic tape
+    and return list of result dicts, see measure. Run in its own process so
+    that peak memory is for this size alone.
+
+    @param n_trades - number of trades to record
+    @param queries - number of calls to time for each query method
+    @param columnar - passed to Market constructor
+    @param samples - maximum number of record_trade calls to time
+    @param tape - dict of keyword arguments for generate_tape
+    """
+    rand = random.Random(n_trades)
+    market = Market(columnar=columnar)
+    names = ["S%04d" % i for i in range(tape.get("n_stocks", 100))]
+
+    for name in names:
+        market.add_stock(Stock(name, 8, 100))
+
+    step = max(1, n_trades // samples)
+    latencies = []
+    elapsed = 0.0
+    clock = time.perf_counter
+    saved = utils._micros_since_epoch
+    now = 0
+
+    try:
+        for stocks, trade_types, quantities, prices, timestamps in \
+                generate_tape(n_trades, **tape):
+            utils._micros_since_epoch = iter(timestamps).__next__
+            record = market.record_trade
+            start = clock()
+
+            for j, row in enumerate(zip(stocks, trade_types, quantities,
+                                        prices)):
+                if j % step:
+                    record(*row)
+
+                else:
+                    t = clock()
+                    record(*row)
+                    latencies.append(clock() - t)
+
+            elapsed += clock() - start
+            now = timestamps[-1]
+
+        results = [measure("record_trade", n_trades, latencies, elapsed,
+                           n_trades)]
+
+        def query(operation, call):
+            times = []
+
+            for _ in range(queries):
+                t = clock()
+                call()
+                times.append(clock() - t)
+
+            results.append(measure(operation, n_trades, times, sum(times),
+                                   queries))
+
+        def random_period(length):
+            t2 = rand.uniform(0, now)
+            return (t2 - length, t2)
+
+        query("get_trades", lambda: market.get_trades(
+            rand.choice(names), random_period(10 ** 6)
+            ))
+        query("calculate_vwsp", lambda: market.calculate_vwsp(
+            rand.choice(names), random_period(300 * 10 ** 6)
+            ))
+
+        def calculate_gbce_asi():
+            nonlocal now
+            now += 1000
+            market.calculate_gbce_asi()
+
+        utils._micros_since_epoch = lambda: now
+        query("calculate_gbce_asi", calculate_gbce_asi)
+
+    finally:
+        utils._micros_since_epoch = saved
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 10 ** 6 if sys.platform == "darwin" else peak / 1024.0
+
+    for result in results:
+        result["peak_rss_mb"] = peak_mb
+
+    return results
+
+
+def run_suite(sizes, output=None, queries=1000, columnar=False,
+              samples=10 ** 5, **tape):
+    """ run benchmark suite for markets of each size, print the results and
+    optionally write them to a JSON file for compare_results.
+
+    @param sizes - list of numbers of trades
+    @param output - optional path of JSON file to write
+    @param queries - number of calls to time for each query method
+    @param columnar - passed to Market constructor
+    @param samples - maximum number of record_trade calls to time
+    @param tape - keyword arguments for generate_tape
+    """
+    results = []
+
+    for n_trades in sizes:
+
+        with ProcessPoolExecutor(1) as pool:
+            size_results = pool.submit(run_suite_size, n_trades, queries,
+                                       columnar, samples, tape).result()
+
+        for result in size_results:
+            print("%-18s %9d trades  %10.0f calls/s  p50 %8.1fus  "
+                  "p99 %8.1fus  peak %7.1fMB" % (
+                      result["operation"], n_trades, result["throughput"],
+                      result["p50_us"], result["p99_us"],
+                      result["peak_rss_mb"]
+                      ))
+
+        results.extend(size_results)
+
+    if output:
+        config = dict(tape, sizes=sizes, queries=queries, columnar=columnar,
+                      samples=samples)
+
+        with open(output, "w") as f:
+            json.dump({
+                "config": config,
+                "python": platform.python_version(),
+                "results": results,
+                }, f, indent=2)
+
+    return results
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """ print throughput and p99 latency of current suite results relative to
+    baseline and return the number of regressions, i.e. results with
+    throughput more than tolerance below the baseline.
+
+    @param baseline - path of JSON file written by run_suite
+    @param current - path of JSON file written by run_suite
+    @param tolerance - fraction of throughput allowed to be lost
+    """
+
+    def load(path):
+        with open(path) as f:
+            return {(r["operation"], r["trades"]): r
+                    for r in json.load(f)["results"]}
+
+    old, new = load(baseline), load(current)
+    regressions = 0
+
+    for key in sorted(set(old) & set(new), key=lambda k: (k[1], k[0])):
+        ratio = new[key]["throughput"] / old[key]["throughput"]
+        p99 = new[key]["p99_us"] / old[key]["p99_us"]
+        regressed = ratio < 1 - tolerance
+        regressions += regressed
+
+        print("%-18s %9d trades  throughput x%.2f  p99 x%.2f%s" % (
+            key[0], key[1], ratio, p99, "  REGRESSION" if regressed else ""
+            ))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sssm benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    suite = commands.add_parser(
+        "suite", help="benchmark Market hot paths on a synthetic tape"
+        )
+    suite.add_argument("--sizes", type=int, nargs="+",
+                       default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+    suite.add_argument("--output", help="write results to this JSON file")
+    suite.add_argument("--queries", type=int, default=1000)
+    suite.add_argument("--columnar", action="store_true")
+    suite.add_argument("--stocks", type=int, default=100)
+    suite.add_argument("--rate", type=float, default=10 ** 5)
+    suite.add_argument("--skew", type=float, default=1.0)
+    suite.add_argument("--volatility", type=float, default=0.0005)
+    suite.add_argument("--seed", type=int, default=0)
+    compare = commands.add_parser(
+        "compare", help="compare suite results against a baseline"
+        )
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "suite":
+        run_suite(args.sizes, args.output, args.queries, args.columnar,
+                  n_stocks=args.stocks, rate=args.rate, skew=args.skew,
+                  volatility=args.volatility, seed=args.seed)
+
+    elif args.command == "compare":
+        if compare_results(args.baseline, args.current, args.tolerance):
+            sys.exit(1)
+
+    else:
+        bench_vwsp()
+        bench_memory()
+        bench_gbce_asi()
+        bench_ingest()
+        bench_threads()
+        bench_sharded()
+        bench_journal()
+        bench_server()
+        bench_retention()
+        bench_analytics()
+        bench_metrics()
+        bench_iter()
+        bench_bars()
+        bench_cache()
+        bench_rolling()
+        bench_bulk()
+        bench_replay()
+        bench_subscribe()
+        bench_symbols()
+        bench_reorder()
+        bench_ids()
+        bench_quantiles()
+        bench_top()
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,42 @@ Created on 10 Apr 2018
 @author: conor
 '''
 
+import asyncio
+from array import array
+from bisect import bisect_right
+import io
+import math
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 from sssm import utils
+from sssm.analytics import StockUniverse
+from sssm.bars import Bar, BarSeries
+from sssm.bulk import export_binary, export_csv, load_binary, load_csv
+from sssm.cache import ResultCache
+from sssm.clock import VirtualClock
+from sssm.ids import FileCounter, IdAllocator, Snowflake
+from sssm.ingest import Ingestor
+from sssm.journal import Journal, restore
 from sssm.market import Market
+from sssm.metrics import format_prometheus
+from sssm.replay import Replay
+from sssm.series import ColumnarTradeSeries, TradeSeries
+from sssm.sketch import QuantileSeries, QuantileSketch, quantiles_of
+from sssm.server import TradeServer
+from sssm.sharded import ShardedMarket
 from sssm.stock import Stock
+from sssm.symbols import SymbolTable
 from sssm.trade import Trade
 from sssm.utils import geometric_mean, Error, reset_auto_increment, \
-    auto_increment, assert_true
+    auto_increment, assert_true, reserve_auto_increment
 
 
 class TestBase(unittest.TestCase):
@@ -63,6 +91,13 @@ class UtilsTests(TestBase):
         self.assertEqual(geometric_mean([2, 2]), 2)
         self.assertEqual(geometric_mean([4.5, 2]), 3)
         self.assertEqual(geometric_mean([4, 2, 1]), 2)
+        self.assertEqual(geometric_mean([0, 2]), 0)
+
+    def test_geometric_mean_overflow(self):
+        """ test geometric mean of values whose product over/underflows """
+        self.assertAlmostEqual(geometric_mean([1e200] * 3) / 1e200, 1)
+        self.assertAlmostEqual(geometric_mean([1e-200] * 3) / 1e-200, 1)
+        self.assertAlmostEqual(geometric_mean([10 ** 200] * 3) / 1e200, 1)
 
     def test_auto_increment(self):
         self.assertEqual(auto_increment(), 0)
@@ -71,9 +106,16 @@ class UtilsTests(TestBase):
         reset_auto_increment()
         self.assertEqual(auto_increment(), 0)
 
+    def test_reserve_auto_increment(self):
+        self.assertEqual(auto_increment(), 0)
+        self.assertEqual(reserve_auto_increment(3), range(1, 4))
+        self.assertEqual(auto_increment(), 4)
+        self.assertEqual(reserve_auto_increment(0), range(5, 5))
+
     def test_assert_true(self):
         assert_true(1, "foo")
         self.assertRaisesRegex(Error, "foo", assert_true, 0, "foo")
+        self.assertRaisesRegex(Error, "foo: 1", assert_true, 0, "foo: %s", 1)
 
 
 class StockTests(TestBase):
@@ -140,6 +182,198 @@ class StockTests(TestBase):
         self.assertRaisesRegex(Error, "invalid price: 0", func, 0)
 
 
+class StockUniverseTests(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.stocks = [self.tea, self.pop, self.ale, self.gin, self.joe]
+        self.universe = StockUniverse(self.stocks)
+
+    def test_dividend_yields(self):
+        """ test dividend yields match the scalar calculation """
+        prices = [100, 99.5, 60, 1, 250]
+        expected = [stock.calculate_dividend_yield(price)
+                    for stock, price in zip(self.stocks, prices)]
+        self.assertEqual(list(self.universe.dividend_yields(prices)), expected)
+
+    def test_pe_ratios(self):
+        """ test P/E ratios match the scalar calculation, with NaN for None """
+        prices = [100, 99.5, 60, 1, 250]
+        pe_ratios = self.universe.pe_ratios(prices)
+        self.assertTrue(math.isnan(pe_ratios[0]))
+        expected = [stock.calculate_pe_ratio(price)
+                    for stock, price in zip(self.stocks, prices)]
+        self.assertEqual(list(pe_ratios[1:]), expected[1:])
+
+    def test_ladders(self):
+        """ test every stock is calculated at every price """
+        prices = [1, 50.5, 100, 1000]
+        yields = self.universe.dividend_yield_ladder(prices)
+        pe_ratios = self.universe.pe_ratio_ladder(prices)
+        self.assertEqual(len(yields), 5)
+        self.assertTrue(all(map(math.isnan, pe_ratios[0])))
+
+        for stock, stock_yields, stock_pe_ratios in zip(self.stocks, yields,
+                                                        pe_ratios):
+            self.assertEqual(
+                list(stock_yields),
+                [stock.calculate_dividend_yield(p) for p in prices]
+                )
+
+            if stock.dividend() > 0:
+                self.assertEqual(
+                    list(stock_pe_ratios),
+                    [stock.calculate_pe_ratio(p) for p in prices]
+                    )
+
+    def test_invalid_prices(self):
+        """ test handling of invalid prices """
+        universe = self.universe
+        prices = [100, 0, 100, -1, 100]
+        self.assertRaisesRegex(Error, "invalid price: -1",
+                               universe.dividend_yields, prices)
+        self.assertRaisesRegex(Error, "invalid price: 0",
+                               universe.pe_ratio_ladder, [1, 0])
+        self.assertRaisesRegex(Error, "expected 5 prices, got 2",
+                               universe.pe_ratios, [1, 2])
+
+
+class SymbolTableTests(TestBase):
+
+    def test_symbols(self):
+        """ test names get dense ids in the order added, are kept sorted and
+        interned """
+        symbols = SymbolTable()
+
+        for i, name in enumerate(["TEA", "POP", "ALE", "ZED", "GIN"]):
+            self.assertEqual(symbols.add("".join(name)), i)
+
+        self.assertEqual(len(symbols), 5)
+        self.assertIn("ALE", symbols)
+        self.assertNotIn("JOE", symbols)
+        self.assertEqual(symbols.get_id("ALE"), 2)
+        self.assertEqual(symbols.get_id("JOE"), None)
+        self.assertEqual(symbols.get_name(3), "ZED")
+        self.assertEqual(symbols.sorted_names,
+                         ["ALE", "GIN", "POP", "TEA", "ZED"])
+        self.assertEqual(symbols.rank("JOE"), 2)
+
+        name = "".join(["T", "EA"])
+        self.assertIsNot(name, symbols.get_name(0))
+        self.assertIs(symbols.intern(name), symbols.get_name(0))
+        self.assertRaisesRegex(Error, "duplicate stock: 'TEA'", symbols.add,
+                               name)
+
+
+def lease_ids(path):
+    """ return list of ids from an allocator leasing from the counter file at
+    path, in a worker process """
+    allocator = IdAllocator(FileCounter(path), block_size=10)
+    return [allocator.next_id() for _ in range(25)] + allocator.reserve(25)
+
+
+class IdAllocatorTests(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_threads(self):
+        """ test ids are unique and ascending per thread across many threads
+        """
+        allocator = IdAllocator(block_size=64)
+        results = []
+
+        def allocate():
+            ids = [allocator.next_id() for _ in range(1000)]
+            ids.extend(allocator.reserve(100))
+            results.append(ids)
+
+        threads = [threading.Thread(target=allocate) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for ids in results:
+            self.assertEqual(ids, sorted(ids))
+
+        all_ids = [trade_id for ids in results for trade_id in ids]
+        self.assertEqual(len(set(all_ids)), 8800)
+        self.assertLess(max(all_ids), 8800 + 8 * 64)
+
+    def test_file_counter(self):
+        """ test ids leased from a counter file are unique across processes
+        and restarts """
+        path = os.path.join(self.directory, "ids")
+
+        with multiprocessing.Pool(2) as pool:
+            results = pool.map(lease_ids, [path] * 4)
+
+        all_ids = [trade_id for ids in results for trade_id in ids]
+        self.assertEqual(len(set(all_ids)), 200)
+
+        restarted = FileCounter(path)
+        self.assertGreater(restarted.lease(1)[0], max(all_ids))
+        restarted.advance(10 ** 6)
+        self.assertEqual(IdAllocator(FileCounter(path)).next_id(), 10 ** 6)
+
+    def test_advance(self):
+        """ test advancing skips ids leased below the new lowest id, from
+        a counter file or the auto incrementing id """
+        path = os.path.join(self.directory, "ids")
+        allocator = IdAllocator(FileCounter(path))
+        self.assertEqual(allocator.next_id(), 0)
+        allocator.advance(5000)
+        self.assertEqual(allocator.next_id(), 5000)
+        self.assertEqual(allocator.reserve(2), [5001, 5002])
+        allocator.advance(10)
+        self.assertEqual(allocator.next_id(), 5003)
+
+        allocator = IdAllocator(block_size=4)
+        self.assertEqual(allocator.reserve(2), [0, 1])
+        allocator.advance(100)
+        self.assertEqual(allocator.reserve(3), [100, 101, 102])
+        self.assertEqual(auto_increment(), 104)
+
+    def test_snowflake(self):
+        """ test snowflake ids embed time, worker and sequence, and stay
+        unique and ascending if the clock goes backwards, the sequence runs
+        out or the source is restarted """
+        path = os.path.join(self.directory, "snowflake")
+        epoch = 10 ** 12
+        snowflake = Snowflake(5, worker_bits=3, sequence_bits=2, epoch=epoch,
+                              path=path)
+        t = (epoch + 7) / 1000
+        snowflake._clock = lambda: t
+
+        self.assertEqual(snowflake.lease(3), range(7 << 5 | 5 << 2,
+                                                   (7 << 5 | 5 << 2) + 3))
+        self.assertEqual(snowflake.split(snowflake.lease(3)[0]),
+                         (epoch + 7, 5, 3))
+        self.assertEqual(snowflake.split(snowflake.lease(1)[0]),
+                         (epoch + 8, 5, 0))
+
+        t = (epoch + 2) / 1000
+        self.assertEqual(snowflake.split(snowflake.lease(1)[0]),
+                         (epoch + 8, 5, 1))
+
+        allocator = IdAllocator(snowflake, block_size=2)
+        ids = [allocator.next_id() for _ in range(20)]
+        self.assertEqual(ids, sorted(set(ids)))
+
+        restarted = Snowflake(5, worker_bits=3, sequence_bits=2, epoch=epoch,
+                              path=path)
+        restarted._clock = lambda: t
+        self.assertGreater(restarted.lease(1)[0], max(ids))
+        self.assertRaisesRegex(Error, "invalid worker_id", Snowflake, 8,
+                               worker_bits=3)
+
+
 class TradeTests(TestBase):
 
     def test_trade(self):
@@ -160,12 +394,316 @@ class TradeTests(TestBase):
         exp_str = "trade(id=0, stock=TEA, type=0, quantity=1000, price=100, timestamp=1000000)"
         self.assertEqual(str(trade), exp_str)
 
+    def test_trade_equality(self):
+        """ test trades with the same values are equal """
+        trade = Trade(0, "TEA", Trade.BUY, 1000, 100, 10)
+        self.assertEqual(trade, Trade(0, "TEA", Trade.BUY, 1000, 100.0, 10))
+        self.assertNotEqual(trade, Trade(1, "TEA", Trade.BUY, 1000, 100, 10))
+        self.assertNotEqual(trade, None)
+
+
+class TradeSeriesTests(TestBase):
+
+    def test_span(self):
+        """ test period lookup is half open, i.e. t1 <= timestamp < t2 """
+        series = TradeSeries()
+        trades = [Trade(i, "TEA", Trade.BUY, 1, 1, t) for i, t in
+                  enumerate([10, 20, 20, 30])]
+
+        for trade in trades:
+            series.append(trade)
+
+        self.assertEqual(series.span(), (0, 4))
+        self.assertEqual(series.span((20, 30)), (1, 3))
+        self.assertEqual(series.span((0, 20)), (0, 1))
+        self.assertEqual(series.span((31, 40)), (4, 4))
+        self.assertEqual(series.span((30, 10)), (3, 3))
+        self.assertEqual(series.get_trades((20, 31)), trades[1:])
+
+    def test_append_out_of_order(self):
+        """ test trades stay in timestamp order if the clock goes backwards """
+        series = TradeSeries()
+        a = Trade(0, "TEA", Trade.BUY, 1, 1, 10)
+        b = Trade(1, "TEA", Trade.BUY, 1, 1, 30)
+        c = Trade(2, "TEA", Trade.BUY, 1, 1, 10)
+
+        for trade in (a, b, c):
+            series.append(trade)
+
+        self.assertEqual(series.get_trades(), [a, c, b])
+        self.assertEqual(series.timestamps, [10, 10, 30])
+        self.assertEqual(series.quantities, [0, 1, 2, 3])
+
+    def test_calculate_vwsp(self):
+        """ test running totals give the same vwsp as summing each period """
+        series = TradeSeries()
+        trades = [Trade(i, "TEA", Trade.BUY, q, p, t) for i, (q, p, t) in
+                  enumerate([(100, 99, 10), (200, 102, 20), (50, 101, 5)])]
+
+        for trade in trades:
+            series.append(trade)
+
+        self.assertEqual(series.calculate_vwsp(), 35350 / 350)
+        self.assertEqual(series.calculate_vwsp((6, 21)), 30300 / 300)
+        self.assertEqual(series.calculate_vwsp((0, 11)), 14950 / 150)
+        self.assertEqual(series.calculate_vwsp((21, 30)), None)
+
+    def test_evict(self):
+        """ test old trades are evicted once they are half of the series """
+        series = TradeSeries("TEA")
+        trades = [Trade(t, "TEA", Trade.BUY, 1, t, t) for t in range(10)]
+        archived = []
+
+        for trade in trades:
+            series.append(trade)
+
+        archiver = lambda stock, trades: archived.append((stock, trades))
+        self.assertEqual(series.evict(4, archiver), 0)
+        self.assertEqual(series.evict(5, archiver), 5)
+        self.assertEqual(archived, [("TEA", trades[:5])])
+        self.assertEqual(series.get_trades(), trades[5:])
+        self.assertEqual(series.amounts, [0, 5, 11, 18, 26, 35])
+        self.assertEqual(series.calculate_vwsp((6, 9)), 7)
+        self.assertEqual(series.evict(6, force=True), 1)
+        self.assertEqual(series.get_trades(), trades[6:])
+
+
+    def test_columnar_invalid(self):
+        """ test a trade or batch that doesn't fit the columns is rejected
+        without changing any of them """
+        series = ColumnarTradeSeries("TEA")
+        series.append(Trade(0, "TEA", Trade.BUY, 1, 1, 10))
+        self.assertRaisesRegex(Error, "invalid trade for columnar storage",
+                               series.append,
+                               Trade(1, "TEA", Trade.BUY, 1.5, 1, 20))
+        self.assertRaisesRegex(Error, "invalid trade for columnar storage",
+                               series.append,
+                               Trade(1, "TEA", Trade.BUY, 1.5, 1, 5))
+        self.assertRaisesRegex(Error, "invalid trades for columnar storage",
+                               series.extend, [1, 2], [0, 0], [1, 1.5],
+                               [1, 1], [20, 5])
+        series.append(Trade(2, "TEA", Trade.BUY, 1, 1, 20))
+
+        self.assertEqual(set(map(len, (series.ids, series.trade_types,
+                                       series.quantities, series.prices,
+                                       series.amounts, series.timestamps))),
+                         {2})
+        self.assertEqual([trade.get_id() for trade in series.get_trades()],
+                         [0, 2])
+
+
+def make_bars(trades, resolution):
+    """ return list of bars for trades, in the order they are stored, made by
+    bucketing them by time
+
+    @param trades - list of Trade objects ordered by timestamp
+    @param resolution - length of bars in microseconds
+    """
+    buckets = {}
+
+    for trade in trades:
+        start = trade.get_timestamp() - trade.get_timestamp() % resolution
+        buckets.setdefault(start, []).append(trade)
+
+    bars = []
+
+    for start, bucket in sorted(buckets.items()):
+        prices = [trade.get_price() for trade in bucket]
+        bars.append(Bar(
+            start, prices[0], max(prices), min(prices), prices[-1],
+            sum(trade.get_quantity() for trade in bucket),
+            sum(trade.get_total_amount() for trade in bucket)
+            ))
+
+    return bars
+
+
+class BarSeriesTests(TestBase):
+
+    def test_add(self):
+        """ test bars are updated by trades in time order and late trades """
+        bars = BarSeries(10)
+        bars.add(11, 100, 1)
+        bars.add(15, 120, 2)
+        bars.add(12, 90, 1)
+        bars.add(31, 50, 1)
+
+        # late trades, after the clock has gone backwards
+        bars.add(10, 95, 1)
+        bars.add(15, 130, 1)
+        bars.add(25, 70, 2)
+
+        self.assertEqual(bars.get_bars(), [
+            Bar(10, 95, 130, 90, 130, 6, 655),
+            Bar(20, 70, 70, 70, 70, 2, 140),
+            Bar(30, 50, 50, 50, 50, 1, 50),
+            ])
+        self.assertEqual(bars.get_bars()[0].get_vwap(), 655 / 6)
+
+    def test_float_quantity(self):
+        """ test bars add up quantities that aren't whole numbers """
+        bars = BarSeries(10)
+        bars.add(11, 100, 1)
+        bars.add(12, 100, 1.5)
+        bars.add(21, 100, 0.5)
+
+        self.assertEqual([bar.get_volume() for bar in bars.get_bars()],
+                         [2.5, 0.5])
+        self.assertEqual(set(map(len, bars._columns())), {2})
+
+    def test_extend(self):
+        """ test a batch in one bar is merged in one go, with the open and
+        close of the first and last trades at the first and last times """
+        bars = BarSeries(10)
+        bars.add(12, 100, 1)
+        bars.extend([15, 11, 11, 15, 13], [1, 2, 3, 4, 5], [1, 1, 1, 1, 1])
+        bars.extend([19, 21], [6, 7], [1, 1])
+        bars.extend([], [], [])
+
+        self.assertEqual(bars.get_bars(), [
+            Bar(10, 2, 100, 1, 6, 7, 121),
+            Bar(20, 7, 7, 7, 7, 1, 7),
+            ])
+
+    def test_evict(self):
+        """ test only bars ending before the given time are evicted """
+        bars = BarSeries(10)
+
+        for t in range(0, 50, 5):
+            bars.add(t, 1, 1)
+
+        self.assertEqual(bars.evict(25), 2)
+        self.assertEqual(bars.get_bars(period=(0, 100))[0].get_start(), 20)
+        self.assertRaisesRegex(Error, "invalid resolution: 0", BarSeries, 0)
+
+
+def rank_error(values, quantile, q):
+    """ return how far the fraction of values at or below quantile is from q
+
+    @param values - sorted list of values
+    @param quantile - value returned for q
+    @param q - fraction from 0 to 1
+    """
+    return abs(bisect_right(values, quantile) / len(values) - q)
+
+
+class QuantileSketchTests(TestBase):
+
+    def test_exact(self):
+        """ test quantiles are exact until values are compacted """
+        sketch = QuantileSketch()
+        self.assertIsNone(sketch.get_quantiles([0.5]))
+
+        for value in range(100, 0, -1):
+            sketch.add(value)
+
+        self.assertEqual(len(sketch), 100)
+        self.assertEqual(sketch.get_quantiles([0, 0.01, 0.5, 0.99, 1]),
+                         [1, 1, 50, 99, 100])
+        self.assertRaisesRegex(Error, "invalid fraction: 2",
+                               sketch.get_quantiles, [2])
+        self.assertRaisesRegex(Error, "invalid k: 1", QuantileSketch, 1)
+
+    def test_error(self):
+        """ test quantiles of many values, added one at a time, in batches
+        and by merging sketches, are within the error bound in bounded
+        memory """
+        rand = random.Random(0)
+        values = [rand.gauss(100, 10) for _ in range(10 ** 5)]
+        fractions = [0, 0.01, 0.1, 0.5, 0.9, 0.99, 1]
+        added = QuantileSketch()
+        extended = QuantileSketch()
+        merged = QuantileSketch()
+        parts = [QuantileSketch() for _ in range(10)]
+
+        for value in values:
+            added.add(value)
+
+        for i, part in enumerate(parts):
+            part.extend(array("d", values[i::10]))
+            merged.merge(part)
+            extended.extend(values[i::10])
+
+        ordered = sorted(values)
+
+        for sketch in (added, extended, merged):
+            self.assertEqual(len(sketch), len(values))
+            self.assertLess(sketch.nbytes(), 3 * 200 * 8)
+            quantiles = sketch.get_quantiles(fractions)
+            self.assertEqual(quantiles[0], ordered[0])
+            self.assertEqual(quantiles[-1], ordered[-1])
+
+            for quantile, q in zip(quantiles, fractions):
+                self.assertLess(rank_error(ordered, quantile, q), 0.01)
+
+        for quantile, q in zip(quantiles_of(parts, fractions), fractions):
+            self.assertLess(rank_error(ordered, quantile, q), 0.01)
+
+    def test_merge_deeper(self):
+        """ test merging a sketch with more compactors into one with fewer
+        grows its capacity to match """
+        rand = random.Random(0)
+        values = [rand.gauss(100, 10) for _ in range(10 ** 5)]
+        deeper = QuantileSketch()
+
+        for value in values:
+            deeper.add(value)
+
+        sketch = QuantileSketch()
+        sketch.add(1)
+        sketch.merge(deeper)
+        values.append(1)
+        ordered = sorted(values)
+
+        self.assertEqual(len(sketch), len(values))
+        self.assertLess(sketch.nbytes(), 3 * 200 * 8)
+        self.assertEqual(sketch.get_quantiles([0]), [1])
+
+        for q in (0.01, 0.5, 0.99):
+            quantile, = sketch.get_quantiles([q])
+            self.assertLess(rank_error(ordered, quantile, q), 0.01)
+
+
+class QuantileSeriesTests(TestBase):
+
+    def test_buckets(self):
+        """ test trades, including a batch and a late trade, are sketched
+        in the bucket for their time and queried over the buckets a period
+        overlaps """
+        series = QuantileSeries(10)
+        series.add(11, 100, 1)
+        series.add(15, 120, 2)
+        series.add(31, 50, 3)
+        series.extend([35, 32, 38], [60, 70, 80], [4, 5, 6])
+        series.add(25, 90, 7)
+        series.extend([], [], [])
+
+        self.assertEqual(list(series.starts), [10, 20, 30])
+        self.assertEqual(series.get_quantiles([0, 0.5, 1], (0, 100)),
+                         ([50, 80, 120], [1, 4, 7]))
+        self.assertEqual(series.get_quantiles([0.5], (20, 30)),
+                         ([90], [7]))
+        self.assertIsNone(series.get_quantiles([0.5], (40, 100)))
+
+    def test_evict(self):
+        """ test only buckets ending before the given time are evicted """
+        series = QuantileSeries(10)
+
+        for t in range(0, 50, 5):
+            series.add(t, t, 1)
+
+        self.assertEqual(series.evict(25), 2)
+        self.assertEqual(series.get_quantiles([0], (0, 100)), ([20], [1]))
+        self.assertGreater(series.nbytes(), 0)
+        self.assertRaisesRegex(Error, "invalid resolution: 0",
+                               QuantileSeries, 0)
+
 
 class MarketTests(TestBase):
 
     def setUp(self):
         TestBase.setUp(self)
-        self.market = Market()
+        self.market = self.create_market()
         self.market.add_stock(self.tea)
         self.market.add_stock(self.pop)
         self.market.add_stock(self.ale)
@@ -175,6 +713,9 @@ class MarketTests(TestBase):
         self.t1 = 10 ** 6  # epoch + 1s
         self.t2 = 600 * (10 ** 6)  # epoch + 10 minutes
 
+    def create_market(self, **kwargs):
+        return Market(**kwargs)
+
     def record_trades(self, all_trades=False):
         """ record some trades at mocked time points, then some extra ones if
         all_trades=True. """
@@ -196,6 +737,88 @@ class MarketTests(TestBase):
             self.mock_time(self.t2 - 2)
             self.pop_trade_2 = record("POP", Trade.BUY, 1000, 100)
 
+    def test_replay(self):
+        """ test replaying trades into a market with a virtual clock, firing
+        callbacks at intervals with the market as at each interval """
+        self.record_trades(all_trades=True)
+        self.clear_mocks()
+        clock = VirtualClock()
+        market = self.create_market(clock=clock)
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        replay = Replay(market)
+        minute = 60 * (10 ** 6)
+        samples = []
+
+        def sample(now):
+            samples.append((now, clock(), market.calculate_vwsp("TEA"),
+                            market.calculate_gbce_asi()))
+
+        replay.every(minute, sample)
+        self.assertEqual(replay.run(self.market.iter_tape(), end=self.t2), 7)
+        self.assertEqual(clock(), self.t2)
+
+        times = list(range(minute, self.t2 + 1, minute))
+        self.assertEqual([sample[:2] for sample in samples],
+                         [(now, now) for now in times])
+
+        for now, (_, _, vwsp, asi) in zip(times, samples):
+            period = (now - 5 * minute, now)
+            self.assertEqual(vwsp, self.market.calculate_vwsp("TEA", period))
+            self.assertAlmostEqual(asi,
+                                   self.market.calculate_gbce_asi(period))
+
+        for stock in ("TEA", "POP"):
+            self.assertEqual(
+                [t.get_timestamp() for t in market.get_trades(stock)],
+                [t.get_timestamp() for t in self.market.get_trades(stock)]
+                )
+
+        self.assertRaisesRegex(Error, "not a VirtualClock", Replay,
+                               self.market)
+
+    def test_subscribe(self):
+        """ test subscribers are notified as trades change a stock's vwsp and
+        the index, and once each time a condition becomes true """
+        market = self.market
+        vwsps, indexes, crossings = [], [], []
+        tea = market.subscribe_vwsp(
+            "TEA", lambda vwsp, now: vwsps.append((vwsp, now))
+            )
+        market.subscribe_gbce_asi(lambda index, now: indexes.append(index))
+        market.subscribe_vwsp("TEA", lambda vwsp, now: crossings.append(now),
+                              when=lambda vwsp: vwsp > 110)
+
+        for i, price in enumerate((100, 100, 160, 50, 200, 100)):
+            self.mock_time((i + 1) * self.t1)
+            market.record_trade("TEA", Trade.BUY, 10, price)
+
+        self.assertEqual(vwsps, [(100, self.t1), (120, 3 * self.t1),
+                                 (102.5, 4 * self.t1), (122, 5 * self.t1),
+                                 (710 / 6, 6 * self.t1)])
+        self.assertEqual(crossings, [3 * self.t1, 5 * self.t1])
+
+        # another stock's trades only change the index
+        market.unsubscribe(tea)
+        self.mock_time(7 * self.t1)
+        market.record_trade("POP", Trade.BUY, 10, 10)
+        market.record_trade("TEA", Trade.BUY, 10, 100)
+        self.assertEqual(len(vwsps), 5)
+
+        expected = [100, 120, 102.5, 122, 710 / 6, math.sqrt(710 / 6 * 10),
+                    math.sqrt(810 / 7 * 10)]
+        self.assertEqual(len(indexes), len(expected))
+
+        for index, value in zip(indexes, expected):
+            self.assertAlmostEqual(index, value)
+
+        # trades leaving the window are seen when published
+        market.publish(self.t1 * 7 + 5 * 60 * 10 ** 6)
+        self.assertEqual(indexes[-1], None)
+        self.assertEqual(crossings, [3 * self.t1, 5 * self.t1])
+        self.assertRaisesRegex(Error, "unknown stock: 'FOO'",
+                               market.subscribe_vwsp, "FOO", print)
+
     def test_get_stock(self):
         """ test getting stock by name """
         self.assertEqual(self.market.get_stock("TEA"), self.tea)
@@ -211,6 +834,27 @@ class MarketTests(TestBase):
         results = [self.market.get_stock(stock) for stock in stock_order]
         self.assertEqual(self.market.get_all_stocks(), results)
 
+    def test_get_stock_id(self):
+        """ test stocks get ids in the order they are added """
+        names = ["TEA", "POP", "ALE", "GIN", "JOE"]
+        self.assertEqual([self.market.get_stock_id(name) for name in names],
+                         list(range(5)))
+        self.assertEqual(self.market.get_stock_id("FOO"), None)
+
+    def test_ids(self):
+        """ test trades get ids from the market's id allocator """
+        snowflake = Snowflake(7)
+        market = self.create_market(ids=IdAllocator(snowflake))
+        market.add_stock(self.tea)
+        trade = market.record_trade("TEA", Trade.BUY, 1, 100)
+        trade_ids = market.record_trades(["TEA"] * 3, [Trade.BUY] * 3,
+                                         [1] * 3, [100] * 3)
+
+        self.assertEqual(snowflake.split(trade.get_id())[1], 7)
+        self.assertEqual(len(trade_ids), 3)
+        self.assertEqual([t.get_id() for t in market.get_trades("TEA")],
+                         [trade.get_id()] + list(trade_ids))
+
     def test_add_duplicate_stock_error(self):
         """ test error when try to add duplicate named stock """
         error_regex = "duplicate stock: 'TEA'"
@@ -250,6 +894,71 @@ class MarketTests(TestBase):
         for args, err in cases:
             self.assertRaisesRegex(Error, err, self.market.record_trade, *args)
 
+    def test_record_trades(self):
+        """ test recording a batch of trades """
+        self.mock_time(self.t1)
+        self.market.record_trade("POP", Trade.BUY, 10, 100)
+        self.mock_time(self.t2)
+
+        trade_ids = self.market.record_trades(
+            ["TEA", "POP", "TEA"],
+            [Trade.BUY, Trade.SELL, Trade.SELL],
+            [1000, 2000, 3000],
+            [100, 101, 102]
+            )
+
+        self.assertEqual(trade_ids, range(1, 4))
+        self.assertEqual(self.market.get_trades("TEA"), [
+            Trade(1, "TEA", Trade.BUY, 1000, 100, self.t2),
+            Trade(3, "TEA", Trade.SELL, 3000, 102, self.t2),
+            ])
+        self.assertEqual(self.market.get_trades("POP")[1:], [
+            Trade(2, "POP", Trade.SELL, 2000, 101, self.t2),
+            ])
+
+        self.mock_time(self.t2 + 1)
+        self.assertEqual(self.market.calculate_vwsp("TEA"), 406000 / 4000)
+        self.assertEqual(self.market.calculate_vwsp("POP"), 202000 / 2000)
+        self.assertAlmostEqual(
+            self.market.calculate_gbce_asi(), (101.5 * 101) ** 0.5
+            )
+
+    def test_record_trades_errors(self):
+        """ test no trades are recorded if any in the batch is invalid """
+
+        buy = Trade.BUY
+
+        cases = [
+            ((["TEA", "FOO"], [buy, buy], [1, 1], [1, 1]), "unknown stock: 'FOO'"),
+            ((["TEA", "TEA"], [buy, 2], [1, 1], [1, 1]), "invalid type: 2"),
+            ((["TEA", "TEA"], [buy, buy], [1, 0], [1, 1]), "invalid quantity: 0"),
+            ((["TEA", "TEA"], [buy, buy], [1, 1], [1, -1]), "invalid price: -1"),
+            ((["TEA", "TEA"], [buy, buy], [1, 1], [1]), "columns differ in length"),
+            ]
+
+        for args, err in cases:
+            self.assertRaisesRegex(Error, err, self.market.record_trades, *args)
+
+        self.assertEqual(self.market.get_trades("TEA"), [])
+        self.assertEqual(self.market.record_trades([], [], [], []), range(0))
+
+    def test_load_trades(self):
+        """ test storing trades with existing ids and timestamps """
+        self.market.load_trades(
+            "TEA", [7, 3, 5], [0, 1, 0], [10, 20, 30], [1, 2, 3], [30, 10, 20]
+            )
+        self.market.load_trades("TEA", [], [], [], [], [])
+
+        self.assertEqual(self.market.get_trades("TEA"), [
+            Trade(3, "TEA", Trade.SELL, 20, 2, 10),
+            Trade(5, "TEA", Trade.BUY, 30, 3, 20),
+            Trade(7, "TEA", Trade.BUY, 10, 1, 30),
+            ])
+        self.assertEqual(self.market.calculate_vwsp("TEA", (0, 25)), 130 / 50)
+        self.assertRaisesRegex(Error, "unknown stock: 'FOO'",
+                               self.market.load_trades, "FOO", [1], [0], [1],
+                               [1], [1])
+
     def test_get_trades(self):
         """ test fetching recorded trades by stock """
         self.record_trades()
@@ -277,6 +986,60 @@ class MarketTests(TestBase):
             [self.tea_trade_1, self.tea_trade_2]
             )
 
+    def test_iter_trades(self):
+        """ test iterating over trades a chunk at a time gives the same trades
+        as get_trades, including where chunks end between trades at the same
+        time """
+        self.record_trades(True)
+        self.mock_time(self.t2)
+        self.market.record_trades(["TEA"] * 5, [0] * 5, [1] * 5, [100] * 5)
+        market = self.market
+
+        for period in (None, (2 * self.t1, self.t2 + 1), (self.t2, 2 * self.t2)):
+            expected = market.get_trades("TEA", period)
+
+            for chunk_size in (1, 2, 3, 100):
+                self.assertEqual(
+                    list(market.iter_trades("TEA", period, chunk_size)),
+                    expected
+                    )
+
+        self.assertEqual(list(market.iter_trades("FOO")), [])
+
+    def test_iter_trades_while_recording(self):
+        """ test trades recorded while iterating are seen, and iterating
+        carries on from the right place when earlier trades are evicted """
+        market = self.create_market(retention=10)
+        market.add_stock(self.tea)
+        trades = []
+
+        for t in range(10):
+            self.mock_time(t)
+            trades.append(market.record_trade("TEA", Trade.BUY, 1, 100))
+
+        iterator = market.iter_trades("TEA", chunk_size=3)
+        self.assertEqual([next(iterator) for _ in range(3)], trades[:3])
+
+        # evicts trades before 5, including ones not yet iterated over
+        self.mock_time(15)
+        trades.append(market.record_trade("TEA", Trade.BUY, 1, 100))
+        self.assertEqual(list(iterator), trades[5:])
+
+    def test_iter_tape(self):
+        """ test trades for all stocks are merged in time order """
+        self.record_trades(True)
+        self.mock_time(self.t2)
+        self.market.record_trades(["POP", "TEA"], [0, 0], [1, 1], [100, 100])
+        trades = [trade for stock in ("TEA", "POP")
+                  for trade in self.market.get_trades(stock)]
+        expected = sorted(trades, key=lambda t: (t.get_timestamp(), t.get_id()))
+
+        self.assertEqual(list(self.market.iter_tape(chunk_size=2)), expected)
+        self.assertEqual(
+            list(self.market.iter_tape(["POP"], (2 * self.t1, self.t2))),
+            [self.pop_trade_1, self.pop_trade_2]
+            )
+
     def test_volume_weighted_stock_price(self):
         """ test volume weighted stock price calculation """
 
@@ -356,6 +1119,1292 @@ class MarketTests(TestBase):
 
         self.assertEqual(self.market.calculate_gbce_asi(), exp)
 
+    def test_gbce_all_share_index_moving_window(self):
+        """ test incrementally maintained index matches calculating it from
+        scratch as time moves on and trades enter and leave the window """
+        rand = random.Random(0)
+        stocks = ["TEA", "POP", "ALE", "GIN", "JOE"]
+        window = 300 * (10 ** 6)
+        now = 0
+
+        for _ in range(500):
+            now += rand.choice([1, 10 ** 3, 10 ** 6, 10 ** 8])
+            self.mock_time(now)
+
+            if rand.random() < 0.7:
+                self.market.record_trade(
+                    rand.choice(stocks),
+                    Trade.BUY,
+                    rand.randint(1, 100),
+                    rand.randint(1, 200)
+                    )
+
+            exp = self.market.calculate_gbce_asi((now - window, now))
+            actual = self.market.calculate_gbce_asi()
+
+            if exp is None:
+                self.assertEqual(actual, None)
+            else:
+                self.assertAlmostEqual(actual / exp, 1)
+
+    def test_gbce_all_share_index_clock_goes_backwards(self):
+        """ test index is recalculated if the clock goes backwards """
+        self.record_trades(True)
+        self.mock_time(self.t2)
+        self.assertAlmostEqual(self.market.calculate_gbce_asi(), 12500 ** 0.5)
+        self.mock_time(3 * self.t1)
+        self.assertAlmostEqual(self.market.calculate_gbce_asi(), 100)
+
+    def test_gbce_all_share_index_overflow(self):
+        """ test index of many highly priced stocks does not overflow """
+        now = self.t2
+        self.mock_time(now)
+
+        for i in range(1000):
+            name = "S%03d" % i
+            self.market.add_stock(Stock(name, 0, 100))
+            self.market.record_trade(name, Trade.BUY, 1, 10 ** 6)
+
+        self.mock_time(now + 1)
+        period = (now, now + 1)
+        self.assertAlmostEqual(
+            self.market.calculate_gbce_asi(period) / 10 ** 6, 1
+            )
+        self.assertAlmostEqual(self.market.calculate_gbce_asi() / 10 ** 6, 1)
+
+    def test_retention_index(self):
+        """ test the index for the default period drops stocks whose trades
+        have been evicted, with retention shorter than five minutes """
+        market = self.create_market(retention=100)
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+
+        self.mock_time(0)
+        market.record_trade("TEA", Trade.BUY, 1, 200)
+        self.mock_time(1)
+        self.assertAlmostEqual(market.calculate_gbce_asi(), 200)
+
+        self.mock_time(150)
+        market.record_trade("POP", Trade.BUY, 1, 400)
+        self.mock_time(151)
+
+        self.assertEqual(market.get_trades("TEA"), [])
+        self.assertAlmostEqual(market.calculate_gbce_asi(), 400)
+        self.assertAlmostEqual(
+            market.calculate_gbce_asi((151 - 300 * 10 ** 6, 151)), 400
+            )
+
+    def test_retention(self):
+        """ test trades older than the retention period are evicted """
+        archived = []
+        market = self.create_market(
+            retention=10,
+            archiver=lambda stock, trades: archived.extend(trades)
+            )
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        trades = []
+
+        self.mock_time(0)
+        pop_trade = market.record_trade("POP", Trade.BUY, 1, 100)
+
+        for t in range(40):
+            self.mock_time(t)
+            trades.append(market.record_trade("TEA", Trade.BUY, 1, 100))
+
+        # at most twice the retention period is held, and no more than that
+        # is evicted
+        tea_trades = market.get_trades("TEA")
+        self.assertEqual(tea_trades, trades[-len(tea_trades):])
+        self.assertEqual(
+            sorted(archived + tea_trades, key=Trade.get_id),
+            [pop_trade] + trades
+            )
+        self.assertLessEqual(len(tea_trades), 20)
+        self.assertGreaterEqual(len(tea_trades), 10)
+
+        # stock no longer trading is evicted too
+        self.assertEqual(market.get_trades("POP"), [])
+        self.assertIn(pop_trade, archived)
+
+        market.evict(40)
+        self.assertEqual(market.get_trades("TEA"), trades[-10:])
+
+
+    def test_stats(self):
+        """ test metrics are only collected once enabled, and trades held are
+        always reported """
+        market = self.create_market()
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        self.mock_time(self.t1)
+        market.record_trade("TEA", Trade.BUY, 1, 100)
+
+        stats = market.stats()
+        self.assertEqual(stats["calls"], {})
+        self.assertEqual(stats["trades"], 1)
+        self.assertEqual(stats["trades_per_stock"], {"TEA": 1, "POP": 0})
+        self.assertGreater(stats["memory_bytes"], 0)
+
+        market.enable_metrics()
+        market.record_trade("TEA", Trade.BUY, 1, 100)
+        market.record_trades(["POP", "TEA"], [0, 1], [1, 2], [100, 100])
+        self.assertEqual(len(market.get_trades("TEA", (0, self.t2))), 3)
+        market.calculate_gbce_asi()
+
+        stats = market.stats()
+        self.assertEqual(stats["calls"]["record_trade"], 1)
+        self.assertEqual(stats["calls"]["record_trades"], 1)
+        self.assertEqual(stats["calls"]["get_trades"], 1)
+        self.assertEqual(stats["calls"]["calculate_gbce_asi"], 1)
+        self.assertEqual(stats["latency"]["get_trades"]["buckets"][-1],
+                         (float("inf"), 1))
+        self.assertEqual(stats["rows_returned"], 3)
+        self.assertGreaterEqual(stats["rows_scanned"], 3)
+        self.assertEqual(stats["trades_per_stock"], {"TEA": 3, "POP": 1})
+
+        market.disable_metrics()
+        market.get_trades("TEA")
+        self.assertNotIn("get_trades", vars(market))
+        self.assertEqual(market.stats()["calls"], {})
+
+    def test_bars(self):
+        """ test bars kept as trades are recorded match bars made from the
+        stored trades, including a batch and a trade after the clock has gone
+        backwards """
+        market = self.create_market(bar_resolutions=[100, 10])
+        market.add_stock(self.tea)
+        rand = random.Random(0)
+
+        for t in [0, 1, 9, 10, 25, 25, 99, 100, 101, 250, 180, 251]:
+            self.mock_time(t)
+            market.record_trade("TEA", rand.randint(0, 1), rand.randint(1, 9),
+                                rand.randint(1, 200))
+
+        self.mock_time(260)
+        market.record_trades(["TEA"] * 3, [0] * 3, [1, 2, 3], [50, 60, 40])
+        trades = market.get_trades("TEA")
+
+        for resolution in (10, 100):
+            expected = make_bars(trades, resolution)
+            self.assertEqual(market.get_bars("TEA", resolution), expected)
+            self.assertEqual(
+                market.get_bars("TEA", resolution, (100, 200)),
+                [bar for bar in expected if 100 <= bar.get_start() < 200]
+                )
+
+        self.assertEqual(market.get_bars("FOO", 10), [])
+        self.assertRaisesRegex(Error, "unknown resolution: 60",
+                               market.get_bars, "TEA", 60)
+        self.assertRaisesRegex(Error, "invalid resolution: 0",
+                               self.create_market, bar_resolutions=[0])
+
+    def test_bars_invalid(self):
+        """ test a trade that doesn't fit the bars is rejected before it is
+        stored """
+        market = self.create_market(bar_resolutions=[10])
+        market.add_stock(self.tea)
+        self.mock_time(5)
+
+        self.assertRaisesRegex(Error, "invalid trade", market.record_trade,
+                               "TEA", Trade.BUY, 1, 10 ** 400)
+        self.assertRaisesRegex(Error, "invalid trade", market.record_trades,
+                               ["TEA"], [Trade.BUY], [1], [10 ** 400])
+        self.assertEqual(market.get_trades("TEA"), [])
+
+        market.record_trade("TEA", Trade.BUY, 2, 100)
+        trades = market.get_trades("TEA")
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(market.get_bars("TEA", 10), make_bars(trades, 10))
+        self.assertEqual(market.calculate_vwsp("TEA", (0, 10)), 100)
+
+    def test_bars_retention(self):
+        """ test bars are evicted with the trades in them """
+        market = self.create_market(retention=100, bar_resolutions=[10])
+        market.add_stock(self.tea)
+
+        for t in range(0, 300, 5):
+            self.mock_time(t)
+            market.record_trade("TEA", Trade.BUY, 1, 100)
+
+        market.evict(300)
+        bars = market.get_bars("TEA", 10)
+        self.assertEqual([bar.get_start() for bar in bars],
+                         list(range(200, 300, 10)))
+
+    def test_quantiles(self):
+        """ test price and size quantiles of trades recorded one at a time
+        and in a batch over the default window and a given period """
+        market = self.create_market(sketch_resolution=10, retention=1000)
+        market.add_stock(self.tea)
+
+        for t in range(0, 400, 4):
+            self.mock_time(t)
+            market.record_trade("TEA", Trade.BUY, 1 + t % 10, 100 + t // 4)
+
+        self.mock_time(400)
+        market.record_trades(["TEA"] * 3, [Trade.SELL] * 3, [1, 2, 3],
+                             [10, 300, 20])
+        self.mock_time(500)
+
+        self.assertEqual(market.get_quantiles("TEA", [0, 0.5, 1]), {
+            "price": [10, 149, 300],
+            "quantity": [1, 5, 9],
+            })
+        self.assertEqual(market.get_quantiles("TEA", period=(100, 200)), {
+            "price": [125, 137, 149],
+            "quantity": [1, 5, 9],
+            })
+        self.assertIsNone(market.get_quantiles("TEA", period=(410, 500)))
+        self.assertIsNone(market.get_quantiles("FOO"))
+        self.assertRaisesRegex(Error, "quantile sketches are not kept",
+                               self.market.get_quantiles, "TEA")
+
+    def test_top(self):
+        """ test top and bottom stocks by each ranking match ranking every
+        stock's trades, as the window moves forward and back """
+        market = self.create_market()
+        minute = 60 * 10 ** 6
+        stocks = [self.tea, self.pop, self.ale, self.gin, self.joe]
+        names = [stock.get_name() for stock in stocks]
+        rand = random.Random(0)
+
+        for stock in stocks:
+            market.add_stock(stock)
+
+        for t in sorted(rand.sample(range(0, 30 * minute, 1000), 300)):
+            self.mock_time(t)
+            market.record_trade(rand.choice(names), Trade.BUY,
+                                rand.randint(1, 10), rand.randint(1, 200))
+
+        def vwsp(trades):
+            return sum(trade.get_total_amount() for trade in trades) / \
+                sum(trade.get_quantity() for trade in trades)
+
+        def expected(now):
+            values = {"volume": {}, "trades": {}, "vwsp_change": {}}
+
+            for name in names:
+                trades = market.get_trades(name, (now - 5 * minute, now))
+                before = market.get_trades(name, (now - 10 * minute,
+                                                  now - 5 * minute))
+
+                if trades:
+                    values["volume"][name] = sum(trade.get_quantity()
+                                                 for trade in trades)
+                    values["trades"][name] = len(trades)
+
+                    if before:
+                        values["vwsp_change"][name] = \
+                            vwsp(trades) / vwsp(before) - 1
+
+            return values
+
+        for now in [0, 7 * minute, 12 * minute, 12 * minute + 1, 29 * minute,
+                    40 * minute, 11 * minute]:
+            values = expected(now)
+
+            for by, stock_values in values.items():
+                ranked = sorted(stock_values.items(),
+                                key=lambda item: (-item[1], item[0]))
+
+                for n, ascending in ((3, False), (10, False), (2, True)):
+                    top = market.get_top(by, n, ascending, now=now)
+                    ranking = ranked[::-1] if ascending else ranked
+                    self.assertEqual([name for name, _ in top],
+                                     [name for name, _ in ranking[:n]])
+
+                    for (_, value), (_, expected_value) in zip(top, ranking):
+                        self.assertAlmostEqual(value, expected_value)
+
+        self.mock_time(12 * minute)
+        market.record_trade("JOE", Trade.BUY, 10 ** 4, 100)
+        self.mock_time(12 * minute + 1)
+        volume = expected(12 * minute + 1)["volume"]["JOE"]
+        self.assertGreater(volume, 10 ** 4)
+        self.assertEqual(market.get_top("volume", 1), [("JOE", volume)])
+        self.assertEqual(market.get_top("volume", 0), [])
+        self.assertRaisesRegex(Error, "unknown ranking: price",
+                               market.get_top, "price")
+
+    def test_rolling(self):
+        """ test rolling vwsp and index series match calculating each sample
+        separately, for windows longer and shorter than the step """
+        market = self.create_market()
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        market.add_stock(self.gin)
+        rand = random.Random(0)
+
+        for t in sorted(rand.sample(range(1000), 60)):
+            self.mock_time(t)
+            market.record_trade(rand.choice(["TEA", "POP"]), Trade.BUY,
+                                rand.randint(1, 9), rand.randint(0, 200))
+
+        self.mock_time(500)
+        market.record_trades(["TEA", "POP"], [0, 0], [5, 5], [10, 20])
+
+        for start, end, step, window in [(-50, 1100, 7, 30), (0, 1000, 50, 5),
+                                         (995, 1000, 1, 1000)]:
+            times = range(start, end, step)
+
+            for stock in ("TEA", "POP", "GIN", "FOO"):
+                vwsps = market.rolling_vwsp(stock, start, end, step, window)
+                self.assertEqual(len(vwsps), len(times))
+
+                for t, vwsp in zip(times, vwsps):
+                    expected = market.calculate_vwsp(stock, (t - window, t))
+
+                    if expected is None:
+                        self.assertTrue(math.isnan(vwsp))
+                    else:
+                        self.assertAlmostEqual(vwsp, expected)
+
+            index = market.rolling_gbce_asi(start, end, step, window)
+            self.assertEqual(len(index), len(times))
+
+            for t, value in zip(times, index):
+                expected = market.calculate_gbce_asi((t - window, t))
+
+                if expected is None:
+                    self.assertTrue(math.isnan(value))
+                else:
+                    self.assertAlmostEqual(value, expected)
+
+        self.assertEqual(len(market.rolling_gbce_asi(10, 0, 1)), 0)
+        self.assertRaisesRegex(Error, "invalid step: 0",
+                               market.rolling_vwsp, "TEA", 0, 10, 0)
+
+class ColumnarMarketTests(MarketTests):
+    """ repeat market tests with trades stored in typed arrays """
+
+    def create_market(self, **kwargs):
+        return Market(columnar=True, **kwargs)
+
+    def test_record_trades_unstorable(self):
+        """ test no trades are recorded, nor ids taken, if any quantity in the
+        batch doesn't fit columnar storage """
+        buy = Trade.BUY
+
+        for quantity in (1.5, 2 ** 63):
+            self.assertRaisesRegex(Error, "invalid trade",
+                                   self.market.record_trades, ["TEA", "POP"],
+                                   [buy, buy], [10, quantity], [100, 100])
+            self.assertRaisesRegex(Error, "invalid trade",
+                                   self.market.record_trade, "POP", buy,
+                                   quantity, 100)
+
+        self.assertEqual(self.market.get_trades("TEA"), [])
+        self.assertEqual(self.market.get_trades("POP"), [])
+        self.assertEqual(self.market.record_trades(["TEA"], [buy], [1], [1]),
+                         range(0, 1))
+
+
+class ConcurrentMarketTests(MarketTests):
+    """ repeat market tests in concurrent mode, and test recording trades and
+    reading from many threads at once """
+
+    def create_market(self, **kwargs):
+        return Market(concurrent=True, **kwargs)
+
+    def test_concurrent_stress(self):
+        """ test trades recorded from many threads are all stored, with unique
+        ids and consistent totals, while other threads read the market """
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+
+        stocks = ["TEA", "POP", "ALE", "GIN", "JOE"]
+        n_writers, n_trades = 8, 1000
+        done = threading.Event()
+        errors = []
+
+        def write(seed):
+            rand = random.Random(seed)
+
+            try:
+                for i in range(n_trades):
+                    stock = rand.choice(stocks)
+                    quantity, price = rand.randint(1, 10), rand.randint(1, 10)
+
+                    if i % 2:
+                        self.market.record_trade(stock, 0, quantity, price)
+                    else:
+                        self.market.record_trades(
+                            [stock], [Trade.SELL], [quantity], [price]
+                            )
+
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                while not done.is_set():
+                    for stock in stocks:
+                        self.market.calculate_vwsp(stock)
+                        self.market.get_trades(stock, (0, 1))
+
+                    self.market.calculate_gbce_asi()
+
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=write, args=(i,))
+                   for i in range(n_writers)]
+        readers = [threading.Thread(target=read) for _ in range(2)]
+
+        for thread in writers + readers:
+            thread.start()
+
+        for thread in writers:
+            thread.join()
+
+        done.set()
+
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+        trades = []
+
+        for stock in stocks:
+            stock_trades = self.market.get_trades(stock)
+            timestamps = [trade.get_timestamp() for trade in stock_trades]
+            self.assertEqual(timestamps, sorted(timestamps))
+
+            amount = sum(trade.get_total_amount() for trade in stock_trades)
+            quantity = sum(trade.get_quantity() for trade in stock_trades)
+            self.assertEqual(
+                self.market.calculate_vwsp(stock, (0, timestamps[-1] + 1)),
+                float(amount) / quantity
+                )
+
+            trades.extend(stock_trades)
+
+        trade_ids = sorted(trade.get_id() for trade in trades)
+        self.assertEqual(trade_ids, list(range(n_writers * n_trades)))
+
+    def test_archiver_reentrant(self):
+        """ test the archiver may query the market for the stocks being
+        evicted without deadlocking """
+        vwsps = []
+        market = self.create_market(
+            retention=10,
+            archiver=lambda stock, trades: vwsps.append(
+                market.calculate_vwsp(stock, (0, 100)))
+            )
+        market.add_stock(self.tea)
+
+        def record():
+            for t in range(40):
+                self.mock_time(t)
+                market.record_trade("TEA", Trade.BUY, 1, 100)
+
+            market.evict(100)
+
+        thread = threading.Thread(target=record, daemon=True)
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertIn(100, vwsps)
+
+    def test_read_while_writing(self):
+        """ test reads of the index and rankings for now finish promptly
+        while writers keep recording trades for many stocks """
+        market = self.create_market()
+        names = ["S%04d" % i for i in range(2000)]
+        done = threading.Event()
+        errors = []
+
+        for name in names:
+            market.add_stock(Stock(name, 8, 100))
+
+        def write(seed):
+            rand = random.Random(seed)
+
+            try:
+                while not done.is_set():
+                    market.record_trade(rand.choice(names), Trade.BUY,
+                                        rand.randint(1, 10), 100)
+
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=write, args=(i,))
+                   for i in range(2)]
+
+        for thread in writers:
+            thread.start()
+
+        try:
+            for _ in range(20):
+                start = time.perf_counter()
+                market.calculate_gbce_asi()
+                self.assertLess(time.perf_counter() - start, 1.0)
+                start = time.perf_counter()
+                market.get_top("volume")
+                self.assertLess(time.perf_counter() - start, 1.0)
+
+        finally:
+            done.set()
+
+            for thread in writers:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertAlmostEqual(market.calculate_gbce_asi(), 100)
+
+
+class ShardedMarketTests(MarketTests):
+    """ repeat market tests with stocks split between worker processes """
+
+    def create_market(self, **kwargs):
+        market = ShardedMarket(shards=2, batch_size=2, **kwargs)
+        self.addCleanup(market.close)
+        return market
+
+    def test_retention(self):
+        """ test trades older than the retention period are evicted, by the
+        worker processes so without checking what is archived """
+        market = self.create_market(retention=10)
+        market.add_stock(self.tea)
+        trades = []
+
+        for t in range(40):
+            self.mock_time(t)
+            trades.append(market.record_trade("TEA", Trade.BUY, 1, 100))
+
+        tea_trades = market.get_trades("TEA")
+        self.assertEqual(tea_trades, trades[-len(tea_trades):])
+        self.assertLessEqual(len(tea_trades), 20)
+
+        market.evict(40)
+        self.assertEqual(market.get_trades("TEA"), trades[-10:])
+
+    def test_journal(self):
+        """ test trades recorded are journaled before they are sent to the
+        workers, within the journal's limits """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "trades.jnl")
+
+        with Journal(path, fsync=False) as journal:
+            market = self.create_market(journal=journal)
+            market.add_stock(self.tea)
+            market.add_stock(self.pop)
+            self.mock_time(10)
+            market.record_trade("TEA", Trade.BUY, 1, 100)
+            market.record_trades(["TEA", "POP"], [0, 1], [2, 3], [101, 102])
+            self.assertRaisesRegex(Error, "invalid trade", market.record_trade,
+                                   "TEA", Trade.BUY, 1.5, 100)
+
+        restored = Market()
+        restored.add_stock(self.tea)
+        restored.add_stock(self.pop)
+        self.assertEqual(restore(restored, path), 3)
+
+        for stock in ("TEA", "POP"):
+            self.assertEqual(restored.get_trades(stock),
+                             market.get_trades(stock))
+
+    def test_subscribe(self):
+        """ test subscriptions are not supported """
+        self.assertRaisesRegex(Error, "not supported",
+                               self.market.subscribe_vwsp, "TEA", print)
+        self.assertRaisesRegex(Error, "not supported",
+                               self.market.subscribe_gbce_asi, print)
+
+    def test_worker_error(self):
+        """ test errors in workers are raised in the parent """
+        self.assertRaisesRegex(TypeError, "missing", self.market._gather,
+                               "get_trades")
+
+
+class MetricsTests(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.market = Market(metrics=True)
+        self.market.add_stock(self.tea)
+        self.market.add_stock(Stock('Q"T', 0, 100))
+        self.mock_time(10)
+        self.market.record_trade("TEA", Trade.BUY, 1, 100)
+        self.market.get_trades("TEA")
+
+    def test_format_prometheus(self):
+        """ test metrics are formatted as Prometheus text """
+        text = format_prometheus(self.market.stats())
+        lines = text.splitlines()
+        self.assertIn("# TYPE sssm_latency_seconds histogram", lines)
+        self.assertIn('sssm_calls_total{method="record_trade"} 1', lines)
+        self.assertIn(
+            'sssm_latency_seconds_bucket{method="get_trades",le="+Inf"} 1',
+            lines
+            )
+        self.assertIn('sssm_latency_seconds_count{method="get_trades"} 1',
+                      lines)
+        self.assertIn("sssm_rows_returned_total 1", lines)
+        self.assertIn('sssm_trades{stock="TEA"} 1', lines)
+        self.assertIn('sssm_trades{stock="Q\\"T"} 0', lines)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_dump_metrics(self):
+        """ test metrics are written to a file and sent to a socket """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        expected = format_prometheus(self.market.stats()).encode()
+
+        path = os.path.join(directory.name, "sssm.prom")
+        self.market.dump_metrics(path)
+
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+        path = os.path.join(directory.name, "sssm.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(path)
+        listener.listen(1)
+        self.market.dump_metrics(path)
+        conn, _ = listener.accept()
+
+        with conn:
+            received = b"".join(iter(lambda: conn.recv(4096), b""))
+
+        self.assertEqual(received, expected)
+
+class ResultCacheTests(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.cache = ResultCache(max_size=4, snap=1000)
+        self.market = Market(cache=self.cache)
+        self.market.add_stock(self.tea)
+        self.market.add_stock(self.pop)
+        self.mock_time(10 ** 6)
+        self.market.record_trade("TEA", Trade.BUY, 10, 100)
+        self.market.record_trade("POP", Trade.BUY, 10, 200)
+        self.period = (0, 2 * 10 ** 6)
+
+    def hits(self):
+        return self.cache.stats()["hits"]
+
+    def test_invalidation(self):
+        """ test results are cached until the trades they read change """
+        market = self.market
+        self.assertEqual(market.calculate_vwsp("TEA", self.period), 100)
+        self.assertEqual(market.calculate_vwsp("TEA", self.period), 100)
+        self.assertEqual(self.hits(), 1)
+
+        # the index is cached as one result, not one per stock, and a trade
+        # for another stock only invalidates the index
+        market.calculate_gbce_asi(self.period)
+        self.assertEqual(len(self.cache), 2)
+        market.record_trade("POP", Trade.BUY, 10, 300)
+        self.assertEqual(market.calculate_vwsp("TEA", self.period), 100)
+        self.assertEqual(self.hits(), 2)
+        self.assertEqual(market.calculate_gbce_asi(self.period),
+                         (100 * 250) ** 0.5)
+
+        market.record_trade("TEA", Trade.BUY, 10, 200)
+        self.assertEqual(market.calculate_vwsp("TEA", self.period), 150)
+
+        stats = market.stats()["cache"]
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 4)
+
+    def test_default_window(self):
+        """ test the default window is cached by time bucket """
+        market = self.market
+        self.mock_time(10 ** 6 + 100)
+        asi = market.calculate_gbce_asi()
+        self.assertAlmostEqual(asi, (100 * 200) ** 0.5)
+        self.mock_time(10 ** 6 + 999)
+        self.assertEqual(market.calculate_gbce_asi(), asi)
+        self.assertEqual(self.hits(), 1)
+
+        self.mock_time(10 ** 6 + 1000)
+        market.calculate_gbce_asi()
+        market.calculate_vwsp("TEA")
+        self.assertEqual(market.calculate_vwsp("POP"), 200)
+        self.assertEqual(self.hits(), 1)
+
+        # only results for POP are recalculated when it trades
+        market.record_trade("POP", Trade.BUY, 10, 400)
+        self.mock_time(10 ** 6 + 1500)
+        self.assertEqual(market.calculate_vwsp("TEA"), 100)
+        self.assertEqual(market.calculate_vwsp("POP"), 300)
+        self.assertEqual(self.hits(), 2)
+
+    def test_eviction(self):
+        """ test least recently used and expired results are evicted """
+        market = self.market
+        periods = [(0, t * 10 ** 6) for t in range(2, 7)]
+
+        for period in periods:
+            market.calculate_vwsp("TEA", period)
+
+        self.assertEqual(len(self.cache), 4)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+        market.calculate_vwsp("TEA", periods[0])
+        self.assertEqual(self.hits(), 0)
+
+        now = [0]
+        cache = ResultCache(ttl=10 ** 6)
+        cache._clock = lambda: now[0]
+        cache.put("key", 1, "value")
+        now[0] = 5 * 10 ** 5
+        self.assertEqual(cache.get("key", 1), (True, "value"))
+        self.assertEqual(cache.get("key", 2), (False, None))
+        now[0] = 10 ** 6
+        self.assertEqual(cache.get("key", 1), (False, None))
+
+class JournalTests(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "trades.jnl")
+
+    def create_market(self, **kwargs):
+        market = Market(**kwargs)
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        return market
+
+    def test_restore(self):
+        """ test trades journaled by a market are restored, in small and large
+        blocks, into markets storing trades either way """
+
+        with Journal(self.path, commit_every=50, fsync=False) as journal:
+            market = self.create_market(journal=journal)
+
+            for i in range(100):
+                self.mock_time(i)
+                market.record_trade(["TEA", "POP"][i % 3 == 0], i % 2, i + 1,
+                                    100 + i)
+
+            self.mock_time(100)
+            market.record_trades(["TEA", "POP"], [0, 1], [5, 6], [7, 8.5])
+
+        for columnar in (False, True):
+            reset_auto_increment()
+            restored = self.create_market(columnar=columnar)
+            self.assertEqual(restore(restored, self.path), 102)
+
+            for stock in ("TEA", "POP"):
+                self.assertEqual(restored.get_trades(stock),
+                                 market.get_trades(stock))
+
+            self.assertEqual(auto_increment(), 102)
+
+    def test_commit(self):
+        """ test trades are only written once committed """
+        journal = Journal(self.path, commit_every=3, fsync=False)
+        self.addCleanup(journal.close)
+
+        def restored_count():
+            reset_auto_increment()
+            return restore(self.create_market(), self.path)
+
+        journal.append(Trade(0, "TEA", Trade.BUY, 1, 1, 1))
+        journal.append(Trade(1, "TEA", Trade.BUY, 1, 1, 1))
+        self.assertEqual(restored_count(), 0)
+        journal.extend("POP", [2, 3], [0, 0], [1, 1], [1, 1], [2, 2])
+        self.assertEqual(restored_count(), 4)
+        journal.append(Trade(4, "TEA", Trade.BUY, 1, 1, 1))
+        journal.commit()
+        self.assertEqual(restored_count(), 5)
+
+    def test_commit_interval(self):
+        """ test buffered trades are committed once the commit interval has
+        passed, without any more trades being journaled """
+        journal = Journal(self.path, commit_every=1000, commit_interval=0.05,
+                          fsync=False)
+        self.addCleanup(journal.close)
+        journal.append(Trade(0, "TEA", Trade.BUY, 1, 1, 1))
+        deadline = time.monotonic() + 5
+
+        while journal._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(restore(self.create_market(), self.path), 1)
+        journal.close()
+        self.assertFalse(journal._committer.is_alive())
+
+    def test_reopen_torn_magic(self):
+        """ test a journal left with only part of its magic bytes is reopened
+        as empty, and a file that isn't a journal is refused """
+
+        with open(self.path, "wb") as f:
+            f.write(b"SSS")
+
+        with Journal(self.path, fsync=False) as journal:
+            journal.append(Trade(0, "TEA", Trade.BUY, 1, 1, 1))
+
+        self.assertEqual(restore(self.create_market(), self.path), 1)
+
+        with open(self.path, "wb") as f:
+            f.write(b"XYZ")
+
+        self.assertRaisesRegex(Error, "not a journal", Journal, self.path)
+
+    def test_restore_torn_write(self):
+        """ test a partly written block at the end of the journal is ignored
+        """
+
+        with Journal(self.path, fsync=False) as journal:
+            journal.extend("TEA", range(40), [0] * 40, [1] * 40, [1] * 40,
+                           range(40))
+            journal.commit()
+            journal.extend("TEA", range(40, 50), [0] * 10, [1] * 10, [1] * 10,
+                           range(40, 50))
+
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 10)
+
+        market = self.create_market()
+        self.assertEqual(restore(market, self.path), 40)
+        self.assertEqual(market.get_trades("TEA")[-1].get_id(), 39)
+
+    def test_reopen_torn_write(self):
+        """ test a partly written block at the end of the journal is
+        truncated when it is reopened, so trades journaled afterwards are
+        restored """
+
+        with Journal(self.path, fsync=False) as journal:
+            market = self.create_market(journal=journal)
+
+            for i in range(3):
+                market.record_trade("TEA", Trade.BUY, 1, 100)
+
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 5)
+
+        with Journal(self.path, fsync=False) as journal:
+            market = self.create_market(journal=journal)
+            self.assertEqual(restore(market, self.path), 2)
+
+            for i in range(5):
+                market.record_trade("TEA", Trade.BUY, 1, 100)
+
+        restored = self.create_market()
+        self.assertEqual(restore(restored, self.path), 7)
+        self.assertEqual(restored.get_trades("TEA"), market.get_trades("TEA"))
+
+    def test_record_unstorable(self):
+        """ test a market journaling trades rejects a trade or batch that
+        doesn't fit the journal before journaling or storing any of it """
+
+        with Journal(self.path, fsync=False) as journal:
+            market = self.create_market(journal=journal)
+            self.assertRaisesRegex(Error, "invalid trade",
+                                   market.record_trade, "TEA", Trade.BUY, 1.5,
+                                   100)
+            self.assertRaisesRegex(Error, "invalid trade",
+                                   market.record_trades, ["TEA", "POP"], [0, 0],
+                                   [10, 1.5], [100, 100])
+            market.record_trade("TEA", Trade.BUY, 1, 100)
+
+        self.assertEqual(len(market.get_trades("TEA")), 1)
+        self.assertEqual(market.get_trades("POP"), [])
+        restored = self.create_market()
+        self.assertEqual(restore(restored, self.path), 1)
+
+    def test_invalid_trade(self):
+        """ test trades that don't fit the journal are rejected without
+        changing the trades buffered for it """
+
+        with Journal(self.path, commit_every=10, fsync=False) as journal:
+            journal.append(Trade(0, "TEA", Trade.BUY, 1, 1, 1))
+            self.assertRaisesRegex(Error, "invalid trade for journal",
+                                   journal.append,
+                                   Trade(1, "TEA", Trade.BUY, 1.5, 1, 1))
+            self.assertRaisesRegex(Error, "invalid trades for journal",
+                                   journal.extend, "TEA", [1, 2], [0, 0],
+                                   [1, 2 ** 64], [1, 1], [1, 1])
+            journal.append(Trade(1, "TEA", Trade.BUY, 2, 1, 1))
+
+        market = self.create_market()
+        self.assertEqual(restore(market, self.path), 2)
+        self.assertEqual([trade.get_quantity()
+                          for trade in market.get_trades("TEA")], [1, 2])
+
+    def test_restore_ids(self):
+        """ test restoring moves the market's id allocator past the ids
+        restored """
+
+        with Journal(self.path, fsync=False) as journal:
+            journal.extend("TEA", range(5), [0] * 5, [1] * 5, [1] * 5,
+                           range(5))
+
+        counter = os.path.join(os.path.dirname(self.path), "ids")
+        market = self.create_market(ids=IdAllocator(FileCounter(counter)))
+        self.assertEqual(restore(market, self.path), 5)
+        self.assertEqual(market.record_trade("TEA", Trade.BUY, 1, 1).get_id(),
+                         5)
+
+    def test_restore_invalid(self):
+        """ test error restoring from a file which is not a journal """
+
+        with open(self.path, "wb") as f:
+            f.write(b"not a journal")
+
+        self.assertRaisesRegex(Error, "not a journal", restore,
+                               self.create_market(), self.path)
+
+
+class BulkTests(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def create_market(self, **kwargs):
+        market = Market(**kwargs)
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        return market
+
+    def record_trades(self, market):
+        for i in range(50):
+            self.mock_time(1000 + i // 2)
+            market.record_trade(["TEA", "POP"][i % 3 == 0], i % 2, i + 1,
+                                100 + i)
+
+    def test_csv(self):
+        """ test trades exported to CSV are loaded in chunks with their ids
+        and timestamps, into markets storing trades either way """
+        market = self.create_market()
+        self.record_trades(market)
+        path = os.path.join(self.directory, "trades.csv")
+        self.assertEqual(export_csv(market.iter_tape(), path), 50)
+
+        for columnar in (False, True):
+            reset_auto_increment()
+            loaded = self.create_market(columnar=columnar)
+            self.assertEqual(load_csv(loaded, path, chunk_size=7), 50)
+
+            for stock in ("TEA", "POP"):
+                self.assertEqual(loaded.get_trades(stock),
+                                 market.get_trades(stock))
+
+            self.assertEqual(auto_increment(), 50)
+
+    def test_csv_ids(self):
+        """ test loading moves the market's id allocator past the ids loaded
+        """
+        f = io.StringIO("id,stock,type,quantity,price,timestamp\n" +
+                        "".join("%d,TEA,0,1,10,%d\n" % (i, i)
+                                for i in range(5)))
+        path = os.path.join(self.directory, "ids")
+        market = self.create_market(ids=IdAllocator(FileCounter(path)))
+        self.assertEqual(load_csv(market, f), 5)
+        self.assertEqual(market.record_trade("TEA", Trade.BUY, 1, 1).get_id(),
+                         5)
+
+    def test_csv_numbers(self):
+        """ test quantities and prices round trip as ints or floats, and a
+        float quantity is only refused by a market that can't store it """
+        market = self.create_market()
+        self.mock_time(10)
+        market.record_trade("TEA", Trade.BUY, 1.5, 100)
+        market.record_trade("TEA", Trade.SELL, 2, 100.5)
+        path = os.path.join(self.directory, "trades.csv")
+        export_csv(market.iter_tape(), path)
+
+        reset_auto_increment()
+        loaded = self.create_market()
+        self.assertEqual(load_csv(loaded, path), 2)
+        trades = loaded.get_trades("TEA")
+        self.assertEqual(trades, market.get_trades("TEA"))
+        self.assertEqual([type(trade.get_quantity()) for trade in trades],
+                         [float, int])
+        self.assertEqual([type(trade.get_price()) for trade in trades],
+                         [int, float])
+
+        self.assertRaisesRegex(Error, "invalid trade", load_csv,
+                               self.create_market(columnar=True), path)
+
+    def test_csv_out_of_order(self):
+        """ test trades out of timestamp order are stored in order """
+        f = io.StringIO("id,stock,type,quantity,price,timestamp\n"
+                        "7,TEA,0,1,10,30\n"
+                        "8,POP,1,2,20.5,10\n"
+                        "9,TEA,1,3,30,20\n")
+        market = self.create_market()
+        self.assertEqual(load_csv(market, f), 3)
+        self.assertEqual([t.get_id() for t in market.get_trades("TEA")],
+                         [9, 7])
+        self.assertEqual(market.get_trades("POP"),
+                         [Trade(8, "POP", Trade.SELL, 2, 20.5, 10)])
+        self.assertEqual(market.calculate_vwsp("TEA", (0, 100)), 25.0)
+
+    def test_csv_invalid(self):
+        """ test invalid files and trades raise Error """
+        market = self.create_market()
+        header = "id,stock,type,quantity,price,timestamp\n"
+
+        for text in ("id,stock,price\n",
+                     header + "1,TEA,0,1,10\n",
+                     header + "1,TEA,0,1,ten,1\n",
+                     header + "1,TEA,0,0,10,1\n",
+                     header + "1,XXX,0,1,10,1\n"):
+            self.assertRaises(Error, load_csv, market, io.StringIO(text))
+
+        self.assertEqual(market.get_trades("TEA"), [])
+        self.assertEqual(load_csv(market, io.StringIO(header)), 0)
+
+    def test_binary(self):
+        """ test trades exported to the binary format are loaded in chunks
+        with their ids and timestamps """
+        market = self.create_market()
+        self.record_trades(market)
+        path = os.path.join(self.directory, "trades.bin")
+        self.assertEqual(export_binary(market.iter_tape(), path, 8), 50)
+        self.assertEqual(export_binary(market.iter_tape(period=(1000, 1010)), path),
+                         20)
+
+        reset_auto_increment()
+        loaded = self.create_market(columnar=True)
+        self.assertEqual(load_binary(loaded, path, chunk_size=3), 20)
+        self.assertEqual(list(loaded.iter_tape()),
+                         list(market.iter_tape(period=(1000, 1010))))
+        self.assertEqual(auto_increment(), 20)
+
+
+class IngestorTests(TestBase):
+
+    def create_market(self, **kwargs):
+        market = Market(**kwargs)
+        market.add_stock(self.tea)
+        market.add_stock(self.pop)
+        return market
+
+    def test_reorder(self):
+        """ test trades arriving out of order within the lateness are stored
+        in timestamp order, and later ones go to the side channel """
+
+        for columnar in (False, True):
+            reset_auto_increment()
+            market = self.create_market(columnar=columnar)
+            ingestor = Ingestor(market, lateness=10)
+            trades = [Trade(i, ["TEA", "POP"][i % 2], Trade.BUY, i + 1, 100 + i,
+                            ts)
+                      for i, ts in enumerate((100, 95, 120, 105, 112, 95, 115))]
+            accepted = [ingestor.submit(trade) for trade in trades]
+
+            self.assertEqual(accepted, [True] * 3 + [False, True, False, True])
+            self.assertEqual(ingestor.watermark, 110)
+            self.assertEqual(len(ingestor), 3)
+            self.assertEqual(market.get_trades("TEA"), [trades[0]])
+            self.assertEqual(market.get_trades("POP"), [trades[1]])
+            self.assertEqual(ingestor.late_trades, [trades[3], trades[5]])
+
+            ingestor.flush()
+            self.assertEqual(ingestor.watermark, 120)
+            self.assertEqual(len(ingestor), 0)
+            self.assertEqual(market.get_trades("TEA"),
+                             [trades[0], trades[4], trades[6], trades[2]])
+            self.assertEqual(market.get_trades("POP"), [trades[1]])
+            self.assertEqual(auto_increment(), 7)
+
+    def test_journal(self):
+        """ test trades ingested into a market with a journal are journaled,
+        so they are restored after a restart """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "trades.jnl")
+        trades = [Trade(i, ["TEA", "POP"][i % 2], Trade.BUY, i + 1, 100 + i,
+                        ts)
+                  for i, ts in enumerate((100, 95, 120, 112, 115))]
+
+        with Journal(path, fsync=False) as journal:
+            market = self.create_market(journal=journal)
+            ingestor = Ingestor(market, lateness=10, batch_size=2)
+            self.assertEqual(ingestor.extend(trades), 5)
+            ingestor.flush()
+
+        reset_auto_increment()
+        restored = self.create_market()
+        self.assertEqual(restore(restored, path), 5)
+
+        for stock in ("TEA", "POP"):
+            self.assertEqual(restored.get_trades(stock),
+                             market.get_trades(stock))
+
+        self.assertEqual(auto_increment(), 5)
+
+    def test_ids(self):
+        """ test ingesting moves the market's id allocator past the ids
+        loaded """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "ids")
+        market = self.create_market(ids=IdAllocator(FileCounter(path)))
+        ingestor = Ingestor(market, lateness=0)
+        ingestor.extend(Trade(i, "TEA", Trade.BUY, 1, 100, i)
+                        for i in range(5))
+        ingestor.flush()
+        self.assertEqual(market.record_trade("TEA", Trade.BUY, 1, 1).get_id(),
+                         5)
+
+    def test_late_callback(self):
+        """ test late trades are passed to the callback if there is one """
+        late = []
+        ingestor = Ingestor(self.create_market(), lateness=0,
+                            late=late.append)
+        trades = [Trade(i, "TEA", Trade.BUY, 1, 100, ts)
+                  for i, ts in enumerate((10, 10, 9, 11))]
+        self.assertEqual(ingestor.extend(trades), 3)
+        self.assertEqual(late, [trades[2]])
+        self.assertEqual(ingestor.late_trades, [])
+        self.assertRaisesRegex(Error, "unknown stock: 'FOO'", ingestor.submit,
+                               Trade(4, "FOO", Trade.BUY, 1, 100, 12))
+        self.assertRaisesRegex(Error, "invalid lateness", Ingestor,
+                               self.create_market(), -1)
+
+    def test_index(self):
+        """ test the incremental index and vwsp stay correct as trades before
+        the last time the index was read are released """
+        market = self.create_market()
+        ingestor = Ingestor(market, lateness=50)
+        rand = random.Random(0)
+        self.mock_time(1000)
+
+        for i in range(200):
+            ts = 500 + i + rand.randint(-40, 0)
+            ingestor.submit(Trade(i, rand.choice(["TEA", "POP"]), Trade.BUY,
+                                  rand.randint(1, 10), rand.randint(90, 110),
+                                  ts))
+
+            if i % 10 == 0:
+                period = (1000 - 5 * 60 * 10 ** 6, 1000)
+                self.assertAlmostEqual(market.calculate_gbce_asi(),
+                                       market.calculate_gbce_asi(period))
+
+        ingestor.flush()
+        self.assertEqual(len(market.get_trades("TEA")) +
+                         len(market.get_trades("POP")), 200)
+
+        for stock in ("TEA", "POP"):
+            timestamps = [t.get_timestamp() for t in market.get_trades(stock)]
+            self.assertEqual(timestamps, sorted(timestamps))
+
+
+class TradeServerTests(TestBase):
+
+    def run_server(self, lines, **kwargs):
+        """ run server, send given lines from one client and return list of
+        response lines read until the server closes the connection.
+
+        @param lines - list of command lines to send, as str or bytes
+        @param kwargs - passed to TradeServer constructor
+        """
+
+        async def run():
+            self.server = TradeServer(**kwargs)
+            listener = await self.server.start("127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"".join(
+                (line if isinstance(line, bytes) else line.encode()) + b"\n"
+                for line in lines
+                ))
+            writer.write_eof()
+            responses = (await reader.read()).decode().splitlines()
+            writer.close()
+            await self.server.stop()
+            listener.close()
+            await listener.wait_closed()
+            return responses
+
+        return asyncio.run(run())
+
+    def test_commands(self):
+        """ test stock, trade and query commands """
+        clock = iter(range(10 ** 6, 2 * 10 ** 6))
+        utils._micros_since_epoch = lambda: next(clock)
+        responses = self.run_server([
+            "STOCK TEA 0 100",
+            "STOCK GIN 8 100 0.02",
+            "TRADE TEA BUY 100 99",
+            "TRADE TEA SELL 100 102",
+            "TRADE GIN 0 200 100",
+            "VWSP TEA",
+            "VWSP TEA 0 1",
+            "VWSP GIN",
+            "ASI 0 2000000",
+            ])
+
+        exp_asi = str(self.server.market.calculate_gbce_asi((0, 2 * 10 ** 6)))
+        self.assertEqual(responses, ["OK", "OK", "100.5", "None", "100.0",
+                                     exp_asi])
+        self.assertEqual(len(self.server.market.get_trades("TEA")), 2)
+
+    def test_errors(self):
+        """ test invalid commands are answered with an error """
+        responses = self.run_server([
+            "STOCK TEA 0 100",
+            "STOCK TEA 0 100",
+            "TRADE FOO BUY 100 99",
+            "TRADE TEA BUY 0 99",
+            "TRADE TEA BUY x 99",
+            "TRADE TEA",
+            "FOO",
+            b"VWSP \xff",
+            "VWSP TEA",
+            ])
+
+        self.assertEqual(responses, [
+            "OK",
+            "ERROR duplicate stock: 'TEA'",
+            "ERROR unknown stock: 'FOO'",
+            "ERROR invalid quantity: 0",
+            "ERROR invalid literal for int() with base 10: 'x'",
+            "ERROR usage: TRADE stock BUY|SELL quantity price",
+            "ERROR unknown command: FOO",
+            "ERROR 'utf-8' codec can't decode byte 0xff in position 5: "
+            "invalid start byte",
+            "None",
+            ])
+
+    def test_record_error(self):
+        """ test a batch of trades that fails to record is logged and the
+        trades and queries after it are still handled """
+        market = Market()
+        record_trades = market.record_trades
+
+        def fail_once(*columns):
+            market.record_trades = record_trades
+            raise Error("disk full")
+
+        market.record_trades = fail_once
+
+        with self.assertLogs("sssm.server", "ERROR") as logs:
+            responses = self.run_server([
+                "STOCK TEA 0 100",
+                "TRADE TEA BUY 1 99",
+                "TRADE TEA BUY 1 101",
+                "VWSP TEA",
+                ], market=market, batch_size=1)
+
+        self.assertEqual(responses, ["OK", "101.0"])
+        self.assertIn("failed to record 1 trades", logs.output[0])
+
+    def test_backpressure(self):
+        """ test a stream of trades much larger than the queue is recorded """
+        lines = ["STOCK TEA 0 100"]
+        lines.extend("TRADE TEA BUY 1 %d" % (i % 100) for i in range(5000))
+        self.run_server(lines, queue_size=10, batch_size=3)
+        self.assertEqual(len(self.server.market.get_trades("TEA")), 5000)
+
 
 if __name__ == "__main__":
     unittest.main()